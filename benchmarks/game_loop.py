@@ -0,0 +1,220 @@
+"""Time scripted playthroughs of the game loop against the mock model backend
+
+Each blocking turn calls main.generate_next_node_ollama itself, so retries
+and the latency policy's deadlines are part of what is measured, then
+records the turn and saves the session as main.run does. Per-stage times
+come from the metrics spans the real code path records. Saves go to a throwaway
+session store. By default they are queued to the background save writer,
+as the interfaces do, so the "save" stage is what the turn waits for; use
+--sync-save to time full durable saves. The generation cache and story
+graph are disabled, so every turn really generates. Results are printed
+(or written with --output) as JSON.
+
+    python -m benchmarks.game_loop --turns 300
+    python -m benchmarks.game_loop --sessions 4 --turns 200 --malformed-rate 0.1 --output bench.json
+    python -m benchmarks.game_loop --stream --latency 0.2 --tokens-per-sec 40
+    python -m benchmarks.game_loop --turns 300 --sync-save
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import main
+import metrics
+import utils
+from benchmarks.mock_llm import MockModel
+from generation_cache import GenerationCache
+from latency_policy import LatencyPolicy
+from metrics import percentile
+from session_store import SQLiteSessionStore
+from story_data import STORY_TREE
+from story_memory import StoryMemory, record_turn
+
+# Spans recorded by main.generate_next_node_ollama; a stage is sampled in the turns it ran
+SPAN_STAGES = ("cache_lookup", "prompt_build", "generation", "parse", "validate", "cache_store", "fallback")
+STAGES = SPAN_STAGES + ("save",)
+SYNC_SAVE = False  # Set by run_benchmark(sync_save=...)
+
+
+def save_turn(state, memory, choice, node, session_id):
+    """Record the turn and save the session, as main.run does after each choice"""
+    record_turn(state["history"], memory, choice, node)
+    state["current_text"] = node["text"]
+    save = utils.save_game if SYNC_SAVE else utils.queue_save
+    save(session_id, {
+        "current_text": state["current_text"],
+        "history": state["history"],
+        "memory": memory.to_dict(),
+    })
+
+
+def span_totals():
+    """{stage: (count, total seconds)} of the metrics spans recorded so far"""
+    stages = metrics.snapshot()["stages"]
+    return {name: (entry["count"], entry["sum"]) for name, entry in stages.items()}
+
+
+def play_turn(state, memory, choice, story_meta, session_id, timings):
+    """One blocking turn through main.generate_next_node_ollama, timing each stage into `timings`
+
+    A stage's sample is its time summed over every attempt of the turn, so
+    retried generations count in full; backoff pauses only show in "turn".
+    """
+    clock = time.perf_counter
+    before = span_totals()
+    t0 = clock()
+    node = main.generate_next_node_ollama(state["current_text"], choice, state["history"], story_meta, memory)
+    t1 = clock()
+    after = span_totals()
+    for name in SPAN_STAGES:
+        count, total = after.get(name, (0, 0.0))
+        count_before, total_before = before.get(name, (0, 0.0))
+        if count > count_before:
+            timings[name].append(total - total_before)
+
+    save_turn(state, memory, choice, node, session_id)
+    t2 = clock()
+    timings["save"].append(t2 - t1)
+    timings["turn"].append(t2 - t0)
+    return node
+
+
+def stream_turn(state, memory, choice, story_meta, session_id, timings):
+    """One streamed turn as the interfaces play it, timing first text and the whole generation"""
+    clock = time.perf_counter
+    t0 = clock()
+    stream = main.stream_next_node_ollama(state["current_text"], choice, state["history"], story_meta, memory)
+    t1 = clock()
+    first = None
+    for _ in stream:
+        if first is None:
+            first = clock()
+    t2 = clock()
+    timings["prompt_build"].append(t1 - t0)
+    timings["generation"].append(t2 - t1)
+    timings["first_text"].append((first or t2) - t1)
+
+    save_turn(state, memory, choice, stream.node, session_id)
+    t3 = clock()
+    timings["save"].append(t3 - t2)
+    timings["turn"].append(t3 - t0)
+    return stream.node
+
+
+def playthrough(session_id, turns, stream, timings):
+    """Play `turns` turns, cycling through whichever choices each scene offers"""
+    start = STORY_TREE["nodes"]["start"]
+    story_meta = STORY_TREE.get("meta", {})
+    state = {"current_text": start["text"], "history": []}
+    memory = StoryMemory()
+    choices = start["choices"]
+    for turn in range(turns):
+        choice = choices[turn % len(choices)]["text"]
+        play = stream_turn if stream else play_turn
+        node = play(state, memory, choice, story_meta, session_id, timings)
+        choices = node.get("choices") or start["choices"]
+
+
+def summarize(samples):
+    """Count, mean, total and tail percentiles in milliseconds"""
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "max_ms": max(samples) * 1000,
+        "total_s": sum(samples),
+    }
+
+
+def run_benchmark(turns=200, sessions=1, stream=False, latency=0.01, tokens_per_sec=1000,
+                  malformed_rate=0.0, seed=0, sync_save=False):
+    """Run the playthroughs and return the JSON-ready report"""
+    global SYNC_SAVE
+    SYNC_SAVE = sync_save
+    model = MockModel(latency=latency, tokens_per_sec=tokens_per_sec, malformed_rate=malformed_rate, seed=seed)
+    timings = {name: [] for name in STAGES + ("turn",)}
+    if stream:
+        timings["first_text"] = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteSessionStore(os.path.join(tmp, "saves.db"))
+        saved = (main._client, main._cache, main._graph, main.GRAPH_PATH, main._similar, main.SIMILARITY_THRESHOLD,
+                 main._policy, utils._store, metrics.enabled())
+        # No story graph or similarity reuse either: replayed branches would skip generation
+        main._client, main._cache, main._graph, main.GRAPH_PATH = model, GenerationCache([]), None, ""
+        main._similar, main.SIMILARITY_THRESHOLD = None, ""
+        # A fresh policy, so deadlines are learned from this run's model only
+        policy = main._policy = LatencyPolicy(default_timeout=main.OLLAMA_TIMEOUT)
+        utils._store = store
+        metrics.reset()
+        metrics.enable()  # Stage times are read from the spans
+        started = time.perf_counter()
+        try:
+            # Fallback warnings go to stderr so stdout stays machine-readable
+            with contextlib.redirect_stdout(sys.stderr):
+                for i in range(sessions):
+                    playthrough(f"bench-{i}", turns, stream, timings)
+                elapsed = time.perf_counter() - started
+                # Everything queued must be written before the store goes away
+                utils.get_saver().flush()
+            stats = metrics.snapshot()["counters"]
+            saves = utils.get_saver().metrics()
+        finally:
+            (main._client, main._cache, main._graph, main.GRAPH_PATH, main._similar, main.SIMILARITY_THRESHOLD,
+             main._policy, utils._store, enabled) = saved
+            metrics.enable(enabled)
+            store.close()
+
+    total_turns = turns * sessions
+    return {
+        "config": {
+            "turns": turns,
+            "sessions": sessions,
+            "stream": stream,
+            "latency": latency,
+            "tokens_per_sec": tokens_per_sec,
+            "malformed_rate": malformed_rate,
+            "seed": seed,
+            "sync_save": sync_save,
+        },
+        "elapsed_s": elapsed,
+        "turns_per_sec": total_turns / elapsed if elapsed else 0.0,
+        "fallback_rate": stats.get("fallbacks", 0) / total_turns if total_turns else 0.0,
+        "retry_rate": stats.get("retries", 0) / total_turns if total_turns else 0.0,
+        "counters": stats,
+        "policy": policy.metrics(),
+        "saves": saves,
+        "model": dict(model.stats),
+        "stages": {name: summarize(samples) for name, samples in timings.items()},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=200, help="Turns per session")
+    parser.add_argument("--sessions", type=int, default=1, help="Sessions played one after another")
+    parser.add_argument("--stream", action="store_true", help="Play turns through the streaming path")
+    parser.add_argument("--latency", type=float, default=0.01, help="Mock seconds before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=1000)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of replies that are malformed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sync-save", action="store_true", help="Wait for each save to be written")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.turns, args.sessions, args.stream, args.latency, args.tokens_per_sec,
+                           args.malformed_rate, args.seed, args.sync_save)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
@@ -0,0 +1,272 @@
+"""Load-test the generation and persistence layers with many concurrent players
+
+Each player is a thread with its own session. It starts by loading its
+session, as the interfaces do. Then it waits a random think time before each
+choice, generates the next scene through main.generate_next_node_ollama and
+saves the session. Choices are replayed from recorded playthroughs (the
+`history` of save files such as those in saves_backup/) or, without
+--replay, picked from whatever each scene offers. The model is the seeded
+mock behind a fixed number of generation slots, like one Ollama server
+working through a queue. A request still waiting for a slot when its deadline
+passes times out, just as an HTTP request would. Saves go to a throwaway
+session store through the background save writer (or --sync-save). The
+generation cache, story graph and similarity index are disabled, so every
+turn really generates.
+
+The JSON report has throughput, turn latency percentiles, error and fallback
+rates, model queue waits, the save writer's queue and lag, and save
+contention per player: how long each player's save calls blocked.
+
+    python -m benchmarks.load_test --players 200 --think-time 0.5
+    python -m benchmarks.load_test --players 100 --replay saves_backup --model-slots 4
+    python -m benchmarks.load_test --players 300 --turns 10 --sync-save --output load.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import main
+import metrics
+import serializers
+import utils
+from benchmarks.game_loop import summarize
+from benchmarks.mock_llm import MockModel
+from generation_cache import GenerationCache
+from session_store import SQLiteSessionStore
+from story_data import STORY_TREE
+from story_memory import StoryMemory, record_turn
+
+
+class ModelSlots:
+    """Mock model that serves at most `slots` requests at a time
+
+    Requests queue for a slot; one that can't get a slot within its timeout
+    raises TimeoutError. Queue waits are kept in `waits`.
+    """
+
+    def __init__(self, model, slots=1):
+        self.model = model
+        self._slots = threading.BoundedSemaphore(slots)
+        self._lock = threading.Lock()
+        self.waits = []
+
+    def generate(self, prompt, system=None, format=None, options=None, timeout=None):
+        started = time.perf_counter()
+        acquired = self._slots.acquire(timeout=timeout)
+        waited = time.perf_counter() - started
+        with self._lock:
+            self.waits.append(waited)
+        if not acquired:
+            raise TimeoutError(f"No free model slot after {waited:.1f}s")
+        try:
+            # The mock's RNG and stats aren't thread-safe; the reply itself is cheap
+            with self._lock:
+                text = self.model.reply()
+            tokens = len(self.model._tokens(text))
+            self.model.sleep(self.model.latency + tokens / self.model.tokens_per_sec)
+            with self._lock:
+                self.model.stats["tokens"] += tokens
+            return self.model._final(prompt, system, text, tokens)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self.model.close()
+
+
+def load_scripts(paths):
+    """Choice sequences from the histories of save files (or directories of them)"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)))
+        else:
+            files.append(path)
+    scripts = []
+    for path in files:
+        try:
+            data = serializers.read_file(path)
+        except Exception as e:
+            print(f"⚠️ Skipping {path}: {e}", file=sys.stderr)
+            continue
+        history = data.get("game_data", data).get("history", []) if isinstance(data, dict) else []
+        choices = [entry["choice"] for entry in history if isinstance(entry, dict) and entry.get("choice")]
+        if choices:
+            scripts.append(choices)
+    return scripts
+
+
+def play(player, session_id, turns, script, think_time, sync_save, seed, results):
+    """One player's session: load, then think, choose, generate and save `turns` times"""
+    rng = random.Random(seed + player)
+    start = STORY_TREE["nodes"]["start"]
+    story_meta = STORY_TREE.get("meta", {})
+    memory = StoryMemory()
+    save = utils.save_game if sync_save else utils.queue_save
+    clock = time.perf_counter
+    record = {"turns": [], "generation": [], "save": [], "load": 0.0, "errors": Counter()}
+    results[player] = record
+
+    t = clock()
+    state = utils.load_game(session_id) or {"current_text": start["text"], "history": []}
+    record["load"] = clock() - t
+    choices = start["choices"]
+    for turn in range(turns):
+        if think_time:
+            time.sleep(rng.expovariate(1 / think_time))
+        choice = script[turn % len(script)] if script else rng.choice(choices)["text"]
+        try:
+            t0 = clock()
+            node = main.generate_next_node_ollama(state["current_text"], choice, state["history"], story_meta, memory)
+            t1 = clock()
+            record_turn(state["history"], memory, choice, node)
+            state["current_text"] = node["text"]
+            save(session_id, {
+                "current_text": state["current_text"],
+                "history": state["history"],
+                "memory": memory.to_dict(),
+            })
+            t2 = clock()
+        except Exception as e:
+            record["errors"][type(e).__name__] += 1
+            continue
+        record["generation"].append(t1 - t0)
+        record["save"].append(t2 - t1)
+        record["turns"].append(t2 - t0)
+        choices = node.get("choices") or start["choices"]
+
+
+def save_contention(results):
+    """How long save calls blocked, per player, and which players waited longest"""
+    per_player = {
+        f"player-{player}": {
+            "saves": len(record["save"]),
+            "blocked_s": sum(record["save"]),
+            "p99_ms": metrics.percentile(record["save"], 99) * 1000,
+            "max_ms": max(record["save"], default=0.0) * 1000,
+        }
+        for player, record in results.items()
+    }
+    blocked = [stats["blocked_s"] for stats in per_player.values()]
+    worst = sorted(per_player.items(), key=lambda item: item[1]["blocked_s"], reverse=True)[:5]
+    return {
+        "blocked_s_p50": metrics.percentile(blocked, 50),
+        "blocked_s_p99": metrics.percentile(blocked, 99),
+        "blocked_s_max": max(blocked, default=0.0),
+        "most_blocked": dict(worst),
+    }
+
+
+def run_benchmark(players=50, turns=20, think_time=0.5, replay=None, model_slots=1, latency=0.05,
+                  tokens_per_sec=500, malformed_rate=0.0, seed=0, sync_save=False):
+    """Run the players concurrently and return the JSON-ready report"""
+    scripts = load_scripts(replay) if replay else []
+    if replay and not scripts:
+        raise SystemExit(f"No playthroughs with choices found in {', '.join(replay)}")
+    model = ModelSlots(MockModel(latency=latency, tokens_per_sec=tokens_per_sec,
+                                 malformed_rate=malformed_rate, seed=seed), model_slots)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteSessionStore(os.path.join(tmp, "saves.db"))
+        saved = (main._client, main._cache, main._graph, main.GRAPH_PATH, main._similar, main.SIMILARITY_THRESHOLD,
+                 main._policy, utils._store)
+        main._client, main._cache, main._graph, main.GRAPH_PATH = model, GenerationCache([]), None, ""
+        main._similar, main.SIMILARITY_THRESHOLD = None, ""
+        main._policy = None  # Deadlines are learned from this run's replies only
+        utils._store = store
+        metrics.reset()
+        threads = [
+            threading.Thread(
+                target=play, name=f"player-{i}",
+                args=(i, f"load-{i}", turns, scripts[i % len(scripts)] if scripts else None,
+                      think_time, sync_save, seed, results),
+            )
+            for i in range(players)
+        ]
+        started = time.perf_counter()
+        try:
+            # Fallback warnings go to stderr so stdout stays machine-readable
+            with contextlib.redirect_stdout(sys.stderr):
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - started
+                # Everything queued must be written before the store goes away
+                utils.get_saver().flush()
+            stats = metrics.snapshot()["counters"]
+            saves = utils.get_saver().metrics()
+        finally:
+            (main._client, main._cache, main._graph, main.GRAPH_PATH, main._similar, main.SIMILARITY_THRESHOLD,
+             main._policy, utils._store) = saved
+            store.close()
+
+    records = list(results.values())
+    turn_times = [t for record in records for t in record["turns"]]
+    errors = sum((record["errors"] for record in records), Counter())
+    attempted = len(turn_times) + sum(errors.values())
+    return {
+        "config": {
+            "players": players,
+            "turns": turns,
+            "think_time": think_time,
+            "replay": replay,
+            "replayed_playthroughs": len(scripts),
+            "model_slots": model_slots,
+            "latency": latency,
+            "tokens_per_sec": tokens_per_sec,
+            "malformed_rate": malformed_rate,
+            "seed": seed,
+            "sync_save": sync_save,
+        },
+        "elapsed_s": elapsed,
+        "turns_per_sec": len(turn_times) / elapsed if elapsed else 0.0,
+        "error_rate": sum(errors.values()) / attempted if attempted else 0.0,
+        "errors": dict(errors),
+        "fallback_rate": stats.get("fallbacks", 0) / attempted if attempted else 0.0,
+        "timeout_rate": stats.get("attempt_timeouts", 0) / attempted if attempted else 0.0,
+        "counters": stats,
+        "latency": {
+            "turn": summarize(turn_times),
+            "generation": summarize([t for record in records for t in record["generation"]]),
+            "model_queue": summarize(model.waits),
+            "save": summarize([t for record in records for t in record["save"]]),
+            "load": summarize([record["load"] for record in records]),
+        },
+        "save_contention": save_contention(results),
+        "saves": saves,
+        "model": dict(model.model.stats),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=50, help="Concurrent players, each with its own session")
+    parser.add_argument("--turns", type=int, default=20, help="Choices per player (replayed scripts repeat)")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Mean seconds a player waits before choosing")
+    parser.add_argument("--replay", nargs="+", help="Save files or directories whose histories are replayed")
+    parser.add_argument("--model-slots", type=int, default=1, help="Generations the mock model runs at once")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock seconds before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=500)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of replies that are malformed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sync-save", action="store_true", help="Wait for each save to be written")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.players, args.turns, args.think_time, args.replay, args.model_slots, args.latency,
+                           args.tokens_per_sec, args.malformed_rate, args.seed, args.sync_save)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
@@ -0,0 +1,95 @@
+"""Deterministic stand-in for OllamaClient so the game loop can be timed without a model
+
+MockModel answers generate() and generate_stream() like Ollama's /api/generate:
+it waits `latency` seconds before the first token, then emits tokens at
+`tokens_per_sec`. A seeded RNG decides each reply's scene and whether it is
+malformed, so two runs with the same settings see exactly the same replies.
+"""
+import json
+import random
+import time
+
+TOKEN_CHARS = 4  # Characters per emitted token, matching story_memory.estimate_tokens
+
+_PLACES = ["hall", "crypt", "library", "bridge", "garden", "tower", "cellar", "gallery"]
+_SIGHTS = ["a flickering lamp", "a sealed door", "fresh footprints", "a humming crystal", "an empty throne"]
+_ACTIONS = ["Open the door", "Follow the footprints", "Call out", "Search the shelves", "Wait and listen", "Turn back"]
+
+# Ways real models get the scene wrong
+MALFORMED_KINDS = ("truncated", "prose", "one_choice", "text_not_string", "preamble")
+
+
+class MockModel:
+    """Fake model backend with configurable latency, throughput and malformed-output rate"""
+
+    def __init__(self, latency=0.01, tokens_per_sec=1000, malformed_rate=0.0, seed=0, sleep=time.sleep):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.malformed_rate = malformed_rate
+        self.sleep = sleep
+        self._rng = random.Random(seed)
+        self.stats = {"requests": 0, "malformed": 0, "tokens": 0}
+
+    def reply(self):
+        """Next raw reply text (valid scene JSON, or one of MALFORMED_KINDS)"""
+        rng = self._rng
+        place = rng.choice(_PLACES)
+        scene = {
+            "text": f"You step into the {place}. In the gloom you notice {rng.choice(_SIGHTS)}. "
+                    f"The air smells of dust and old rain.",
+            "choices": [
+                {"id": f"choice{i + 1}", "text": action}
+                for i, action in enumerate(rng.sample(_ACTIONS, rng.randint(2, 4)))
+            ],
+        }
+        self.stats["requests"] += 1
+        if rng.random() >= self.malformed_rate:
+            return json.dumps(scene)
+
+        self.stats["malformed"] += 1
+        kind = rng.choice(MALFORMED_KINDS)
+        if kind == "truncated":
+            text = json.dumps(scene)
+            return text[:rng.randint(10, len(text) - 2)]
+        if kind == "prose":
+            return scene["text"]
+        if kind == "one_choice":
+            scene["choices"] = scene["choices"][:1]
+        elif kind == "text_not_string":
+            scene["text"] = [scene["text"]]
+        elif kind == "preamble":
+            return "Sure! Here is the next scene:\n" + json.dumps(scene)
+        return json.dumps(scene)
+
+    def _tokens(self, text):
+        return [text[i:i + TOKEN_CHARS] for i in range(0, len(text), TOKEN_CHARS)]
+
+    def generate(self, prompt, system=None, format=None, options=None, timeout=None):
+        text = self.reply()
+        tokens = self._tokens(text)
+        self.stats["tokens"] += len(tokens)
+        self.sleep(self.latency + len(tokens) / self.tokens_per_sec)
+        return self._final(prompt, system, text, len(tokens))
+
+    def generate_stream(self, prompt, system=None, format=None, options=None, timeout=None):
+        text = self.reply()
+        tokens = self._tokens(text)
+        self.sleep(self.latency)
+        for token in tokens:
+            self.sleep(1 / self.tokens_per_sec)
+            self.stats["tokens"] += 1
+            yield {"response": token, "done": False}
+        final = self._final(prompt, system, "", len(tokens))
+        yield final
+
+    def _final(self, prompt, system, text, eval_count):
+        prompt_chars = len(prompt) + len(system or "")
+        return {
+            "response": text,
+            "done": True,
+            "eval_count": eval_count,
+            "prompt_eval_count": prompt_chars // TOKEN_CHARS + 1,
+        }
+
+    def close(self):
+        pass
@@ -0,0 +1,142 @@
+"""Measure how many prompt tokens must be prefilled per turn with and without a stable prefix
+
+Ollama reuses the KV cache for the longest prefix a request shares with the
+previous one, so only the tokens after that prefix are prefilled. This
+replays a synthetic playthrough and compares the legacy monolithic prompt
+(per-turn content in the middle) against the prompt_builder split.
+
+    python -m benchmarks.prefix_reuse --turns 50
+    python -m benchmarks.prefix_reuse --turns 10 --live   # ask a running Ollama
+"""
+import argparse
+import json
+import os
+
+import prompt_builder
+from story_data import STORY_TREE
+from story_memory import StoryMemory, estimate_tokens
+
+
+def legacy_prompt(current_text, choice_text, context, meta):
+    """The prompt layout used before prompt_builder (static text after the per-turn content)"""
+    genre = meta.get("genre", "Adventure")
+    tone = meta.get("tone", "mysterious")
+    system = prompt_builder.system_prompt(genre, tone)
+    instructions = system[system.index("INSTRUCTIONS:"):]
+    return f"""You are an expert {genre.lower()} storyteller. 
+
+STORY CONTEXT:
+Genre: {genre}
+Tone: {tone}
+{context}
+
+CURRENT SCENE:
+{current_text}
+
+PLAYER ACTION: {choice_text}
+
+{instructions}"""
+
+
+def common_prefix_len(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def synthetic_turns(turns):
+    """Deterministic (current_text, choice, context) triples for a playthrough"""
+    start = STORY_TREE["nodes"]["start"]
+    current_text = start["text"]
+    choices = [c["text"] for c in start["choices"]]
+    memory = StoryMemory()
+    for turn in range(turns):
+        choice = choices[turn % len(choices)]
+        yield current_text, choice, memory.context()
+        current_text = (
+            f"Turn {turn + 1}: after you {choice.lower()}, the hall shifts around you. "
+            f"A new passage opens to the {['north', 'east', 'south', 'west'][turn % 4]}. "
+            "Somewhere a bell tolls once."
+        )
+        memory.add_turn(choice, current_text)
+
+
+def simulate(turns):
+    """Prefill estimate per turn for both layouts, assuming prefix KV-cache reuse"""
+    meta = STORY_TREE["meta"]
+    results = {"legacy": [], "split": []}
+    previous = {"legacy": "", "split": ""}
+    for current_text, choice, context in synthetic_turns(turns):
+        requests = {
+            "legacy": legacy_prompt(current_text, choice, context, meta),
+            "split": prompt_builder.flatten(prompt_builder.build(current_text, choice, context, meta)),
+        }
+        for layout, text in requests.items():
+            reused = common_prefix_len(previous[layout], text)
+            results[layout].append({
+                "prompt_tokens": estimate_tokens(text),
+                "prefill_tokens": estimate_tokens(text[reused:]),
+            })
+            previous[layout] = text
+    return results
+
+
+def layout_request(layout, current_text, choice, context, meta):
+    """(prompt, system) of one turn in the given layout"""
+    if layout == "legacy":
+        return legacy_prompt(current_text, choice, context, meta), None
+    prompt = prompt_builder.build(current_text, choice, context, meta)
+    return prompt.prompt, prompt.system
+
+
+def live(turns, model):
+    """Prefill token counts reported by Ollama (prompt_eval_count) for both layouts
+
+    Each layout is measured in its own pass. Interleaved requests would evict
+    each other's cached prefix. Every pass starts with an unmeasured warm-up
+    turn from an unrelated scene, so the model is loaded and only the layout's
+    own static text is in the KV cache, as in steady play.
+    """
+    from ollama_client import OllamaClient
+
+    client = OllamaClient(model, timeout=300)
+    meta = STORY_TREE["meta"]
+    options = {"num_predict": 1}
+    results = {}
+    for layout in ("legacy", "split"):
+        prompt, system = layout_request(layout, "A quiet antechamber, lit by a single candle.", "Wait", "", meta)
+        client.generate(prompt, system=system, options=options)
+        results[layout] = []
+        for current_text, choice, context in synthetic_turns(turns):
+            prompt, system = layout_request(layout, current_text, choice, context, meta)
+            reply = client.generate(prompt, system=system, options=options)
+            results[layout].append({"prefill_tokens": reply.get("prompt_eval_count", 0)})
+    return results
+
+
+def summarize(results):
+    summary = {}
+    for layout, rows in results.items():
+        # The first turn has nothing to reuse; report steady-state turns
+        steady = rows[1:] or rows
+        summary[layout] = {
+            key: sum(row[key] for row in steady) / len(steady)
+            for key in rows[0]
+        }
+    legacy = summary["legacy"]["prefill_tokens"]
+    split = summary["split"]["prefill_tokens"]
+    summary["prefill_reduction"] = 1 - split / legacy if legacy else 0.0
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--live", action="store_true", help="Measure against a running Ollama server")
+    parser.add_argument("--model", default=os.environ.get("OLLAMA_MODEL", "llama3.1:8b"))
+    args = parser.parse_args()
+
+    results = live(args.turns, args.model) if args.live else simulate(args.turns)
+    print(json.dumps({"turns": args.turns, "live": args.live, "per_turn_mean": summarize(results)}, indent=2))
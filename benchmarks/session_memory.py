@@ -0,0 +1,120 @@
+"""Measure per-session memory of the game state after 10, 100 and 1000 turns
+
+Many sessions are played side by side, the way story_server holds them.
+Each turn's scene is decoded from JSON afresh, as it arrives from the model,
+cache or story graph. The state of each session (scene text, history and
+story memory) is sized by walking it, counting each object shared between
+sessions once. Two layouts are compared.
+"plain" keeps history entries as dicts, each holding its own copy of the
+choices list. "compact" uses session_state.Turn, as record_turn now does.
+Loading a saved session goes through the same path, so resumed sessions
+get the compact layout too. The script also checks that both layouts save
+to identical JSON, and prints a JSON report.
+
+    python -m benchmarks.session_memory
+    python -m benchmarks.session_memory --sessions 500 --turns 10 100 1000
+"""
+import argparse
+import json
+import sys
+from collections import deque
+from datetime import datetime, timedelta
+
+from benchmarks.mock_llm import MockModel
+from session_state import to_plain
+from story_data import STORY_TREE
+from story_memory import HISTORY_LIMIT, StoryMemory, record_turn
+
+SCENES = 64  # Distinct scenes the mock story draws from, as a story graph or cache would serve them
+
+
+def record_plain_turn(history, memory, choice, next_node, **extra):
+    """record_turn as it was before the compact layout: one fresh dict per entry"""
+    history.append(dict({"choice": choice, "choices": next_node.get("choices", [])}, **extra))
+    del history[:-HISTORY_LIMIT]
+    memory.add_turn(choice, next_node["text"])
+
+
+def play(sessions, turns, record, seed=0):
+    """Build `sessions` states of `turns` turns each; returns them"""
+    model = MockModel(seed=seed)
+    scenes = [model.reply() for _ in range(SCENES)]
+    start = STORY_TREE["nodes"]["start"]
+    clock = datetime(2025, 1, 1, 12, 0, 0, 123456)
+    states = []
+    for s in range(sessions):
+        state = {"current_text": start["text"], "history": [], "memory": StoryMemory()}
+        choices = start["choices"]
+        for t in range(turns):
+            node = json.loads(scenes[(s * 7 + t * 13) % SCENES])
+            choice = choices[t % len(choices)]["text"]
+            record(state["history"], state["memory"], choice, node,
+                   timestamp=(clock + timedelta(seconds=s * turns + t)).isoformat())
+            state["current_text"] = node["text"]
+            choices = node["choices"]
+        states.append(state)
+    return states
+
+
+def _children(obj):
+    if isinstance(obj, dict):
+        return list(obj.keys()) + list(obj.values())
+    if isinstance(obj, (list, tuple, deque)):
+        return list(obj)
+    if isinstance(obj, (str, bytes, int, float, bool, type(None))):
+        return []
+    children = list(getattr(obj, "__dict__", {}).values())
+    for slot in getattr(type(obj), "__slots__", ()):
+        if slot != "__weakref__" and hasattr(obj, slot):
+            children.append(getattr(obj, slot))
+    return children
+
+
+def deep_size(roots):
+    """Bytes reachable from `roots`, counting objects shared between them once"""
+    seen = set()
+    total = 0
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(_children(obj))
+    return total
+
+
+def measure(sessions, turns, record):
+    """Bytes per session held by the states, and the states themselves"""
+    states = play(sessions, turns, record)
+    return deep_size(states) / sessions, states
+
+
+def saved(state):
+    return json.dumps({"current_text": state["current_text"], "history": state["history"],
+                       "memory": state["memory"].to_dict()}, default=to_plain, sort_keys=True)
+
+
+def run_benchmark(sessions=200, turn_counts=(10, 100, 1000)):
+    report = {"sessions": sessions, "history_limit": HISTORY_LIMIT, "turns": {}}
+    for turns in turn_counts:
+        plain, plain_states = measure(sessions, turns, record_plain_turn)
+        compact, compact_states = measure(sessions, turns, record_turn)
+        same = all(saved(a) == saved(b) for a, b in zip(plain_states, compact_states))
+        report["turns"][turns] = {
+            "plain_bytes_per_session": round(plain),
+            "compact_bytes_per_session": round(compact),
+            "saving": round(1 - compact / plain, 3) if plain else 0.0,
+            "identical_saves": same,
+        }
+        del plain_states, compact_states
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.sessions, args.turns), indent=2))
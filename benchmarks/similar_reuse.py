@@ -0,0 +1,169 @@
+"""Measure how often paraphrased choices reuse a stored scene, and how fast the lookup is
+
+Scenes from the mock model are indexed with a few of the choices below, and
+the index is then queried from the same scenes. Four kinds of paraphrase of
+a stored choice should be reused:
+- filler words, case or punctuation ("I open the heavy wooden door.")
+- synonymous verbs ("Examine the damaged throne" for "Approach and inspect
+  the damaged throne")
+- dropped modifiers ("Inspect the throne")
+- an added manner adverb ("Carefully open the heavy wooden door")
+Five kinds of probe should not be:
+- the same object with a different verb ("Ignore the damaged throne")
+- an action the scene never offered
+- the negated action ("Do not open the heavy wooden door")
+- the action with something added ("Open the heavy wooden door and run")
+- another choice the scene offers
+
+Reports the reuse rate (overall and per kind), the false-reuse rate (overall
+and per kind) and the p50/p99 lookup latency at each threshold, as JSON.
+Exits non-zero when the default threshold reuses less than --min-reuse of
+the paraphrases, or any threshold at or above it lets more than
+--max-false-reuse of the negative probes through.
+
+    python -m benchmarks.similar_reuse
+    python -m benchmarks.similar_reuse --scenes 5000 --thresholds 0.6 0.7 0.8
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from benchmarks.mock_llm import MockModel
+from metrics import percentile
+from similarity_index import SIMILARITY_THRESHOLD, SimilarityIndex
+
+# (choice, what it acts on, paraphrases with synonymous verbs, paraphrases with modifiers dropped)
+CHOICES = (
+    ("Approach and inspect the damaged throne", "the damaged throne",
+     ("Examine the damaged throne", "Look at the damaged throne"), ("Inspect the throne", "Study the throne")),
+    ("Question the lone guard in the corner", "the lone guard in the corner",
+     ("Interrogate the lone guard in the corner", "Ask the lone guard in the corner"),
+     ("Question the guard", "Question the lone guard")),
+    ("Examine the ancient tapestries", "the ancient tapestries",
+     ("Study the ancient tapestries", "Look over the ancient tapestries"), ("Examine the tapestries",)),
+    ("Leave the hall quietly", "the hall", ("Exit the hall quietly", "Quietly depart from the hall"),
+     ("Leave the hall", "Exit the hall")),
+    ("Open the heavy wooden door", "the heavy wooden door", (), ("Open the door", "Open the wooden door")),
+    ("Follow the fresh footprints", "the fresh footprints", ("Track the fresh footprints", "Trail the footprints"),
+     ("Follow the footprints",)),
+    ("Search the dusty shelves", "the dusty shelves", ("Rummage through the dusty shelves",),
+     ("Search the shelves",)),
+    ("Pick up the rusty key", "the rusty key", ("Take the rusty key", "Grab the key"), ("Pick up the key",)),
+    ("Call out to the stranger", "the stranger", ("Shout to the stranger", "Yell to the stranger"), ()),
+    ("Climb the crumbling tower stairs", "the crumbling tower stairs", ("Ascend the crumbling tower stairs",),
+     ("Climb the stairs", "Climb the tower stairs")),
+    ("Talk to the old merchant", "the old merchant", ("Speak with the old merchant", "Speak to the merchant"),
+     ("Talk to the merchant",)),
+    ("Wait and listen", "", ("Linger and listen",), ()),
+)
+OFFERED = 4  # Choices per scene
+REWORDINGS = (
+    "I {lower}",
+    "{text}!",
+    "{lower}.",
+    "Let's {lower}",
+    "I will {lower} now",
+    "{text}, please",
+)
+MANNERS = ("Carefully {lower}", "Slowly {lower}", "{text} cautiously")
+OTHER_VERBS = ("Close", "Ignore", "Guard", "Mark", "Block")
+NEGATIONS = ("Do not {lower}", "Don't {lower}", "Refuse to {lower}", "Never {lower}")
+SUPERSETS = (
+    "{text} with the rusty key",
+    "Smash and {lower}",
+    "{text} and run",
+    "{text} quietly and wait",
+)
+POSITIVE_KINDS = ("reworded", "synonym", "shorter", "manner")
+NEGATIVE_KINDS = ("other_verb", "unoffered", "negated", "superset", "sibling")
+MIN_REUSE = 0.95       # Share of paraphrases that must reuse a scene at the default threshold
+MAX_FALSE_REUSE = 0.0  # Share of negative probes allowed to reuse a scene at the default threshold
+
+
+def build(scenes, threshold, seed=0):
+    """An index over `scenes` mock scenes, plus (scene, query, offered, kind) probes
+
+    Each scene gets one probe of each positive and negative kind.
+    """
+    model = MockModel(seed=seed)
+    rng = random.Random(seed)
+    index = SimilarityIndex(threshold=threshold)
+    probes = []
+    for n in range(scenes):
+        scene = json.loads(model.reply())
+        scene_text = f"{scene['text']} ({n})"  # Each mock scene is its own story situation
+        choices = rng.sample(CHOICES, OFFERED)
+        offered = [choice[0] for choice in choices]
+        # One offered choice is left unexpanded: picking it must not replay a sibling's scene
+        unexpanded = choices.pop(rng.randrange(OFFERED))
+        for choice in choices:
+            index.add(scene_text, choice[0], {"text": f"after {choice[0]}", "choices": []})
+
+        def probe(template, kind, text=None):
+            text = text or rng.choice(choices)[0]
+            probes.append((scene_text, template.format(text=text, lower=text.lower()), offered, kind))
+
+        probe(rng.choice(REWORDINGS), "reworded")
+        for kind, field in (("synonym", 2), ("shorter", 3)):
+            probe(rng.choice(rng.choice([choice for choice in choices if choice[field]])[field]), kind)
+        probe(rng.choice(MANNERS), "manner")
+        target = rng.choice([choice[1] for choice in choices if choice[1]])
+        probe(f"{rng.choice(OTHER_VERBS)} {target}", "other_verb")
+        probe(rng.choice([choice[0] for choice in CHOICES if choice[0] not in offered]), "unoffered")
+        probe(rng.choice(NEGATIONS), "negated")
+        probe(rng.choice(SUPERSETS), "superset")
+        probe("{text}", "sibling", unexpanded[0])
+    return index, probes
+
+
+def run_benchmark(scenes=1000, thresholds=(0.6, 0.7, 0.8, 0.9), min_reuse=MIN_REUSE,
+                  max_false_reuse=MAX_FALSE_REUSE):
+    report = {"scenes": scenes, "thresholds": {}, "failures": []}
+    for threshold in thresholds:
+        index, probes = build(scenes, threshold)
+        timings = []
+        reused = dict.fromkeys(POSITIVE_KINDS, 0)
+        false_reused = dict.fromkeys(NEGATIVE_KINDS, 0)
+        for scene_text, query, offered, kind in probes:
+            started = time.perf_counter()
+            hit = index.find(scene_text, query, offered)
+            timings.append(time.perf_counter() - started)
+            if hit is not None:
+                if kind in reused:
+                    reused[kind] += 1
+                else:
+                    false_reused[kind] += 1
+        reuse_rate = sum(reused.values()) / (scenes * len(POSITIVE_KINDS))
+        false_rate = sum(false_reused.values()) / (scenes * len(NEGATIVE_KINDS))
+        report["thresholds"][threshold] = {
+            "indexed_choices": len(index),
+            "reuse_rate": round(reuse_rate, 3),
+            "reuse_by_kind": {kind: round(count / scenes, 3) for kind, count in reused.items()},
+            "false_reuse_rate": round(false_rate, 3),
+            "false_reuse_by_kind": {kind: round(count / scenes, 3) for kind, count in false_reused.items()},
+            "lookup_p50_us": round(percentile(timings, 50) * 1e6, 1),
+            "lookup_p99_us": round(percentile(timings, 99) * 1e6, 1),
+        }
+        if threshold == SIMILARITY_THRESHOLD and reuse_rate < min_reuse:
+            report["failures"].append(f"threshold {threshold}: reuse rate {reuse_rate:.3f} (required {min_reuse})")
+        if threshold >= SIMILARITY_THRESHOLD and false_rate > max_false_reuse:
+            report["failures"].append(
+                f"threshold {threshold}: false-reuse rate {false_rate:.3f} (allowed {max_false_reuse})"
+            )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenes", type=int, default=1000)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.6, 0.7, 0.8, 0.9])
+    parser.add_argument("--min-reuse", type=float, default=MIN_REUSE,
+                        help="Required reuse rate of paraphrases at the default threshold")
+    parser.add_argument("--max-false-reuse", type=float, default=MAX_FALSE_REUSE,
+                        help="Allowed false-reuse rate at thresholds at or above the default")
+    args = parser.parse_args()
+    report = run_benchmark(args.scenes, args.thresholds, args.min_reuse, args.max_false_reuse)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["failures"] else 0)
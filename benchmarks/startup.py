@@ -0,0 +1,106 @@
+"""Check import time and Streamlit rerun time against a budget
+
+Each import is timed in a fresh interpreter (best of --repeat runs), and
+the modules the generation backend defers until first use must not have
+been loaded by it. With Streamlit installed, the app is also run headless
+through streamlit.testing and its rerun time is checked. Prints a JSON
+report and exits with status 1 when anything is over budget.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --scale 2   # loosen every budget, e.g. on slow CI machines
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Milliseconds; generous enough for a laptop, tight enough to catch an eager heavy import
+IMPORT_BUDGET_MS = {
+    "main": 40,
+    "story_server": 120,  # asyncio alone is most of this
+}
+RERUN_BUDGET_MS = 150
+
+# Imported on first generation/save, never by `import main`
+DEFERRED_MODULES = ("http.client", "subprocess", "sqlite3", "concurrent.futures", "mmap")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = """
+import sys, time, json
+before = set(sys.modules)
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(json.dumps({{"ms": elapsed * 1000, "loaded": sorted(set(sys.modules) - before)}}))
+"""
+
+
+def time_import(module, repeat=5):
+    """Best-of-`repeat` import time in milliseconds and the modules it loaded"""
+    best = None
+    loaded = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module)],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        )
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        if best is None or result["ms"] < best:
+            best, loaded = result["ms"], result["loaded"]
+    return best, loaded
+
+
+def time_reruns(reruns=5):
+    """Streamlit first-run and rerun times in milliseconds, or None without Streamlit"""
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return None
+    app = AppTest.from_file(os.path.join(ROOT, "gui_streamlit.py"), default_timeout=30)
+    started = time.perf_counter()
+    app.run()
+    first = (time.perf_counter() - started) * 1000
+    samples = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        app.run()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"first_run_ms": first, "rerun_ms": min(samples)}
+
+
+def check(scale=1.0, repeat=5):
+    report = {"imports": {}, "failures": []}
+    for module, budget in IMPORT_BUDGET_MS.items():
+        ms, loaded = time_import(module, repeat)
+        eager = [name for name in DEFERRED_MODULES if name in loaded] if module == "main" else []
+        report["imports"][module] = {"ms": ms, "budget_ms": budget * scale, "eager_deferred_modules": eager}
+        if ms > budget * scale:
+            report["failures"].append(f"import {module} took {ms:.1f} ms (budget {budget * scale:.0f} ms)")
+        if eager:
+            report["failures"].append(f"import {module} loaded {', '.join(eager)} eagerly")
+
+    reruns = time_reruns()
+    if reruns is None:
+        report["streamlit"] = "not installed; rerun budget not checked"
+    else:
+        reruns["budget_ms"] = RERUN_BUDGET_MS * scale
+        report["streamlit"] = reruns
+        if reruns["rerun_ms"] > RERUN_BUDGET_MS * scale:
+            report["failures"].append(
+                f"Streamlit rerun took {reruns['rerun_ms']:.1f} ms (budget {RERUN_BUDGET_MS * scale:.0f} ms)"
+            )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every budget by this")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    report = check(args.scale, args.repeat)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["failures"] else 0)
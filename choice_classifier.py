@@ -0,0 +1,121 @@
+import re
+import threading
+from bisect import bisect_right
+
+import metrics
+from story_data import STORY_TEMPLATES
+
+# Intents in priority order: a choice's primary intent is the first one it matches
+INTENTS = (
+    ("inspect", ("inspect", "examine", "look", "search")),
+    ("talk", ("talk", "speak", "ask", "question")),
+    ("fight", ("fight", "attack", "defend")),
+    ("leave", ("leave", "go", "move", "walk")),
+    ("use", ("use", "take", "grab")),
+)
+ICONS = {"inspect": "🔍", "talk": "💬", "fight": "⚔️", "leave": "🚶", "use": "🤲"}
+DEFAULT_ICON = "✨"
+MEMO_SIZE = 4096  # Choice texts whose intents are remembered
+
+
+def _slug(text):
+    return re.sub(r"\W+", "_", text.strip().lower()).strip("_")
+
+
+def _intents():
+    """INTENTS followed by each template's choice types ("use magic" -> use_magic)"""
+    intents = list(INTENTS)
+    known = {name for name, _ in intents}
+    for template in STORY_TEMPLATES.values():
+        for choice_type in template.get("choice_types", []):
+            if _slug(choice_type) not in known:
+                known.add(_slug(choice_type))
+                intents.append((_slug(choice_type), (choice_type,)))
+    return intents
+
+
+def _compile(intents):
+    """One regex matching every keyword at the start of a word, and keyword -> intents
+
+    Keywords match inflected words too ("looking"), except very short ones,
+    which must be whole words so "go" doesn't match "gold".
+    """
+    keyword_intents = {}
+    for name, keywords in intents:
+        for keyword in keywords:
+            keyword_intents.setdefault(" ".join(keyword.lower().split()), set()).add(name)
+    # A phrase also counts for the keywords inside it ("use magic" is a "use" too)
+    for phrase in keyword_intents:
+        for keyword, names in list(keyword_intents.items()):
+            if keyword != phrase and re.search(rf"\b{re.escape(keyword)}", phrase):
+                keyword_intents[phrase] |= names
+    alternatives = sorted(
+        (r"\s+".join(map(re.escape, k.split())) + (r"\b" if len(k) <= 2 else "") for k in keyword_intents),
+        key=len, reverse=True,
+    )
+    pattern = re.compile(r"\b(?:" + "|".join(alternatives) + ")", re.IGNORECASE)
+    return pattern, keyword_intents
+
+
+_INTENTS = _intents()
+_PRIORITY = {name: i for i, (name, _) in enumerate(_INTENTS)}
+_PATTERN, _KEYWORD_INTENTS = _compile(_INTENTS)
+_memo = {}
+_memo_lock = threading.Lock()
+
+
+def classify_choices(texts):
+    """Intents of each choice (text or choice dict), in priority order
+
+    Choices not seen before are matched together in one regex pass; results
+    are memoized by text, since generated choice ids repeat across scenes.
+    """
+    texts = [t["text"] if isinstance(t, dict) else t for t in texts]
+    unique = list(dict.fromkeys(texts))
+    with _memo_lock:
+        known = {t: _memo[t] for t in unique if t in _memo}
+    pending = [t for t in unique if t not in known]
+    if pending:
+        # NUL can't be part of a keyword match, so no match spans two choices
+        joined = "\0".join(pending)
+        starts = []
+        offset = 0
+        for text in pending:
+            starts.append(offset)
+            offset += len(text) + 1
+        found = [set() for _ in pending]
+        for match in _PATTERN.finditer(joined):
+            found[bisect_right(starts, match.start()) - 1] |= _KEYWORD_INTENTS[" ".join(match.group().lower().split())]
+        for text, names in zip(pending, found):
+            known[text] = tuple(sorted(names, key=_PRIORITY.__getitem__))
+        with _memo_lock:
+            if len(_memo) + len(pending) > MEMO_SIZE:
+                _memo.clear()
+            _memo.update((text, known[text]) for text in pending)
+    return [known[t] for t in texts]
+
+
+def classify(text):
+    """Intents of one choice, in priority order (empty when none match)"""
+    return classify_choices([text])[0]
+
+
+def primary_intent(text):
+    intents = classify(text)
+    return intents[0] if intents else None
+
+
+def icons(choices):
+    """Button icon for each choice, classifying the whole batch at once"""
+    return [next((ICONS[name] for name in intents if name in ICONS), DEFAULT_ICON)
+            for intents in classify_choices(choices)]
+
+
+def icon(text):
+    """Button icon for a choice"""
+    return icons([text])[0]
+
+
+def record(text):
+    """Count the intent of a choice the player made"""
+    metrics.inc(f"choice_intent_{primary_intent(text) or 'other'}")
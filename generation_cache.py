@@ -0,0 +1,195 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+HISTORY_WINDOW = 3  # Must match the number of past choices the prompt includes
+
+
+def normalize(text):
+    """Collapse whitespace so cosmetic differences don't split cache, graph or similarity keys"""
+    return " ".join(str(text).split())
+
+
+def make_cache_key(current_text, choice_text, history, story_meta=None, context=None):
+    """Hash the normalized inputs that fully determine a generated scene
+
+    `context` is the story-memory block when the prompt uses one; it then
+    replaces the last-choices window.
+    """
+    meta = story_meta or {}
+    if context is not None:
+        recent = [context]
+    else:
+        recent = [h.get("choice", "") for h in (history or [])[-HISTORY_WINDOW:]]
+    material = json.dumps([
+        normalize(current_text),
+        normalize(choice_text),
+        [normalize(c) for c in recent],
+        normalize(meta.get("genre", "Adventure")),
+        normalize(meta.get("tone", "mysterious")),
+    ], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class MemoryTier:
+    """In-process LRU tier with optional TTL"""
+
+    name = "memory"
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (stored_at, node)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, node = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return node
+
+    def put(self, key, node):
+        with self._lock:
+            self._entries[key] = (time.time(), node)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteTier:
+    """On-disk tier shared across sessions and restarts, evicted by TTL and least-recent use"""
+
+    name = "sqlite"
+
+    def __init__(self, path="generation_cache.db", max_entries=100_000, ttl=30 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scenes ("
+            " key TEXT PRIMARY KEY, node TEXT NOT NULL,"
+            " stored_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS scenes_used_at ON scenes(used_at)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT node, stored_at FROM scenes WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            node, stored_at = row
+            if self.ttl is not None and now - stored_at > self.ttl:
+                self._conn.execute("DELETE FROM scenes WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE scenes SET used_at = ? WHERE key = ?", (now, key))
+        return json.loads(node)
+
+    def put(self, key, node):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scenes (key, node, stored_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(node, ensure_ascii=False, separators=(",", ":")), now, now),
+            )
+            # Evicting is a table scan, so only do it every so often
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(now)
+
+    def _evict(self, now):
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM scenes WHERE stored_at < ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM scenes WHERE key IN ("
+            " SELECT key FROM scenes ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM scenes")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM scenes").fetchone()[0]
+
+
+class GenerationCache:
+    """Content-addressed scene cache checked tier by tier (fastest first)
+
+    A hit in a slower tier is promoted into the faster ones. Any object with
+    get(key), put(key, node), clear() and a `name` can be used as a tier.
+    """
+
+    def __init__(self, tiers):
+        self.tiers = list(tiers)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0}
+        for tier in self.tiers:
+            self.stats[f"{tier.name}_hits"] = 0
+
+    def get(self, key):
+        for i, tier in enumerate(self.tiers):
+            node = tier.get(key)
+            if node is not None:
+                for faster in self.tiers[:i]:
+                    faster.put(key, node)
+                self._count("hits", f"{tier.name}_hits")
+                return node
+        self._count("misses")
+        return None
+
+    def put(self, key, node):
+        for tier in self.tiers:
+            tier.put(key, node)
+        self._count("stores")
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+    def metrics(self):
+        """Hit/miss counters plus the overall hit rate"""
+        with self._lock:
+            metrics = dict(self.stats)
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_rate"] = metrics["hits"] / lookups if lookups else 0.0
+        return metrics
+
+    def _count(self, *names):
+        with self._lock:
+            for name in names:
+                self.stats[name] += 1
+
+
+def default_cache(path="generation_cache.db"):
+    """Memory LRU in front of the SQLite store"""
+    return GenerationCache([MemoryTier(), SQLiteTier(path)])
@@ -1,9 +1,10 @@
 import streamlit as st
-import time
+import uuid
 from datetime import datetime
-from main import generate_next_node_ollama, OLLAMA_MODEL
+from story_memory import StoryMemory, load_memory, record_turn
 from story_data import STORY_TREE
-from utils import save_game, load_game
+import choice_classifier
+from utils import save_game, queue_save, load_game
 
 st.set_page_config(
     page_title="AI Storyteller", 
@@ -12,13 +13,35 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_resource(show_spinner=False)
+def get_backend():
+    """Generation backend, imported once per server process and shared by all sessions and reruns"""
+    import main as backend
+    # Start loading the model now, so the first turn doesn't pay for it
+    backend.get_warmup().start()
+    return backend
+
+@st.cache_resource(show_spinner=False)
+def get_prefetch_pool():
+    """Prefetch workers shared by every session, so speculative load doesn't grow with the number of players"""
+    from prefetch import PrefetchPool
+    return PrefetchPool()
+
 def initialize_session_state():
     """Initialize or load game state"""
     if 'initialized' not in st.session_state:
-        state = load_game()
+        # Each player gets their own save; pick one with ?session=<name>
+        session_id = st.query_params.get("session")
+        if not session_id:
+            # A new tab starts its own game; the id goes into the URL so a reload resumes it
+            session_id = uuid.uuid4().hex
+            st.query_params["session"] = session_id
+        st.session_state.session_id = session_id
+        state = load_game(st.session_state.session_id)
         if state:
             st.session_state.current_text = state.get("current_text", STORY_TREE["nodes"]["start"]["text"])
             st.session_state.history = state.get("history", [])
+            st.session_state.memory = load_memory(state)
             st.session_state.story_meta = state.get("story_meta", STORY_TREE.get("meta", {}))
             if st.session_state.history and "choices" in st.session_state.history[-1]:
                 st.session_state.choices = st.session_state.history[-1]["choices"]
@@ -28,11 +51,16 @@ def initialize_session_state():
             new_game()
         st.session_state.initialized = True
         st.session_state.generation_count = 0
+        from prefetch import Prefetcher
+        st.session_state.prefetcher = Prefetcher(get_backend().generate_next_node_cancellable, pool=get_prefetch_pool())
 
 def new_game():
     """Start a new game"""
+    if 'prefetcher' in st.session_state:
+        st.session_state.prefetcher.cancel()
     st.session_state.current_text = STORY_TREE["nodes"]["start"]["text"]
     st.session_state.history = []
+    st.session_state.memory = StoryMemory()
     st.session_state.choices = STORY_TREE["nodes"]["start"]["choices"]
     st.session_state.story_meta = STORY_TREE.get("meta", {})
     st.session_state.generation_count = 0
@@ -47,8 +75,15 @@ def display_sidebar():
         st.info(f"**{meta.get('title', 'Unknown Story')}**\n\n*Genre: {meta.get('genre', 'Adventure')}*")
         
         # Game stats
-        st.metric("Choices Made", len(st.session_state.get('history', [])))
+        st.metric("Choices Made", st.session_state.memory.turns)
         st.metric("Scenes Generated", st.session_state.get('generation_count', 0))
+        prefetch = st.session_state.prefetcher.metrics()
+        st.metric(
+            "Prefetch Hit Rate",
+            f"{prefetch['hit_rate']:.0%}",
+            help=f"{prefetch['hits']} hits, {prefetch['misses']} misses, "
+                 f"{prefetch['wasted_tokens']} tokens spent on unpicked branches"
+        )
         
         st.divider()
         
@@ -56,34 +91,35 @@ def display_sidebar():
         col1, col2 = st.columns(2)
         with col1:
             if st.button("💾 Save", use_container_width=True):
-                save_game({
+                save_game(st.session_state.session_id, {
                     "current_text": st.session_state.current_text,
                     "history": st.session_state.history,
+                    "memory": st.session_state.memory.to_dict(),
                     "story_meta": st.session_state.story_meta
                 })
-                st.success("Saved!")
-                time.sleep(1)
+                # A toast survives the rerun, so there's no need to pause before it
+                st.toast("Saved!")
                 st.rerun()
         
         with col2:
             if st.button("🔄 New Game", use_container_width=True):
                 new_game()
-                st.success("New game started!")
-                time.sleep(1)
+                st.toast("New game started!")
                 st.rerun()
         
         if st.button("📁 Load Game", use_container_width=True):
-            state = load_game()
+            state = load_game(st.session_state.session_id)
             if state:
+                st.session_state.prefetcher.cancel()
                 st.session_state.current_text = state.get("current_text", STORY_TREE["nodes"]["start"]["text"])
                 st.session_state.history = state.get("history", [])
+                st.session_state.memory = load_memory(state)
                 st.session_state.story_meta = state.get("story_meta", STORY_TREE.get("meta", {}))
                 if st.session_state.history and "choices" in st.session_state.history[-1]:
                     st.session_state.choices = st.session_state.history[-1]["choices"]
                 else:
                     st.session_state.choices = STORY_TREE["nodes"]["start"]["choices"]
-                st.success("Game loaded!")
-                time.sleep(1)
+                st.toast("Game loaded!")
                 st.rerun()
             else:
                 st.error("No save file found!")
@@ -97,7 +133,11 @@ def display_sidebar():
                     st.caption(f"{i}. {entry.get('choice', 'Unknown choice')}")
         
         # Model info
-        st.caption(f"🤖 Model: {OLLAMA_MODEL}")
+        st.caption(f"🤖 Model: {get_backend().OLLAMA_MODEL}")
+        for name, state in get_backend().get_warmup().state().items():
+            icon = {"resident": "🟢", "loading": "🟡", "cold": "🔴"}.get(state, "⚪")
+            st.caption(f"{icon} {name}: {state}")
+        st.caption(f"💾 Session: {st.session_state.session_id}")
 
 def display_story():
     """Enhanced story display"""
@@ -130,13 +170,14 @@ def handle_choice_selection():
     
     # Display choices in a more engaging way
     cols = st.columns(min(len(st.session_state.choices), 2))
+    # Add icons based on choice type (classified together, and remembered across reruns)
+    icons = choice_classifier.icons(st.session_state.choices)
     
     for i, choice in enumerate(st.session_state.choices):
         col = cols[i % len(cols)]
         
         with col:
-            # Add icons based on choice type
-            icon = get_choice_icon(choice["text"])
+            icon = icons[i]
             
             if st.button(
                 f"{icon} {choice['text']}", 
@@ -148,61 +189,37 @@ def handle_choice_selection():
     
     return None
 
-def get_choice_icon(choice_text):
-    """Get appropriate icon for choice type"""
-    text_lower = choice_text.lower()
-    if any(word in text_lower for word in ["inspect", "examine", "look", "search"]):
-        return "🔍"
-    elif any(word in text_lower for word in ["talk", "speak", "ask", "question"]):
-        return "💬"
-    elif any(word in text_lower for word in ["fight", "attack", "defend"]):
-        return "⚔️"
-    elif any(word in text_lower for word in ["leave", "go", "move", "walk"]):
-        return "🚶"
-    elif any(word in text_lower for word in ["use", "take", "grab"]):
-        return "🤲"
-    else:
-        return "✨"
-
 def generate_with_progress(selected_choice):
-    """Generate next scene with progress indication"""
-    progress_container = st.empty()
-    status_container = st.empty()
+    """Generate next scene, streaming its text onto the page as tokens arrive"""
+    # Served instantly if the branch was generated while the player was reading; a branch
+    # still running is waited on, since it is already ahead of a fresh live generation
+    with st.spinner("Finishing the next scene..."):
+        next_node = st.session_state.prefetcher.take(selected_choice["text"])
+    if next_node:
+        return next_node
     
-    with progress_container.container():
-        progress_bar = st.progress(0)
-        
-        # Simulate progress steps
-        steps = [
-            "🤖 Thinking about your choice...",
-            "📝 Crafting the next scene...", 
-            "🎭 Adding dramatic elements...",
-            "✨ Finalizing the story..."
-        ]
-        
-        for i, step in enumerate(steps):
-            status_container.info(step)
-            progress_bar.progress((i + 1) / len(steps))
-            time.sleep(0.5)
+    stream_container = st.empty()
     
-    # Generate content
     try:
-        next_node = generate_next_node_ollama(
+        stream = get_backend().stream_next_node_ollama(
             st.session_state.current_text,
             selected_choice["text"],
             st.session_state.history,
-            st.session_state.story_meta
+            st.session_state.story_meta,
+            memory=st.session_state.memory
         )
         
-        # Clear progress indicators
-        progress_container.empty()
-        status_container.empty()
+        with stream_container.container():
+            st.markdown("### Next Scene")
+            st.write_stream(stream)
         
-        return next_node
+        # Clear the live preview; the rerun renders the finished scene
+        stream_container.empty()
+        
+        return stream.node
         
     except Exception as e:
-        progress_container.empty()
-        status_container.error(f"Generation failed: {e}")
+        stream_container.error(f"Generation failed: {e}")
         return None
 
 def main():
@@ -214,27 +231,40 @@ def main():
     selected_choice = handle_choice_selection()
     
     if selected_choice:
+        get_backend().get_warmup().touch()
         next_node = generate_with_progress(selected_choice)
         
         if next_node:
             # Update game state
-            st.session_state.history.append({
-                "choice": selected_choice["text"],
-                "choices": next_node.get("choices", []),
-                "timestamp": datetime.now().isoformat()
-            })
+            record_turn(
+                st.session_state.history,
+                st.session_state.memory,
+                selected_choice["text"],
+                next_node,
+                timestamp=datetime.now().isoformat()
+            )
             st.session_state.current_text = next_node["text"]
             st.session_state.choices = next_node.get("choices", [])
             st.session_state.generation_count += 1
             
-            # Auto-save
-            save_game({
+            # Auto-save in the background so the next scene renders right away
+            queue_save(st.session_state.session_id, {
                 "current_text": st.session_state.current_text,
                 "history": st.session_state.history,
+                "memory": st.session_state.memory.to_dict(),
                 "story_meta": st.session_state.story_meta
             })
             
             st.rerun()
+    else:
+        # Generate every branch in the background while the player reads
+        st.session_state.prefetcher.start(
+            st.session_state.current_text,
+            st.session_state.choices,
+            st.session_state.history,
+            st.session_state.story_meta,
+            memory=st.session_state.memory
+        )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
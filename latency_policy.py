@@ -0,0 +1,146 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import metrics
+from metrics import percentile
+
+TURN_BUDGET = float(os.environ.get("STORY_TURN_BUDGET", "90"))  # Seconds a turn may spend on attempts
+POLICY_LOG = os.environ.get("STORY_POLICY_LOG")  # JSON-lines file of retry/deadline decisions
+
+DEFAULT_TIMEOUT = 30     # Deadline before enough warm samples exist
+COLD_TIMEOUT = 120       # Deadline when the model probably has to be loaded first
+MIN_TIMEOUT = 5          # Never give an attempt less than this
+MIN_SAMPLES = 5          # Warm samples needed before deadlines are learned
+DEADLINE_PERCENTILE = 99
+HEADROOM = 2.0           # Deadline = percentile latency * headroom
+COLD_AFTER = 30 * 60     # Idle seconds after which Ollama has likely unloaded the model (its keep_alive)
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 4.0
+
+
+class LatencyPolicy:
+    """Per-attempt deadlines learned from observed latency, with jittered retries inside a turn budget
+
+    Warm and cold calls are tracked separately: a call is expected to be
+    cold when nothing has succeeded for `cold_after` seconds (Ollama will
+    have unloaded the model). A warm deadline is the warm p99 latency
+    times `headroom`; a cold one is at least `cold_timeout`. Failed attempts
+    are retried after full-jitter exponential backoff as long as the next
+    attempt still fits the turn budget. Every decision is kept in
+    `decisions` (and appended to `log_path` when set) for tuning.
+    """
+
+    def __init__(self, turn_budget=TURN_BUDGET, default_timeout=DEFAULT_TIMEOUT, cold_timeout=COLD_TIMEOUT,
+                 min_timeout=MIN_TIMEOUT, max_attempts=MAX_ATTEMPTS, cold_after=COLD_AFTER,
+                 log_path=POLICY_LOG, window=200, rng=None):
+        self.turn_budget = turn_budget
+        self.default_timeout = default_timeout
+        self.cold_timeout = cold_timeout
+        self.min_timeout = min_timeout
+        self.max_attempts = max_attempts
+        self.cold_after = cold_after
+        self.log_path = log_path
+        self.warm = deque(maxlen=window)
+        self.cold = deque(maxlen=window)
+        self.decisions = deque(maxlen=window)
+        self._last_success = None
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def expect_cold(self):
+        last = self._last_success
+        return last is None or time.monotonic() - last > self.cold_after
+
+    def deadline(self, cold=None):
+        """Timeout for the next attempt"""
+        cold = self.expect_cold() if cold is None else cold
+        with self._lock:
+            warm = list(self.warm)
+            cold_samples = list(self.cold)
+        if cold:
+            learned = percentile(cold_samples, DEADLINE_PERCENTILE) * HEADROOM if cold_samples else 0.0
+            return max(self.cold_timeout, learned)
+        if len(warm) < MIN_SAMPLES:
+            return self.default_timeout
+        return max(self.min_timeout, percentile(warm, DEADLINE_PERCENTILE) * HEADROOM)
+
+    def mark_warm(self):
+        """Note that the model was just loaded (e.g. by a warm-up ping), so the next call is warm"""
+        with self._lock:
+            self._last_success = time.monotonic()
+
+    def observe(self, seconds, cold=False):
+        """Record a successful call's latency"""
+        with self._lock:
+            (self.cold if cold else self.warm).append(seconds)
+            self._last_success = time.monotonic()
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff before retry number `attempt` (1-based)"""
+        return self._rng.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+    def call(self, attempt_fn, retry_on=(Exception,), observe=True):
+        """Run attempt_fn(timeout) until it succeeds or the attempts/turn budget run out
+
+        The last error is re-raised when giving up. With observe=False the
+        successful attempt's latency is left for the caller to observe(),
+        e.g. when the attempt only starts a stream.
+        """
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            cold = self.expect_cold()
+            remaining = self.turn_budget - (time.monotonic() - started)
+            timeout = min(self.deadline(cold), remaining)
+            attempt_started = time.monotonic()
+            try:
+                result = attempt_fn(timeout)
+            except retry_on as e:
+                elapsed = time.monotonic() - attempt_started
+                if isinstance(e, TimeoutError):
+                    metrics.inc("attempt_timeouts")
+                pause = self.backoff(attempt)
+                left = self.turn_budget - (time.monotonic() - started) - pause
+                retry = attempt < self.max_attempts and left >= self.min_timeout
+                self._decide(attempt=attempt, cold=cold, timeout=timeout, outcome=type(e).__name__,
+                             seconds=elapsed, retry=retry, backoff=pause if retry else 0.0)
+                if not retry:
+                    raise
+                metrics.inc("retries")
+                time.sleep(pause)
+                continue
+            elapsed = time.monotonic() - attempt_started
+            if observe:
+                self.observe(elapsed, cold)
+            self._decide(attempt=attempt, cold=cold, timeout=timeout, outcome="ok", seconds=elapsed)
+            return result
+
+    def _decide(self, **decision):
+        decision["ts"] = time.time()
+        with self._lock:
+            self.decisions.append(decision)
+        if self.log_path:
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(decision) + "\n")
+            except OSError as e:
+                print(f"⚠️ Could not write policy log: {e}")
+
+    def metrics(self):
+        with self._lock:
+            warm = list(self.warm)
+            cold = list(self.cold)
+        return {
+            "warm_samples": len(warm),
+            "warm_p50": percentile(warm, 50),
+            "warm_p99": percentile(warm, 99),
+            "cold_samples": len(cold),
+            "cold_p50": percentile(cold, 50),
+            "next_deadline": self.deadline(),
+        }
@@ -1,101 +1,472 @@
-import subprocess
+import atexit
 import json
-import re
 import os
+import sys
+import time
+import choice_classifier
+import metrics
+import prompt_builder
 from story_data import STORY_TREE
-from utils import save_game, load_game
+from utils import queue_save, load_game, DEFAULT_SESSION
+from ollama_client import OllamaClient, OllamaError
+from scene_stream import SceneStreamParser, SceneFormatError, parse_scene
+from latency_policy import LatencyPolicy
+from story_memory import load_memory, record_turn, estimate_tokens
+
+# subprocess, the model router, generation cache, story graph, similarity index and prefetcher are
+# imported where first used, so importing this module (e.g. from the UI) stays cheap
 
 OLLAMA_MODEL = "llama3.1:8b"  # replace with your local model name
+OLLAMA_TIMEOUT = 30  # seconds; per-attempt deadlines come from the latency policy once it has samples
+# Several backends to route between, e.g. "llama3.1:8b,phi3:mini@gpu-box:11434" (model[@host])
+STORY_MODELS = os.environ.get("STORY_MODELS", "")
+CACHE_PATH = os.environ.get("STORY_CACHE_PATH", "generation_cache.db")
+# Story graph files (<path>.dat / <path>.idx); set to an empty string to disable
+GRAPH_PATH = os.environ.get("STORY_GRAPH_PATH", "story_graph")
+# Ask Ollama for schema-constrained JSON (needs Ollama 0.5+; set to 0 for older servers)
+STRUCTURED_OUTPUT = os.environ.get("STORY_STRUCTURED_OUTPUT", "1") != "0"
+# Reuse the scene of a differently worded but equivalent choice above this score; empty disables
+SIMILARITY_THRESHOLD = os.environ.get("STORY_SIMILARITY_THRESHOLD", "0.8")
+TRAILING_CHUNKS = 16  # Chunks read past a complete scene while waiting for Ollama's done chunk
 
-def generate_next_node_ollama(current_text, choice_text, history, story_meta=None):
-    # Build context from history for better coherence
-    context = ""
+# Environment for the `ollama run` fallback, built once instead of on every call
+SUBPROCESS_ENV = dict(os.environ, PYTHONIOENCODING='utf-8')
+
+_client = None
+_cache = None
+_graph = None
+_policy = None
+_warmup = None
+_similar = None
+
+def get_client():
+    """Shared Ollama HTTP client so keep-alive connections survive between scenes
+
+    With STORY_MODELS set this is a ModelRouter over those backends instead.
+    """
+    global _client
+    if _client is None:
+        if STORY_MODELS:
+            from model_router import ModelRouter, parse_backends
+            _client = ModelRouter(parse_backends(STORY_MODELS, timeout=OLLAMA_TIMEOUT))
+        else:
+            _client = OllamaClient(OLLAMA_MODEL, timeout=OLLAMA_TIMEOUT)
+    return _client
+
+def get_policy():
+    """Shared latency policy, so deadlines are learned across turns"""
+    global _policy
+    if _policy is None:
+        _policy = LatencyPolicy(default_timeout=OLLAMA_TIMEOUT)
+    return _policy
+
+def get_warmup():
+    """Shared warm-up manager for the configured model(s); call start() to begin preloading"""
+    global _warmup
+    if _warmup is None:
+        from warmup import WarmupManager
+        client = get_client()
+        clients = [backend.client for backend in client.backends] if hasattr(client, "backends") else [client]
+        _warmup = WarmupManager(clients, on_warm=lambda _: get_policy().mark_warm())
+    return _warmup
+
+def get_cache():
+    """Shared generation cache (memory LRU backed by SQLite at CACHE_PATH)"""
+    global _cache
+    if _cache is None:
+        from generation_cache import default_cache
+        _cache = default_cache(CACHE_PATH)
+    return _cache
+
+def get_graph():
+    """Shared story graph seeded with STORY_TREE, or None when disabled"""
+    global _graph
+    if _graph is None and GRAPH_PATH:
+        from story_graph import StoryGraph
+        _graph = StoryGraph(GRAPH_PATH)
+        if not len(_graph):
+            _graph.add_tree(STORY_TREE)
+        atexit.register(_graph.flush)
+    return _graph
+
+def get_similar():
+    """Shared index of choices already expanded from each scene, or None when disabled"""
+    global _similar
+    if _similar is None and SIMILARITY_THRESHOLD:
+        from similarity_index import SimilarityIndex
+        _similar = SimilarityIndex(threshold=float(SIMILARITY_THRESHOLD))
+    return _similar
+
+def offered_choices(current_text, history):
+    """Texts of the choices the current scene offers, as far as the history (or story tree) tells"""
     if history:
-        recent_history = history[-3:]  # Last 3 choices for context
-        context = "\n".join([f"Previously: {h.get('choice', '')}" for h in recent_history])
-    
-    # Get story metadata for consistency
-    meta = story_meta or STORY_TREE.get("meta", {})
-    genre = meta.get("genre", "Adventure")
-    tone = meta.get("tone", "mysterious")
-    
-    prompt = f"""You are an expert {genre.lower()} storyteller. 
-
-STORY CONTEXT:
-Genre: {genre}
-Tone: {tone}
-{context}
-
-CURRENT SCENE:
-{current_text}
-
-PLAYER ACTION: {choice_text}
-
-INSTRUCTIONS:
-- Continue the story with 2-3 engaging sentences
-- Maintain {genre.lower()} genre and {tone} tone
-- Create 2-4 meaningful choices that advance the plot
-- Each choice should lead to different story paths
-- Keep choices concise but descriptive
-- Ensure narrative coherence with previous events
-
-RESPONSE FORMAT (JSON only):
-{{
-    "text": "Next scene description (2-3 sentences)",
-    "choices": [
-        {{"id": "choice1", "text": "Action-oriented choice"}},
-        {{"id": "choice2", "text": "Investigation choice"}},
-        {{"id": "choice3", "text": "Social/dialogue choice"}},
-        {{"id": "choice4", "text": "Creative/alternative choice"}}
-    ]
-}}"""
+        choices = history[-1].get("choices") or []
+    elif current_text == STORY_TREE["nodes"]["start"]["text"]:
+        choices = STORY_TREE["nodes"]["start"]["choices"]
+    else:
+        choices = []
+    return [choice["text"] for choice in choices if isinstance(choice, dict) and "text" in choice]
+
+def lookup_scene(key, current_text, choice_text, offered=()):
+    """A scene already known for this choice
+
+    An authored branch of the story graph, else a generated one written for
+    the same story so far (`key`), else a cached generation, else the scene of
+    an equivalent, differently worded choice from the same scene. `offered`
+    are the scene's own choices, which are never taken for rewordings of each other.
+    """
+    similar = get_similar()
+    node = None
+    graph = get_graph()
+    if graph is not None:
+        # Authored branches are the same for every player; generated ones depend on the
+        # story memory, genre and tone, like the cache key
+        node = graph.child(current_text, choice_text) or graph.child(current_text, choice_text, key)
+        if node is not None:
+            metrics.inc("graph_hits")
+            node = {"text": node["text"], "choices": node["choices"]}
+    if node is None:
+        node = get_cache().get(key)
+    if node is not None:
+        if similar is not None:
+            similar.add(current_text, choice_text, node)
+        return node
+    if similar is not None:
+        match = similar.find(current_text, choice_text, offered)
+        if match is not None:
+            # Served for this turn only: a near match is never written into the graph or
+            # cache, so a wrong one can't become a permanent branch
+            metrics.inc("similar_hits")
+            return match[0]
+    return None
+
+def store_scene(key, current_text, choice_text, node):
+    """Remember a generated scene in the cache, as a branch of the story graph and for similar choices"""
+    get_cache().put(key, node)
+    graph = get_graph()
+    if graph is not None:
+        graph.add(node, current_text, choice_text, key)
+    similar = get_similar()
+    if similar is not None:
+        similar.add(current_text, choice_text, node)
 
+def scene_cache_key(current_text, choice_text, history, story_meta=None, memory=None):
+    """Cache key for a scene, using the same defaults as build_prompt"""
+    from generation_cache import make_cache_key
+    context = memory.context() if memory is not None else None
+    return make_cache_key(current_text, choice_text, history, story_meta or STORY_TREE.get("meta", {}), context)
+
+def output_format():
+    """Value for Ollama's `format` parameter"""
+    return prompt_builder.SCENE_SCHEMA if STRUCTURED_OUTPUT else None
+
+def run_ollama_subprocess(prompt, timeout=None):
+    """Generate a reply by spawning `ollama run` (used when the HTTP API is unreachable)"""
+    import subprocess
+
+    timeout = timeout or OLLAMA_TIMEOUT
+    command = ["ollama", "run", OLLAMA_MODEL]
+    if STRUCTURED_OUTPUT:
+        command += ["--format", "json"]  # The CLI only supports plain JSON mode
     try:
-        # Set environment variables for proper encoding
-        env = os.environ.copy()
-        env['PYTHONIOENCODING'] = 'utf-8'
-        
         result = subprocess.run(
-            ["ollama", "run", OLLAMA_MODEL],
-            input=prompt,
+            command,
+            input=prompt_builder.flatten(prompt),
             capture_output=True,
             text=True,
             encoding='utf-8',  # Force UTF-8 encoding
             errors='replace',  # Replace problematic characters
             check=True,
-            timeout=30,
-            env=env  # Pass environment with UTF-8 setting
+            timeout=timeout,
+            env=SUBPROCESS_ENV  # Pass environment with UTF-8 setting
         )
-        
-        output = result.stdout.strip()
-        
-        # Enhanced JSON extraction
-        json_match = re.search(r'\{.*\}', output, re.DOTALL)
-        if json_match:
-            json_str = json_match.group()
-            parsed = json.loads(json_str)
-            
-            # Validate response structure
-            if validate_response(parsed):
-                return parsed
-            else:
-                raise ValueError("Invalid response structure")
-        else:
-            raise ValueError("No JSON found in response")
-            
-    except subprocess.TimeoutExpired:
+    except subprocess.TimeoutExpired as e:
+        # Report it like an API timeout so callers only need to handle TimeoutError
+        raise TimeoutError(f"`ollama run` timed out after {timeout:.0f}s") from e
+    return result.stdout.strip()
+
+def call_ollama(prompt, timeout=None):
+    """Generate a reply via the Ollama HTTP API, falling back to the `ollama run` subprocess"""
+    try:
+        with metrics.span("generation"):
+            reply = get_client().generate(prompt.prompt, system=prompt.system, format=output_format(), timeout=timeout)
+            return reply["response"].strip()
+    except OllamaError as e:
+        metrics.inc("api_unavailable")
+        print(f"⚠️ Ollama API unavailable ({e}). Falling back to `ollama run`...")
+    with metrics.span("subprocess_generation"):
+        return run_ollama_subprocess(prompt, timeout)
+
+def build_prompt(current_text, choice_text, history, story_meta=None, memory=None):
+    """Build the scene-generation prompt as a static system prefix plus a per-turn prompt"""
+    # Build context from story memory (or recent history) for better coherence
+    context = ""
+    if memory is not None:
+        context = memory.context()
+    elif history:
+        recent_history = history[-3:]  # Last 3 choices for context
+        context = "\n".join([f"Previously: {h.get('choice', '')}" for h in recent_history])
+    
+    # Get story metadata for consistency
+    meta = story_meta or STORY_TREE.get("meta", {})
+    return prompt_builder.build(current_text, choice_text, context, meta)
+
+def parse_response(output):
+    """Parse and validate the scene JSON from raw model output"""
+    with metrics.span("parse"):
+        parsed = parse_scene(output)
+
+    # Validate response structure
+    with metrics.span("validate"):
+        valid = validate_response(parsed)
+    if not valid:
+        raise ValueError("Invalid response structure")
+    return parsed
+
+def handle_generation_error(error, choice_text, output=None):
+    """Report a failed generation and return the fallback scene"""
+    metrics.inc("fallbacks")
+    if output:
+        metrics.inc("wasted_tokens", estimate_tokens(output))
+
+    if isinstance(error, TimeoutError):
+        metrics.inc("timeouts")
         print("⚠️ Generation timed out. Using fallback...")
-        return create_fallback_response(choice_text)
-    except json.JSONDecodeError as e:
-        print(f"⚠️ JSON parsing failed: {e}")
-        print(f"Raw output: {result.stdout if 'result' in locals() else 'No output'}")
-        return create_fallback_response(choice_text)
-    except UnicodeDecodeError as e:
-        print(f"⚠️ Unicode error: {e}")
-        return create_fallback_response(choice_text)
+    elif isinstance(error, SceneFormatError):
+        metrics.inc("parse_failures")
+        print(f"⚠️ Malformed scene: {error}")
+    elif isinstance(error, json.JSONDecodeError):
+        metrics.inc("parse_failures")
+        print(f"⚠️ JSON parsing failed: {error}")
+        print(f"Raw output: {output if output is not None else 'No output'}")
+    elif isinstance(error, UnicodeDecodeError):
+        print(f"⚠️ Unicode error: {error}")
+    else:
+        print(f"⚠️ Generation failed: {error}")
+    return create_fallback_response(choice_text)
+
+def generate_next_node_ollama(current_text, choice_text, history, story_meta=None, memory=None):
+    # Identical inputs always produce an equivalent scene, so serve repeats from cache
+    with metrics.span("cache_lookup"):
+        key = scene_cache_key(current_text, choice_text, history, story_meta, memory)
+        cached = lookup_scene(key, current_text, choice_text, offered_choices(current_text, history))
+    if cached is not None:
+        return cached
+
+    with metrics.span("prompt_build"):
+        prompt = build_prompt(current_text, choice_text, history, story_meta, memory)
+
+    output = None
+
+    def attempt(timeout):
+        nonlocal output
+        if output:
+            # The previous attempt's reply was unusable
+            metrics.inc("wasted_tokens", estimate_tokens(output))
+        output = None
+        output = call_ollama(prompt, timeout)
+        return parse_response(output)
+
+    try:
+        # Timeouts, unreachable backends and malformed replies are retried within the turn budget
+        node = get_policy().call(attempt, retry_on=(TimeoutError, OllamaError, ValueError))
+        metrics.inc("generated")
+        with metrics.span("cache_store"):
+            store_scene(key, current_text, choice_text, node)
+        return node
     except Exception as e:
-        print(f"⚠️ Generation failed: {e}")
-        return create_fallback_response(choice_text)
+        with metrics.span("fallback"):
+            return handle_generation_error(e, choice_text, output)
+
+def finish_stream(stream, limit=TRAILING_CHUNKS):
+    """Read what follows a complete scene, up to Ollama's done chunk, so the connection is pooled again
+
+    The done chunk comes right after the closing brace. A model still
+    writing after `limit` chunks is cut off instead when the caller closes the
+    stream. Returns the done chunk, or None.
+    """
+    for n, chunk in enumerate(stream):
+        if chunk.get("done"):
+            return chunk
+        if n >= limit:
+            return None
+    return None
+
+class SceneStream:
+    """Iterate to receive the next scene's text as tokens arrive
+
+    Once iteration finishes, `node` holds the parsed scene (text and choices),
+    or the fallback scene if generation failed.
+    """
+
+    def __init__(self, current_text, choice_text, history, story_meta=None, memory=None):
+        with metrics.span("prompt_build"):
+            self.prompt = build_prompt(current_text, choice_text, history, story_meta, memory)
+        self.key = scene_cache_key(current_text, choice_text, history, story_meta, memory)
+        self.offered = offered_choices(current_text, history)
+        self.current_text = current_text
+        self.choice_text = choice_text
+        self.node = None
+
+    def __iter__(self):
+        cached = lookup_scene(self.key, self.current_text, self.choice_text, self.offered)
+        if cached is not None:
+            self.node = cached
+            yield cached["text"]
+            return
+
+        parser = SceneStreamParser()
+        parts = []
+        output = None
+        # Timed by hand: a span around a generator would also count the consumer's time
+        started = time.perf_counter()
+        policy = get_policy()
+        attempt_started = cold = None
+
+        def open_stream(timeout):
+            """Start a stream and read up to the first scene text; failing before then is retried"""
+            nonlocal parser, parts, output, attempt_started, cold
+            if parts:
+                # The previous attempt's reply was unusable
+                metrics.inc("wasted_tokens", estimate_tokens("".join(parts)))
+            parser, parts, output = SceneStreamParser(), [], None
+            attempt_started, cold = time.perf_counter(), policy.expect_cold()
+            stream = get_client().generate_stream(
+                self.prompt.prompt, system=self.prompt.system, format=output_format(), timeout=timeout
+            )
+            try:
+                for chunk in stream:
+                    token = chunk.get("response", "")
+                    parts.append(token)
+                    fragment = parser.feed(token)
+                    if fragment or parser.done:
+                        return stream, fragment
+                parser.result()  # Ended before any scene text: raises SceneFormatError
+            except BaseException as e:
+                if isinstance(e, SceneFormatError):
+                    metrics.inc("aborted_early")
+                output = "".join(parts)
+                stream.close()
+                raise
+
+        try:
+            try:
+                # Nothing has been shown until the first fragment, so timeouts, unreachable
+                # backends and malformed openings are retried within the turn budget
+                stream, fragment = policy.call(
+                    open_stream, retry_on=(TimeoutError, OllamaError, ValueError), observe=False
+                )
+                # Time spent reading the stream, up to the last token; the time the consumer
+                # takes between fragments (rendering them) is left out
+                generation = time.perf_counter() - attempt_started
+                paused = 0.0
+                if fragment:
+                    metrics.observe("first_text", time.perf_counter() - started)
+                    resumed = time.perf_counter()
+                    yield fragment
+                    paused += time.perf_counter() - resumed
+                # No retries from here on: the player is already reading this attempt's text
+                try:
+                    if parser.done:
+                        finish_stream(stream)
+                    else:
+                        for chunk in stream:
+                            token = chunk.get("response", "")
+                            parts.append(token)
+                            generation = time.perf_counter() - attempt_started - paused
+                            fragment = parser.feed(token)
+                            if fragment:
+                                resumed = time.perf_counter()
+                                yield fragment
+                                paused += time.perf_counter() - resumed
+                            if parser.done:
+                                finish_stream(stream)
+                                break
+                except SceneFormatError:
+                    # Stop paying for a reply that can no longer be valid
+                    metrics.inc("aborted_early")
+                    output = "".join(parts)
+                    raise
+                finally:
+                    stream.close()
+                output = "".join(parts).strip()
+                metrics.observe("stream_generation", generation)
+            except OllamaError as e:
+                if parser.started:
+                    raise
+                metrics.inc("api_unavailable")
+                print(f"⚠️ Ollama API unavailable ({e}). Falling back to `ollama run`...")
+                parser = SceneStreamParser()
+                with metrics.span("subprocess_generation"):
+                    output = run_ollama_subprocess(self.prompt, policy.deadline())
+                generation = None
+                fragment = parser.feed(output)
+                if fragment:
+                    yield fragment
+            self.node = parse_response(output)
+            if generation is not None:
+                policy.observe(generation, cold)
+            metrics.inc("generated")
+            store_scene(self.key, self.current_text, self.choice_text, self.node)
+        except Exception as e:
+            self.node = handle_generation_error(e, self.choice_text, output)
+            # Whatever was streamed so far is discarded; show the fallback scene instead
+            yield ("\n\n" if parser.started else "") + self.node["text"]
+
+def stream_next_node_ollama(current_text, choice_text, history, story_meta=None, memory=None):
+    """Streaming counterpart of generate_next_node_ollama; see SceneStream"""
+    return SceneStream(current_text, choice_text, history, story_meta, memory)
+
+def generate_next_node_cancellable(current_text, choice_text, history, story_meta=None, cancel=None, memory=None):
+    """Generate a scene for speculative prefetch, stopping early once `cancel` is set
+
+    Returns (node, tokens). node is None if the generation was cancelled or
+    failed, so the caller can fall back to a normal live generation.
+    """
+    key = scene_cache_key(current_text, choice_text, history, story_meta, memory)
+    cached = lookup_scene(key, current_text, choice_text, offered_choices(current_text, history))
+    if cached is not None:
+        return cached, 0
+
+    prompt = build_prompt(current_text, choice_text, history, story_meta, memory)
+    parser = SceneStreamParser()
+    tokens = 0
+    policy = get_policy()
+    cold = policy.expect_cold()
+    started = time.perf_counter()
+    try:
+        stream = get_client().generate_stream(
+            prompt.prompt, system=prompt.system, format=output_format(), timeout=policy.deadline(cold)
+        )
+        try:
+            for chunk in stream:
+                if cancel is not None and cancel.is_set():
+                    return None, tokens
+                if chunk.get("done"):
+                    tokens = chunk.get("eval_count", tokens)
+                elif chunk.get("response"):
+                    tokens += 1
+                    parser.feed(chunk["response"])
+                    if parser.done:
+                        final = finish_stream(stream)
+                        if final is not None:
+                            tokens = final.get("eval_count", tokens)
+                        break
+        except SceneFormatError:
+            metrics.inc("aborted_early")
+            metrics.inc("wasted_tokens", tokens)
+            raise
+        finally:
+            # Closing an unfinished stream drops the connection so Ollama stops generating
+            stream.close()
+        node = parser.result()
+        if not validate_response(node):
+            return None, tokens
+        policy.observe(time.perf_counter() - started, cold)
+        store_scene(key, current_text, choice_text, node)
+        return node, tokens
+    except Exception:
+        return None, tokens
 
 def validate_response(response):
     """Validate AI response structure"""
@@ -138,10 +509,10 @@ def create_fallback_response(choice_text=""):
         }
     }
     
-    # Choose fallback based on choice keywords
-    for keyword, fallback in fallbacks.items():
-        if keyword.lower() in choice_text.lower():
-            return fallback
+    # Choose fallback based on the choice's intent
+    for intent in choice_classifier.classify(choice_text):
+        if intent in fallbacks:
+            return fallbacks[intent]
     
     # Default fallback
     return {
@@ -152,8 +523,8 @@ def create_fallback_response(choice_text=""):
         ]
     }
 
-def run():
-    state = load_game()
+def run(session_id=DEFAULT_SESSION):
+    state = load_game(session_id)
     if state:
         current_text = state.get("current_text", STORY_TREE["nodes"]["start"]["text"])
         history = state.get("history", [])
@@ -165,34 +536,57 @@ def run():
         current_text = STORY_TREE["nodes"]["start"]["text"]
         history = []
         choices = STORY_TREE["nodes"]["start"]["choices"]
+    memory = load_memory(state)
+
+    # Load the model while the player reads the opening scene
+    warmup = get_warmup()
+    warmup.start()
+    from prefetch import Prefetcher
+    prefetcher = Prefetcher(generate_next_node_cancellable)
+    print(f"\n{current_text}\n")
 
     while True:
-        print(f"\n{current_text}\n")
-        
         print("Your choices:")
         for i, choice in enumerate(choices, 1):
             print(f"{i}. {choice['text']}")
         
+        # Start generating every branch while the player decides
+        prefetcher.start(current_text, choices, history, memory=memory)
+        
         try:
             choice_num = int(input("\nEnter your choice (number): ")) - 1
             if 0 <= choice_num < len(choices):
                 selected_choice = choices[choice_num]
+                warmup.touch()
                 
-                print("Generating next scene...")
-                next_node = generate_next_node_ollama(current_text, selected_choice["text"], history)
+                print()
+                if prefetcher.running(selected_choice["text"]):
+                    print("Finishing the next scene...\n")
+                next_node = prefetcher.take(selected_choice["text"])
+                if next_node:
+                    print(f"{next_node['text']}\n")
+                else:
+                    # Stream the scene to the console as it is generated
+                    stream = stream_next_node_ollama(current_text, selected_choice["text"], history, memory=memory)
+                    for fragment in stream:
+                        print(fragment, end="", flush=True)
+                    print("\n")
+                    next_node = stream.node
                 
-                history.append({"choice": selected_choice["text"], "choices": next_node.get("choices", [])})
+                record_turn(history, memory, selected_choice["text"], next_node)
                 current_text = next_node["text"]
                 choices = next_node.get("choices", [])
                 
-                # Auto-save
-                save_game({"current_text": current_text, "history": history})
+                # Auto-save in the background; the next scene doesn't wait for the disk
+                queue_save(session_id, {"current_text": current_text, "history": history, "memory": memory.to_dict()})
                 
             else:
                 print("Invalid choice. Please try again.")
         except (ValueError, KeyboardInterrupt):
             print("\nGame ended.")
+            prefetcher.shutdown()
+            warmup.stop()
             break
 
 if __name__ == "__main__":
-    run()
+    run(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SESSION)
@@ -0,0 +1,156 @@
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+# Stage timers are off unless STORY_METRICS=1 (or enable() is called); counters are always kept
+METRICS_ENABLED = os.environ.get("STORY_METRICS", "0") != "0"
+# When set, a JSON-lines snapshot is appended here on exit
+METRICS_FILE = os.environ.get("STORY_METRICS_FILE")
+
+# Histogram bucket upper bounds in seconds, from in-process steps up to slow generations
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_enabled = METRICS_ENABLED
+_counters = {}
+_stages = {}  # stage -> {"count", "sum", "max", "buckets"}
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    """Times a `with` block into its stage histogram"""
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers (0.0 if empty)"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def enabled():
+    return _enabled
+
+
+def span(stage):
+    """Context manager timing a stage; a shared no-op when timers are disabled"""
+    return _Span(stage) if _enabled else _NULL_SPAN
+
+
+def observe(stage, seconds):
+    """Record one duration for a stage"""
+    if not _enabled:
+        return
+    with _lock:
+        entry = _stages.get(stage)
+        if entry is None:
+            entry = _stages[stage] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(BUCKETS)}
+        entry["count"] += 1
+        entry["sum"] += seconds
+        entry["max"] = max(entry["max"], seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                entry["buckets"][i] += 1
+                break
+
+
+def inc(name, value=1):
+    """Add to a counter (timeouts, parse failures, fallbacks, ...)"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def counter(name):
+    return _counters.get(name, 0)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _stages.clear()
+
+
+def snapshot():
+    """Counters and per-stage timing summaries as plain data"""
+    with _lock:
+        counters = dict(_counters)
+        stages = {stage: dict(entry, buckets=list(entry["buckets"])) for stage, entry in _stages.items()}
+    for entry in stages.values():
+        entry["mean"] = entry["sum"] / entry["count"]
+        entry["p50"] = _bucket_quantile(entry, 0.5)
+        entry["p99"] = _bucket_quantile(entry, 0.99)
+        del entry["buckets"]
+    return {"ts": time.time(), "counters": counters, "stages": stages}
+
+
+def _bucket_quantile(entry, q):
+    """Upper bound of the bucket holding the q-quantile (the max if it's past the last bucket)"""
+    rank = q * entry["count"]
+    seen = 0
+    for bound, count in zip(BUCKETS, entry["buckets"]):
+        seen += count
+        if seen >= rank:
+            return min(bound, entry["max"])
+    return entry["max"]
+
+
+def to_json_line():
+    return json.dumps(snapshot(), separators=(",", ":")) + "\n"
+
+
+def write_json_line(path):
+    """Append the current snapshot to a JSON-lines file"""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(to_json_line())
+
+
+def to_prometheus(prefix="story"):
+    """Counters and stage histograms in the Prometheus text exposition format"""
+    with _lock:
+        counters = dict(_counters)
+        stages = {stage: dict(entry, buckets=list(entry["buckets"])) for stage, entry in _stages.items()}
+
+    lines = []
+    for name in sorted(counters):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {counters[name]}")
+    if stages:
+        metric = f"{prefix}_stage_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for stage in sorted(stages):
+            entry = stages[stage]
+            cumulative = 0
+            for bound, count in zip(BUCKETS, entry["buckets"]):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}')
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {entry["sum"]}')
+            lines.append(f'{metric}_count{{stage="{stage}"}} {entry["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+if METRICS_FILE:
+    atexit.register(write_json_line, METRICS_FILE)
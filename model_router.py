@@ -0,0 +1,208 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+from metrics import percentile
+from ollama_client import OllamaClient, OllamaError, OLLAMA_HOST
+
+LATENCY_WINDOW = 50      # Recent calls per backend used for latency and error rate
+MIN_SAMPLES = 5          # Calls before a backend's latency is trusted for hedging
+HEDGE_PERCENTILE = 95    # A request slower than this percentile gets a backup request
+HEDGE_MIN_DELAY = 0.5    # Never hedge sooner than this (seconds)
+MAX_ERROR_RATE = 0.5     # Backends failing more often than this are routed to last
+TRIP_AFTER = 3           # Consecutive failures that take a backend out of rotation
+COOLDOWN = 30            # Seconds a tripped backend sits out before it is tried again
+
+# What counts as a backend failure (anything else is the caller's problem)
+BACKEND_ERRORS = (OllamaError, TimeoutError, OSError)
+
+
+class Backend:
+    """A named client plus its rolling latency and error record"""
+
+    def __init__(self, name, client, window=LATENCY_WINDOW):
+        self.name = name
+        self.client = client
+        self.latencies = deque(maxlen=window)    # Full generate() calls
+        self.first_token = deque(maxlen=window)  # Time to first chunk of a stream
+        self.outcomes = deque(maxlen=window)     # True for success
+        self.consecutive_failures = 0
+        self.tripped_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, ok, seconds=None, streaming=False):
+        with self._lock:
+            self.outcomes.append(ok)
+            if ok:
+                self.consecutive_failures = 0
+                if seconds is not None:
+                    (self.first_token if streaming else self.latencies).append(seconds)
+            else:
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= TRIP_AFTER:
+                    self.tripped_until = time.monotonic() + COOLDOWN
+
+    def error_rate(self):
+        outcomes = list(self.outcomes)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def healthy(self):
+        return time.monotonic() >= self.tripped_until and self.error_rate() <= MAX_ERROR_RATE
+
+    def latency(self, pct=50, streaming=False):
+        """Rolling latency percentile, or None until there are enough samples"""
+        samples = list(self.first_token if streaming else self.latencies)
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return percentile(samples, pct)
+
+    def metrics(self):
+        return {
+            "healthy": self.healthy(),
+            "error_rate": self.error_rate(),
+            "latency_p50": self.latency(50),
+            "latency_p95": self.latency(95),
+            "first_token_p50": self.latency(50, streaming=True),
+            "calls": len(self.outcomes),
+        }
+
+
+class ModelRouter:
+    """Route generations across several model backends by recent latency and health
+
+    Each request goes to the fastest healthy backend (backends without
+    enough history are tried first so they get measured). If a blocking
+    generate() runs past that backend's usual p95 latency, the same request
+    is also sent to the next backend and whichever answers first wins. A
+    failed backend is failed over to the next one; only when every backend
+    has failed does the error reach the caller, which then uses its fallback.
+
+    Backends are any objects with OllamaClient's generate()/generate_stream().
+    """
+
+    def __init__(self, backends, hedge_percentile=HEDGE_PERCENTILE, hedge_min_delay=HEDGE_MIN_DELAY):
+        self.backends = [b if isinstance(b, Backend) else Backend(*b) for b in backends]
+        if not self.backends:
+            raise ValueError("ModelRouter needs at least one backend")
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        # A hedged request can leave its loser running, so allow two calls per backend
+        self._executor = ThreadPoolExecutor(max_workers=2 * len(self.backends), thread_name_prefix="router")
+
+    def ranked(self, streaming=False):
+        """Backends in the order to try them: healthy and fast first"""
+        def key(backend):
+            latency = backend.latency(streaming=streaming)
+            if latency is None:
+                latency = backend.latency(streaming=not streaming)
+            return (not backend.healthy(), latency is not None, latency or 0.0)
+        return sorted(self.backends, key=key)
+
+    def _hedge_delay(self, backend):
+        latency = backend.latency(self.hedge_percentile)
+        if latency is None:
+            return None
+        return max(latency, self.hedge_min_delay)
+
+    def _call(self, backend, prompt, system, format, options, timeout):
+        started = time.perf_counter()
+        try:
+            reply = backend.client.generate(prompt, system=system, format=format, options=options, timeout=timeout)
+        except BACKEND_ERRORS:
+            backend.record(False)
+            raise
+        backend.record(True, time.perf_counter() - started)
+        return dict(reply, backend=backend.name)
+
+    def generate(self, prompt, system=None, format=None, options=None, timeout=None):
+        candidates = iter(self.ranked())
+        pending = {}
+        errors = []
+
+        def launch():
+            backend = next(candidates, None)
+            if backend is not None:
+                future = self._executor.submit(self._call, backend, prompt, system, format, options, timeout)
+                pending[future] = backend
+            return backend
+
+        primary = launch()
+        hedge_delay = self._hedge_delay(primary) if len(self.backends) > 1 else None
+        hedged = False
+        while pending:
+            done, _ = wait(pending, timeout=hedge_delay, return_when=FIRST_COMPLETED)
+            if not done:
+                # Slower than this backend usually is: race a backup request against it
+                hedge_delay = None
+                hedged = launch() is not None
+                if hedged:
+                    metrics.inc("hedged_requests")
+                continue
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    reply = future.result()
+                except BACKEND_ERRORS as e:
+                    errors.append(e)
+                    if not pending and launch() is not None:
+                        metrics.inc("backend_failovers")
+                    continue
+                if hedged and backend is not primary:
+                    metrics.inc("hedge_wins")
+                return reply
+        raise errors[-1]
+
+    def generate_stream(self, prompt, system=None, format=None, options=None, timeout=None):
+        """Stream from the best backend, failing over if it can't start a stream
+
+        Streams are not hedged: the caller is already showing tokens, and
+        switching backends mid-scene would splice two different stories.
+        """
+        errors = []
+        for backend in self.ranked(streaming=True):
+            started = time.perf_counter()
+            stream = backend.client.generate_stream(prompt, system=system, format=format, options=options,
+                                                    timeout=timeout)
+            try:
+                first = next(stream)
+            except StopIteration:
+                backend.record(True, time.perf_counter() - started, streaming=True)
+                return
+            except BACKEND_ERRORS as e:
+                backend.record(False)
+                errors.append(e)
+                metrics.inc("backend_failovers")
+                continue
+            backend.record(True, time.perf_counter() - started, streaming=True)
+            try:
+                yield first
+                yield from stream
+            except BACKEND_ERRORS:
+                backend.record(False)
+                raise
+            finally:
+                stream.close()
+            return
+        raise errors[-1]
+
+    def metrics(self):
+        return {backend.name: backend.metrics() for backend in self.backends}
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for backend in self.backends:
+            backend.client.close()
+
+
+def parse_backends(spec, timeout=30):
+    """Backends from a spec like 'llama3.1:8b, phi3:mini@gpu-box:11434' (model[@host], comma-separated)"""
+    backends = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        model, _, host = entry.partition("@")
+        backends.append(Backend(entry, OllamaClient(model, host=host or OLLAMA_HOST, timeout=timeout)))
+    return backends
@@ -0,0 +1,165 @@
+import json
+import os
+import queue
+
+# http.client (and the email/ssl modules behind it) is imported on first request,
+# which keeps `import main` cheap for the UI
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "localhost:11434")
+DEFAULT_KEEP_ALIVE = "30m"  # How long Ollama keeps the model loaded after a request
+
+
+class OllamaError(Exception):
+    """Raised when the Ollama HTTP API is unreachable or returns an error"""
+
+
+def _split_host(host):
+    """Turn 'http://localhost:11434' or 'localhost:11434' into (hostname, port)"""
+    host = host.split("://", 1)[-1].rstrip("/")
+    if ":" in host:
+        name, port = host.rsplit(":", 1)
+        return name, int(port)
+    return host, 11434
+
+
+class OllamaClient:
+    """Ollama REST client that reuses keep-alive HTTP connections across requests"""
+
+    def __init__(self, model, host=OLLAMA_HOST, keep_alive=DEFAULT_KEEP_ALIVE, timeout=30, pool_size=4):
+        self.model = model
+        self.host, self.port = _split_host(host)
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        # Idle connections ready for reuse; LIFO so the warmest socket goes first
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _acquire(self):
+        """Take an idle pooled connection, or open a new one"""
+        import http.client
+
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, conn):
+        """Return a connection to the pool, closing it if the pool is full"""
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _open(self, method, path, payload=None, timeout=None):
+        """Send a request and return (connection, response) with the body still unread"""
+        import http.client
+
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+
+        while True:
+            conn, reused = self._acquire()
+            conn.timeout = timeout or self.timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(conn.timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except TimeoutError:
+                conn.close()
+                raise
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                # The server may have dropped an idle pooled socket; retry once on a fresh one
+                if reused:
+                    continue
+                raise OllamaError(f"Cannot reach Ollama at {self.host}:{self.port}: {e}") from e
+
+    def _check_status(self, conn, response):
+        """Raise OllamaError for non-200 responses"""
+        if response.status != 200:
+            detail = response.read().decode("utf-8", errors="replace")
+            conn.close()
+            raise OllamaError(f"Ollama returned HTTP {response.status}: {detail}")
+
+    def request_json(self, method, path, payload=None, timeout=None):
+        """Perform a non-streaming API call and return the decoded JSON body"""
+        conn, response = self._open(method, path, payload, timeout)
+        self._check_status(conn, response)
+        try:
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+        self._release(conn)
+        return json.loads(data.decode("utf-8")) if data else {}
+
+    def _payload(self, prompt, system, format, options, stream):
+        """Build a /api/generate request body"""
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+        }
+        if system is not None:
+            payload["system"] = system
+        if format is not None:
+            payload["format"] = format
+        if options:
+            payload["options"] = options
+        return payload
+
+    def generate(self, prompt, system=None, format=None, options=None, timeout=None):
+        """Run a completion and return Ollama's response dict ('response', 'eval_count', ...)"""
+        payload = self._payload(prompt, system, format, options, stream=False)
+        return self.request_json("POST", "/api/generate", payload, timeout)
+
+    def generate_stream(self, prompt, system=None, format=None, options=None, timeout=None):
+        """Run a completion, yielding Ollama's chunk dicts as tokens arrive
+
+        The last chunk has done=True and carries the timing/token counts.
+        Closing the generator before that drops the connection, which makes
+        Ollama stop generating; the connection is only pooled again once the
+        done chunk has been read.
+        """
+        payload = self._payload(prompt, system, format, options, stream=True)
+        conn, response = self._open("POST", "/api/generate", payload, timeout)
+        self._check_status(conn, response)
+
+        finished = False
+        try:
+            for line in response:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise OllamaError(f"Ollama error: {chunk['error']}")
+                # Once the done chunk is out, closing the generator still pools the connection
+                finished = bool(chunk.get("done"))
+                yield chunk
+                if finished:
+                    break
+        finally:
+            if finished:
+                # Drain the chunked-encoding trailer so the socket can be reused
+                response.read()
+                self._release(conn)
+            else:
+                conn.close()
+
+    def load(self, timeout=None):
+        """Load the model into memory (or refresh its keep_alive) without generating anything"""
+        payload = {"model": self.model, "keep_alive": self.keep_alive, "stream": False}
+        return self.request_json("POST", "/api/generate", payload, timeout)
+
+    def running_models(self, timeout=None):
+        """Names of the models Ollama currently holds in memory (/api/ps)"""
+        reply = self.request_json("GET", "/api/ps", timeout=timeout)
+        return {m.get("name") or m.get("model") for m in reply.get("models", [])}
+
+    def close(self):
+        """Close all pooled connections"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,179 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PREFETCH_WORKERS = int(os.environ.get("STORY_PREFETCH_WORKERS", "4"))  # Speculative generations at once, per process
+MAX_QUEUED = 8       # Branches waiting for a worker before new ones are skipped
+
+
+class PrefetchPool:
+    """Worker threads shared by every session's Prefetcher
+
+    The number of speculative generations hitting the model is capped for the
+    whole process, however many sessions are open. At most `max_queued`
+    branches wait behind the running ones; past that submit() returns None and
+    the branch is simply not prefetched.
+    """
+
+    def __init__(self, max_workers=PREFETCH_WORKERS, max_queued=MAX_QUEUED):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queued)
+
+    def submit(self, fn, *args):
+        """Future for fn(*args), or None when the pool is saturated"""
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # Also runs for cancelled futures, so queued branches that are dropped free their slot
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Prefetch pool shared by the whole process"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PrefetchPool()
+        return _pool
+
+
+class Prefetcher:
+    """Speculatively generate the next scene for every offered choice while the player reads
+
+    `generate(current_text, choice_text, history, story_meta, cancel=..., memory=...)` must return
+    (node, tokens): the parsed scene (or None if it failed or was cancelled) and
+    the number of tokens the model produced for it. It should stop early once
+    the `cancel` event is set. Branches run on `pool` (the process-wide
+    get_pool() by default), so each session only owns its pending branches.
+    """
+
+    def __init__(self, generate, pool=None):
+        self._generate = generate
+        self._pool = pool or get_pool()
+        self._lock = threading.RLock()
+        self._scene = None      # (current_text, choice texts) the pending branches belong to
+        self._branches = {}     # choice text -> (future, cancel event)
+        self.stats = {
+            "prefetched": 0,     # Branches started
+            "hits": 0,           # Choices served from a prefetched branch
+            "ready_hits": 0,     # ...of which were already finished when picked
+            "misses": 0,         # Choices that needed a live generation
+            "skipped": 0,        # Branches not started because the shared pool was full
+            "cancelled": 0,      # Losing branches stopped or discarded
+            "used_tokens": 0,
+            "wasted_tokens": 0,
+        }
+
+    def start(self, current_text, choices, history, story_meta=None, memory=None):
+        """Begin generating every choice of the scene being shown (no-op if already started)"""
+        scene = (current_text, tuple(choice["text"] for choice in choices))
+        with self._lock:
+            if scene == self._scene:
+                return
+            self._discard(self._branches)
+            self._scene = scene
+            # Snapshot history and memory so later turns don't leak into running prompts
+            history = list(history)
+            memory = memory.copy() if memory is not None else None
+            self._branches = {}
+            for choice_text in scene[1]:
+                cancel = threading.Event()
+                future = self._pool.submit(
+                    self._run, current_text, choice_text, history, story_meta, cancel, memory
+                )
+                if future is None:
+                    self.stats["skipped"] += 1
+                    continue
+                self._branches[choice_text] = (future, cancel)
+                self.stats["prefetched"] += 1
+
+    def running(self, choice_text):
+        """Whether the branch for this choice has started but not finished, i.e. take() would wait"""
+        with self._lock:
+            branch = self._branches.get(choice_text)
+        return branch is not None and branch[0].running()
+
+    def take(self, choice_text):
+        """Return the prefetched scene for the picked choice, or None if a live call is needed
+
+        All other branches are cancelled at once. A branch that is still
+        generating is waited on until it finishes (its generation has its own
+        deadline), since it is already ahead of a fresh request; one still
+        queued for a worker is dropped instead.
+        """
+        with self._lock:
+            branch = self._branches.pop(choice_text, None)
+            self._discard(self._branches)
+            self._branches = {}
+            self._scene = None
+
+        node = None
+        if branch is not None:
+            future, _ = branch
+            ready = future.done()
+            tokens = 0
+            if future.cancel():
+                pass  # Still queued behind other sessions' branches: a live call starts sooner
+            elif future.exception() is None:  # Blocks until the branch finishes
+                node, tokens = future.result()
+            with self._lock:
+                self.stats["used_tokens"] += tokens
+                if node is not None and ready:
+                    self.stats["ready_hits"] += 1
+
+        with self._lock:
+            self.stats["hits" if node is not None else "misses"] += 1
+        return node
+
+    def cancel(self):
+        """Stop all pending branches (e.g. on new game or load)"""
+        with self._lock:
+            self._discard(self._branches)
+            self._branches = {}
+            self._scene = None
+
+    def metrics(self):
+        """Counters plus hit rate and the share of generated tokens that were thrown away"""
+        with self._lock:
+            metrics = dict(self.stats)
+        picks = metrics["hits"] + metrics["misses"]
+        total_tokens = metrics["used_tokens"] + metrics["wasted_tokens"]
+        metrics["hit_rate"] = metrics["hits"] / picks if picks else 0.0
+        metrics["waste_ratio"] = metrics["wasted_tokens"] / total_tokens if total_tokens else 0.0
+        return metrics
+
+    def shutdown(self):
+        """Cancel this session's pending work (the shared pool keeps running)"""
+        self.cancel()
+
+    def _run(self, current_text, choice_text, history, story_meta, cancel, memory):
+        if cancel.is_set():
+            return None, 0
+        return self._generate(current_text, choice_text, history, story_meta, cancel=cancel, memory=memory)
+
+    def _discard(self, branches):
+        """Cancel branches and book their tokens as wasted once they stop (caller holds the lock)"""
+        for future, cancel in branches.values():
+            cancel.set()
+            future.cancel()
+            self.stats["cancelled"] += 1
+            future.add_done_callback(self._book_waste)
+
+    def _book_waste(self, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        _, tokens = future.result()
+        with self._lock:
+            self.stats["wasted_tokens"] += tokens
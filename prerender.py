@@ -0,0 +1,110 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import main
+from story_data import STORY_TREE
+from story_memory import StoryMemory, record_turn
+
+
+def rendered(graph, scene, choice_text):
+    """Child scene for a choice if it is already in the graph or the generation cache, else None"""
+    meta = STORY_TREE.get("meta", {})
+    key = main.scene_cache_key(scene["text"], choice_text, scene["history"], meta, scene["memory"])
+    child = graph.child(scene["text"], choice_text) or graph.child(scene["text"], choice_text, key)
+    if child is not None:
+        return child
+    cached = main.get_cache().get(key)
+    if cached is not None:
+        graph.add(cached, scene["text"], choice_text, key)
+    return cached
+
+
+def generate(graph, scene, choice_text):
+    """Generate the child scene for a choice (None on failure)"""
+    meta = STORY_TREE.get("meta", {})
+    node = main.generate_next_node_ollama(scene["text"], choice_text, scene["history"], meta, scene["memory"])
+    # Only successful generations are stored; a fallback scene is left for the next run to retry
+    key = main.scene_cache_key(scene["text"], choice_text, scene["history"], meta, scene["memory"])
+    return node if graph.child(scene["text"], choice_text, key) is not None else None
+
+
+def descend(scene, choice_text, node):
+    """The scene reached from `scene` by taking `choice_text`"""
+    history = list(scene["history"])
+    memory = scene["memory"].copy()
+    record_turn(history, memory, choice_text, node)
+    return {"text": node["text"], "choices": node.get("choices", []), "history": history, "memory": memory}
+
+
+def prerender(root="start", depth=3, fanout=4, workers=2, max_scenes=None):
+    """Expand the choice tree under `root` breadth-first into the story graph
+
+    Every finished scene is written to the graph as soon as it is generated,
+    so an interrupted run can simply be started again: branches already in
+    the graph are walked without calling the model.
+    """
+    graph = main.get_graph()
+    if graph is None:
+        raise ValueError("The story graph is disabled (STORY_GRAPH_PATH is empty)")
+    start = STORY_TREE["nodes"].get(root) or graph.get(root)
+    if start is None:
+        raise ValueError(f"Unknown root node: {root}")
+
+    stats = {"generated": 0, "reused": 0, "failed": 0}
+    level = [{"text": start["text"], "choices": start["choices"], "history": [], "memory": StoryMemory()}]
+    # A similar-choice hit is served without being stored, so its branch would never be rendered
+    # (and would count as failed on every rerun); prerender generates every branch instead
+    similar = main._similar, main.SIMILARITY_THRESHOLD
+    main._similar, main.SIMILARITY_THRESHOLD = None, ""
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for d in range(1, depth + 1):
+                started = time.perf_counter()
+                next_level = []
+                jobs = {}
+                for scene in level:
+                    for choice in scene["choices"][:fanout]:
+                        # Branches rendered by an earlier run are walked for free; only
+                        # new generations count against max_scenes
+                        node = rendered(graph, scene, choice["text"])
+                        if node is not None:
+                            stats["reused"] += 1
+                            next_level.append(descend(scene, choice["text"], node))
+                        elif max_scenes is None or stats["generated"] + len(jobs) < max_scenes:
+                            jobs[executor.submit(generate, graph, scene, choice["text"])] = (scene, choice["text"])
+
+                for future in as_completed(jobs):
+                    scene, choice_text = jobs[future]
+                    node = future.result()
+                    if node is None:
+                        stats["failed"] += 1
+                        continue
+                    stats["generated"] += 1
+                    next_level.append(descend(scene, choice_text, node))
+                print(f"Depth {d}: {len(next_level)} scenes in {time.perf_counter() - started:.1f}s "
+                      f"({stats['generated']} generated, {stats['reused']} already rendered, {stats['failed']} failed so far)")
+                level = next_level
+                if not level or (max_scenes is not None and stats["generated"] >= max_scenes):
+                    break
+    finally:
+        main._similar, main.SIMILARITY_THRESHOLD = similar
+        graph.flush()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-render story branches into the story graph without playing")
+    parser.add_argument("--root", default="start", help="Node id to expand from")
+    parser.add_argument("--depth", type=int, default=3, help="Choices deep to expand")
+    parser.add_argument("--fanout", type=int, default=4, help="Choices expanded per scene")
+    parser.add_argument("--workers", type=int, default=2, help="Concurrent generations")
+    parser.add_argument("--max-scenes", type=int, help="Stop after generating this many new scenes")
+    parser.add_argument("--graph", help="Story graph path (defaults to STORY_GRAPH_PATH)")
+    args = parser.parse_args()
+
+    if args.graph:
+        main.GRAPH_PATH = args.graph
+    stats = prerender(args.root, args.depth, args.fanout, args.workers, args.max_scenes)
+    print(f"Done: {stats['generated']} generated, {stats['reused']} already rendered, {stats['failed']} failed "
+          f"(rerun to retry failures)")
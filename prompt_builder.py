@@ -0,0 +1,82 @@
+from collections import namedtuple
+from functools import lru_cache
+
+# `system` is identical for every turn of a story, so Ollama keeps its KV cache
+# and only prefills `prompt`, the part that changes each turn
+Prompt = namedtuple("Prompt", ["system", "prompt"])
+
+# JSON schema passed as Ollama's `format` so decoding is constrained to a valid scene
+SCENE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "text": {"type": "string"},
+        "choices": {
+            "type": "array",
+            "minItems": 2,
+            "maxItems": 4,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "text": {"type": "string"},
+                },
+                "required": ["id", "text"],
+            },
+        },
+    },
+    "required": ["text", "choices"],
+}
+
+
+@lru_cache(maxsize=64)
+def system_prompt(genre="Adventure", tone="mysterious"):
+    """Static persona, instructions and JSON schema for a story's genre and tone"""
+    return f"""You are an expert {genre.lower()} storyteller.
+
+STORY SETTINGS:
+Genre: {genre}
+Tone: {tone}
+
+INSTRUCTIONS:
+- Continue the story with 2-3 engaging sentences
+- Maintain {genre.lower()} genre and {tone} tone
+- Create 2-4 meaningful choices that advance the plot
+- Each choice should lead to different story paths
+- Keep choices concise but descriptive
+- Ensure narrative coherence with previous events
+
+RESPONSE FORMAT (JSON only):
+{{
+    "text": "Next scene description (2-3 sentences)",
+    "choices": [
+        {{"id": "choice1", "text": "Action-oriented choice"}},
+        {{"id": "choice2", "text": "Investigation choice"}},
+        {{"id": "choice3", "text": "Social/dialogue choice"}},
+        {{"id": "choice4", "text": "Creative/alternative choice"}}
+    ]
+}}"""
+
+
+def turn_prompt(current_text, choice_text, context=""):
+    """Per-turn part of the prompt: story so far, current scene and the player's action"""
+    parts = []
+    if context:
+        parts.append(f"STORY CONTEXT:\n{context}")
+    parts.append(f"CURRENT SCENE:\n{current_text}")
+    parts.append(f"PLAYER ACTION: {choice_text}")
+    parts.append("Reply with the next scene as JSON only.")
+    return "\n\n".join(parts)
+
+
+def build(current_text, choice_text, context="", story_meta=None):
+    """Prompt split into the reusable system prefix and the per-turn suffix"""
+    meta = story_meta or {}
+    return Prompt(
+        system_prompt(meta.get("genre", "Adventure"), meta.get("tone", "mysterious")),
+        turn_prompt(current_text, choice_text, context),
+    )
+
+
+def flatten(prompt):
+    """Single prompt string for backends without a separate system field (`ollama run`)"""
+    return f"{prompt.system}\n\n{prompt.prompt}"
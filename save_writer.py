@@ -0,0 +1,133 @@
+import threading
+import time
+
+import metrics
+from session_store import freeze
+
+MAX_PENDING = 256   # Sessions with unsaved state before submit() blocks
+CLOSE_TIMEOUT = 30  # Seconds close() waits for queued saves at exit
+
+
+class SaveWriter:
+    """Write-behind saving: submit() returns at once and one writer thread commits
+
+    A save for a session that is still queued replaces the queued state, so
+    a burst of turns costs one write. Each batch of sessions is committed
+    with the store's save_many() in one transaction. At most `max_pending`
+    sessions wait at a time; past that, submit() blocks until the writer
+    catches up. flush() waits for everything queued so far, and close()
+    (registered at exit by utils.get_saver) flushes before the process ends.
+    Write lag is measured from a session's first unsaved submit to its commit.
+    """
+
+    def __init__(self, get_store, max_pending=MAX_PENDING):
+        self._get_store = get_store
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._pending = {}  # session_id -> (state, first submitted at)
+        self._writing = {}  # session_id -> state, for the batch being committed
+        self._errors = {}   # session_id -> exception from its last failed write
+        self._stop = False
+        self._thread = None
+        self._lags = []
+        self.stats = {"submitted": 0, "coalesced": 0, "batches": 0, "written": 0, "failed": 0}
+
+    def submit(self, session_id, state):
+        """Queue a session's state to be saved"""
+        state = freeze(state)
+        with self._cond:
+            while session_id not in self._pending and len(self._pending) >= self.max_pending:
+                metrics.inc("save_queue_full")
+                self._cond.wait()
+            queued = self._pending.get(session_id)
+            if queued is not None:
+                self.stats["coalesced"] += 1
+                metrics.inc("saves_coalesced")
+            self._pending[session_id] = (state, queued[1] if queued else time.monotonic())
+            self.stats["submitted"] += 1
+            self._stop = False
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="save-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stop:
+                    self._cond.wait()
+                if not self._pending:
+                    self._thread = None
+                    return
+                batch, self._pending = self._pending, {}
+                self._writing = {session_id: state for session_id, (state, _) in batch.items()}
+                self._cond.notify_all()  # Room in the queue again
+
+            error = None
+            try:
+                with metrics.span("save"):
+                    self._get_store().save_many(list(self._writing.items()))
+            except Exception as e:
+                # The next save of these sessions writes their whole state again
+                error = e
+                metrics.inc("save_failures", len(batch))
+                print(f"⚠️ Background save failed: {e}")
+            committed = time.monotonic()
+
+            with self._cond:
+                self._writing = {}
+                self.stats["batches"] += 1
+                self.stats["failed" if error else "written"] += len(batch)
+                for session_id, (_, submitted) in batch.items():
+                    if error is None:
+                        self._errors.pop(session_id, None)
+                    else:
+                        self._errors[session_id] = error
+                    lag = committed - submitted
+                    metrics.observe("save_lag", lag)
+                    self._lags.append(lag)
+                del self._lags[:-1000]
+                self._cond.notify_all()
+
+    def pending_state(self, session_id):
+        """The queued (or being written) state of a session, or None if it is saved"""
+        with self._cond:
+            if session_id in self._pending:
+                state = self._pending[session_id][0]
+            else:
+                state = self._writing.get(session_id)
+        return freeze(state) if state is not None else None
+
+    def last_error(self, session_id):
+        """Exception from the session's last write if it failed, else None"""
+        with self._cond:
+            return self._errors.get(session_id)
+
+    def flush(self, timeout=None):
+        """Wait until everything submitted so far is written; False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._writing, timeout)
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """Flush and stop the writer thread"""
+        flushed = self.flush(timeout)
+        with self._cond:
+            if not flushed:
+                print(f"⚠️ {len(self._pending) + len(self._writing)} session(s) not saved before exit")
+            self._stop = True
+            self._cond.notify_all()
+        return flushed
+
+    def metrics(self):
+        """Queue depth, oldest unsaved change and write lag (seconds)"""
+        with self._cond:
+            oldest = min((submitted for _, submitted in self._pending.values()), default=None)
+            lags = list(self._lags)
+            stats = dict(self.stats, pending=len(self._pending))
+        return dict(
+            stats,
+            oldest_pending_age=time.monotonic() - oldest if oldest is not None else 0.0,
+            lag_p50=metrics.percentile(lags, 50),
+            lag_p99=metrics.percentile(lags, 99),
+            lag_max=max(lags, default=0.0),
+        )
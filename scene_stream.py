@@ -0,0 +1,250 @@
+import json
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_END = object()  # Sentinel for the closing quote of a string literal
+_WHITESPACE = " \t\r\n"
+_SCALAR_CHARS = set("-+.0123456789eEtruefalsn")
+
+
+class SceneFormatError(ValueError):
+    """Raised as soon as a streamed reply can no longer become a valid scene"""
+
+
+class SceneStreamParser:
+    """Incremental parser and validator for the scene JSON while it is still streaming
+
+    feed() consumes raw model tokens and returns newly decoded characters of
+    the top-level "text" value, so the UI can show the scene long before the
+    closing brace arrives. The reply is checked against the scene shape as it
+    goes; as soon as it cannot become valid (chatty preamble, wrong types,
+    a choice without id/text, runaway text, too few choices) SceneFormatError
+    is raised so the caller can stop the generation instead of paying for the
+    rest of it. result() returns the parsed scene once the object is closed.
+    """
+
+    def __init__(self, max_preamble=200, max_text_chars=2000, max_choices=6):
+        self.max_preamble = max_preamble
+        self.max_text_chars = max_text_chars
+        self.max_choices = max_choices
+
+        self.stack = []          # Open containers: {"kind", "key", "keys", "count"}
+        self.expect = "value"    # value | key | colon | comma
+        self.in_string = False
+        self.string_role = None  # "key", "text" (the scene text) or "value"
+        self.string_buf = []
+        self.escape = None       # None, "" after a backslash, or the hex digits of a \u escape
+        self.high_surrogate = None
+        self.scalar = []
+        self.raw = []            # Everything from the opening brace, for the final json.loads
+        self.preamble = 0
+        self.text_chars = 0
+        self.started = False     # Some scene text has been emitted
+        self.done = False        # The top-level object is complete
+
+    def feed(self, chunk):
+        """Consume a chunk of model output and return any newly decoded scene text"""
+        out = []
+        for ch in chunk:
+            if self.done:
+                break
+            if self.stack:
+                self.raw.append(ch)
+            if self.in_string:
+                self._string_char(ch, out)
+            elif self.scalar:
+                if ch in _SCALAR_CHARS:
+                    self.scalar.append(ch)
+                else:
+                    self._end_scalar()
+                    self._structural(ch)
+            else:
+                self._structural(ch)
+        return "".join(out)
+
+    def result(self):
+        """The parsed scene; raises SceneFormatError if the reply never completed"""
+        if not self.done:
+            raise SceneFormatError("Reply ended before the scene JSON was complete")
+        return json.loads("".join(self.raw))
+
+    def _fail(self, message):
+        raise SceneFormatError(message)
+
+    def _structural(self, ch):
+        if ch in _WHITESPACE:
+            return
+        if not self.stack:
+            # Nothing opened yet: only the scene object may start here
+            if ch == "{":
+                self.raw.append(ch)
+                self._open("object")
+                return
+            self.preamble += 1
+            if self.preamble > self.max_preamble:
+                self._fail("No JSON object at the start of the reply")
+            return
+
+        top = self.stack[-1]
+        if self.expect == "value":
+            if ch == "]" and top["kind"] == "array" and top["count"] == 0:
+                self._close()
+            else:
+                self._start_value(ch)
+        elif self.expect == "key":
+            if ch == '"':
+                self._start_string("key")
+            elif ch == "}" and not top["keys"]:
+                self._close()
+            else:
+                self._fail(f"Expected a key, got {ch!r}")
+        elif self.expect == "colon":
+            if ch != ":":
+                self._fail(f"Expected ':', got {ch!r}")
+            self.expect = "value"
+        elif self.expect == "comma":
+            if ch == ",":
+                self.expect = "key" if top["kind"] == "object" else "value"
+            elif ch == ("}" if top["kind"] == "object" else "]"):
+                self._close()
+            else:
+                self._fail(f"Expected ',' or end of {top['kind']}, got {ch!r}")
+
+    def _path(self):
+        """Where the value being started sits, e.g. 'scene.text', 'choices[]', 'choice.id'"""
+        depth = len(self.stack)
+        top = self.stack[-1]
+        if depth == 1:
+            return f"scene.{top['key']}"
+        if depth == 2 and self.stack[0]["key"] == "choices":
+            return "choices[]"
+        if depth == 3 and self.stack[0]["key"] == "choices":
+            return f"choice.{top['key']}"
+        return "other"
+
+    def _start_value(self, ch):
+        path = self._path()
+        top = self.stack[-1]
+        if top["kind"] == "array":
+            top["count"] += 1
+
+        expected = {
+            "scene.text": "string",
+            "scene.choices": "array",
+            "choices[]": "object",
+            "choice.text": "string",
+        }.get(path)
+        kind = {"{": "object", "[": "array", '"': "string"}.get(ch, "scalar")
+        if expected and kind != expected:
+            self._fail(f"{path} must be of type {expected}")
+        if path == "choice.id" and kind not in ("string", "scalar"):
+            self._fail("choice.id must be a string")
+        if path == "choices[]" and top["count"] > self.max_choices:
+            self._fail(f"More than {self.max_choices} choices")
+        if len(self.stack) >= 4 and kind in ("object", "array"):
+            self._fail("Scene JSON is nested too deeply")
+
+        if kind in ("object", "array"):
+            self._open(kind)
+        elif kind == "string":
+            self._start_string("text" if path == "scene.text" else "value")
+        else:
+            if ch not in _SCALAR_CHARS:
+                self._fail(f"Unexpected {ch!r} where a value should be")
+            self.scalar = [ch]
+
+    def _open(self, kind):
+        self.stack.append({"kind": kind, "key": None, "keys": set(), "count": 0})
+        self.expect = "key" if kind == "object" else "value"
+
+    def _close(self):
+        closed = self.stack.pop()
+        depth = len(self.stack)
+        in_choices = depth >= 1 and self.stack[0]["key"] == "choices"
+        if closed["kind"] == "object" and depth == 2 and in_choices:
+            if not {"id", "text"} <= closed["keys"]:
+                self._fail("Choice without id and text")
+        if closed["kind"] == "array" and depth == 1 and in_choices:
+            if closed["count"] < 2:
+                self._fail("Fewer than 2 choices")
+        if depth == 0:
+            if not {"text", "choices"} <= closed["keys"]:
+                self._fail("Scene is missing text or choices")
+            self.done = True
+        self.expect = "comma"
+
+    def _end_scalar(self):
+        try:
+            json.loads("".join(self.scalar))
+        except ValueError:
+            self._fail(f"Invalid value {''.join(self.scalar)!r}")
+        self.scalar = []
+        self.expect = "comma"
+
+    def _start_string(self, role):
+        self.in_string = True
+        self.string_role = role
+        self.string_buf = []
+
+    def _string_char(self, ch, out):
+        decoded = self._decode(ch)
+        if decoded is None:
+            return
+        if decoded is _END:
+            self.in_string = False
+            if self.string_role == "key":
+                key = "".join(self.string_buf)
+                top = self.stack[-1]
+                top["key"] = key
+                top["keys"].add(key)
+                self.expect = "colon"
+            else:
+                self.expect = "comma"
+            return
+        if self.string_role == "text":
+            self.text_chars += len(decoded)
+            if self.text_chars > self.max_text_chars:
+                self._fail("Scene text is too long")
+            out.append(decoded)
+            self.started = True
+        elif self.string_role == "key":
+            self.string_buf.append(decoded)
+
+    def _decode(self, ch):
+        """Decode one character inside a string literal; _END marks the closing quote"""
+        if self.escape is None:
+            if ch == "\\":
+                self.escape = ""
+                return None
+            if ch == '"':
+                return _END
+            return ch
+        if self.escape == "":
+            if ch == "u":
+                self.escape = "u"
+                return None
+            self.escape = None
+            return _ESCAPES.get(ch, ch)
+        # Collecting the four hex digits of a \uXXXX escape
+        self.escape += ch
+        if len(self.escape) < 5:
+            return None
+        code, self.escape = self.escape[1:], None
+        try:
+            value = int(code, 16)
+        except ValueError:
+            self._fail(f"Invalid escape \\u{code}")
+        # Emoji and other astral characters arrive as a \uD8xx\uDCxx surrogate pair
+        if 0xD800 <= value < 0xDC00:
+            self.high_surrogate = value
+            return None
+        if 0xDC00 <= value < 0xE000 and self.high_surrogate is not None:
+            value = 0x10000 + ((self.high_surrogate - 0xD800) << 10) + (value - 0xDC00)
+        self.high_surrogate = None
+        return chr(value)
+
+
+def parse_scene(output, **limits):
+    """Parse a complete reply with the same rules as the streaming path"""
+    parser = SceneStreamParser(**limits)
+    parser.feed(output)
+    return parser.result()
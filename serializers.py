@@ -0,0 +1,151 @@
+import json
+import os
+
+from session_state import to_plain
+
+SAVE_FORMAT = os.environ.get("STORY_SAVE_FORMAT", "json")  # "json" or "msgpack"
+MSGPACK_MAGIC = b"SMP1"
+HEADER_BYTES = 64 * 1024  # Most of a save file read_header() will look at
+
+
+class JSONSerializer:
+    name = "json"
+
+    def dumps(self, value):
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=to_plain)
+
+    def loads(self, data):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data).decode("utf-8-sig")
+        return json.loads(data)
+
+
+class MsgpackSerializer:
+    """Binary format; smaller and faster than JSON for long histories. Needs `pip install msgpack`"""
+
+    name = "msgpack"
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError as e:
+            raise ImportError("The msgpack save format needs the msgpack package (pip install msgpack)") from e
+        self._msgpack = msgpack
+
+    def dumps(self, value):
+        return MSGPACK_MAGIC + self._msgpack.packb(value, default=to_plain, use_bin_type=True)
+
+    def loads(self, data):
+        return self._msgpack.unpackb(memoryview(data)[len(MSGPACK_MAGIC):], raw=False)
+
+
+_FORMATS = {"json": JSONSerializer, "msgpack": MsgpackSerializer}
+_instances = {}
+
+
+def get_serializer(name=None):
+    """Serializer by name (defaults to STORY_SAVE_FORMAT)"""
+    name = name or SAVE_FORMAT
+    if name not in _FORMATS:
+        raise ValueError(f"Unknown save format: {name} (expected one of {', '.join(_FORMATS)})")
+    if name not in _instances:
+        _instances[name] = _FORMATS[name]()
+    return _instances[name]
+
+
+def detect(data):
+    """Serializer that wrote `data`
+
+    JSON is text (or UTF-8 bytes), msgpack is bytes behind MSGPACK_MAGIC, so
+    stores and files can mix formats and changing STORY_SAVE_FORMAT never
+    strands older saves.
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:len(MSGPACK_MAGIC)]) == MSGPACK_MAGIC:
+        return get_serializer("msgpack")
+    return get_serializer("json")
+
+
+def loads(data):
+    """Decode data written by any serializer"""
+    return detect(data).loads(data)
+
+
+def read_file(path):
+    """Decode a save file in any format"""
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def read_header(path, keys=("version", "saved_at")):
+    """Top-level `keys` of a save file, read without decoding the game data after them
+
+    Save files write their metadata before "game_data", so only the first few
+    hundred bytes are decoded. Falls back to reading the whole file when a
+    value in the way is too large to skip cheaply.
+    """
+    with open(path, "rb") as f:
+        prefix = f.read(len(MSGPACK_MAGIC))
+        if prefix == MSGPACK_MAGIC:
+            return _msgpack_header(f, keys)
+        f.seek(0)
+        chunk = f.read(HEADER_BYTES)
+    header = _json_header(chunk.decode("utf-8-sig", errors="ignore"), keys)
+    if header is None:
+        data = read_file(path)
+        header = {key: data[key] for key in keys if key in data}
+    return header
+
+
+def _json_header(text, keys):
+    """Wanted members of the JSON object at the start of `text`, or None if it needs a full parse"""
+    decoder = json.JSONDecoder()
+    wanted = set(keys)
+    header = {}
+    pos = text.find("{")
+    if pos < 0:
+        return None
+    pos += 1
+    while wanted:
+        pos = _skip_space(text, pos)
+        if pos >= len(text):
+            return None
+        if text[pos] == "}":
+            break
+        if text[pos] == ",":
+            pos += 1
+            continue
+        try:
+            key, pos = decoder.raw_decode(text, pos)
+            pos = _skip_space(text, pos)
+            if text[pos:pos + 1] != ":":
+                return None
+            value, pos = decoder.raw_decode(text, _skip_space(text, pos + 1))
+        except (ValueError, IndexError):
+            # Ran off the end of the chunk (or the file is damaged)
+            return None
+        if key in wanted:
+            header[key] = value
+            wanted.discard(key)
+    return header
+
+
+def _skip_space(text, pos):
+    while pos < len(text) and text[pos] in " \t\r\n":
+        pos += 1
+    return pos
+
+
+def _msgpack_header(f, keys):
+    unpacker = get_serializer("msgpack")._msgpack.Unpacker(f, raw=False)
+    wanted = set(keys)
+    header = {}
+    for _ in range(unpacker.read_map_header()):
+        if not wanted:
+            break
+        key = unpacker.unpack()
+        if key in wanted:
+            header[key] = unpacker.unpack()
+            wanted.discard(key)
+        else:
+            unpacker.skip()
+    return header
@@ -0,0 +1,148 @@
+import sys
+import weakref
+from collections.abc import Mapping
+from datetime import datetime
+
+_ENTRY_KEYS = ("choice", "choices", "timestamp")
+
+
+class Choices(list):
+    """A scene's choice list, shared by every turn that reached the scene (treat as read-only)"""
+    __slots__ = ("__weakref__",)
+
+
+# Identical choice lists share one Choices object for as long as some turn still uses it
+_choice_lists = weakref.WeakValueDictionary()
+# Key orders of saved entries that don't match Turn's own, one shared tuple per order
+_orders = {}
+
+
+def _key(value):
+    """Hashable key for a JSON value"""
+    if isinstance(value, dict):
+        return tuple((k, _key(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return ("[]",) + tuple(_key(v) for v in value)
+    return value
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def intern_choices(choices):
+    """The shared Choices list equal to `choices`, with interned ids and texts"""
+    if isinstance(choices, Choices):
+        return choices
+    key = _key(choices)
+    shared = _choice_lists.get(key)
+    if shared is None:
+        shared = Choices({_intern(k): _intern(v) for k, v in choice.items()} if isinstance(choice, dict) else choice
+                         for choice in choices)
+        _choice_lists[key] = shared
+    return shared
+
+
+def _pack_timestamp(value):
+    """ISO timestamps are kept as epoch floats when that converts back to exactly the same string"""
+    if isinstance(value, str):
+        try:
+            stamp = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+        if stamp.tzinfo is None and stamp.isoformat() == value:
+            seconds = stamp.timestamp()
+            if datetime.fromtimestamp(seconds).isoformat() == value:
+                return seconds
+    return value
+
+
+def _unpack_timestamp(value):
+    return datetime.fromtimestamp(value).isoformat() if isinstance(value, float) else value
+
+
+class Turn(Mapping):
+    """One history entry, read like the {"choice", "choices", "timestamp"} dict it replaces
+
+    The choice text is interned, the choices list is shared with every other
+    turn that reached the same scene, and the timestamp is packed into a
+    float. Other keys, and values of unexpected types, are kept as they are
+    in `extra`. Keys are listed in the order the saved entry had them, so
+    to_dict() gives back the saved entry unchanged, key order included.
+    """
+
+    __slots__ = ("choice", "choices", "_timestamp", "extra", "_order")
+
+    def __init__(self, choice=None, choices=None, timestamp=None, extra=None):
+        self.choice = _intern(choice)
+        self.choices = None if choices is None else intern_choices(choices)
+        self._timestamp = _pack_timestamp(timestamp)
+        self.extra = extra or None
+        self._order = None  # Saved key order, when it differs from the slot order
+
+    @classmethod
+    def from_entry(cls, entry):
+        if isinstance(entry, Turn):
+            return entry
+        packed = {key: entry.get(key) for key in _ENTRY_KEYS}
+        if not isinstance(packed["choice"], str):
+            packed["choice"] = None
+        if not isinstance(packed["choices"], list):
+            packed["choices"] = None
+        if not isinstance(packed["timestamp"], str):
+            packed["timestamp"] = None
+        extra = {k: v for k, v in entry.items() if packed.get(k) is None}
+        turn = cls(extra=extra, **packed)
+        order = tuple(entry)
+        if tuple(turn) != order:
+            turn._order = _orders.setdefault(order, order)
+        return turn
+
+    @property
+    def timestamp(self):
+        return _unpack_timestamp(self._timestamp)
+
+    def __getitem__(self, key):
+        if key == "choice" and self.choice is not None:
+            return self.choice
+        if key == "choices" and self.choices is not None:
+            return self.choices
+        if key == "timestamp" and self._timestamp is not None:
+            return self.timestamp
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        if self._order is not None:
+            yield from self._order
+            return
+        if self.choice is not None:
+            yield "choice"
+        if self.choices is not None:
+            yield "choices"
+        if self._timestamp is not None:
+            yield "timestamp"
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        return {key: list(value) if isinstance(value, Choices) else value for key, value in self.items()}
+
+    def __repr__(self):
+        return f"Turn({self.to_dict()!r})"
+
+
+def compact_history(entries):
+    """History entries (saved dicts or Turns) as Turns"""
+    return [Turn.from_entry(entry) for entry in entries]
+
+
+def to_plain(value):
+    """json.dumps `default` hook for Turns and other objects with to_dict()"""
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,269 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+import serializers
+from session_state import compact_history
+
+SAVE_VERSION = "2.0"
+COMPACT_EVERY = 50  # Journal records per session before they are folded into a snapshot
+
+
+class SQLiteSessionStore:
+    """Session-keyed save storage with a snapshot plus an append-only journal per session
+
+    A turn is saved as one small journal record (the new scene text, the
+    history entries added since the last save and any other changed keys)
+    instead of rewriting the whole history. Every `compact_every` records the
+    session is compacted: a fresh snapshot is written and its journal dropped,
+    in the same transaction. Loading replays snapshot + journal. Each save is
+    a SQLite transaction, so a crash leaves either the old or the new state.
+
+    Concurrent save() calls are group-committed: whichever thread gets the
+    write lock flushes every pending save in one transaction, and repeated
+    saves of the same session collapse to the latest state.
+
+    Snapshots and journal records are written with `serializer` (see
+    serializers.py; STORY_SAVE_FORMAT by default) and read back in whatever
+    format each row was written in.
+    """
+
+    def __init__(self, path="saves.db", timeout=30, compact_every=COMPACT_EVERY, serializer=None):
+        self.path = path
+        self.compact_every = compact_every
+        self.serializer = serializer or serializers.get_serializer()
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " version TEXT NOT NULL,"
+            " saved_at TEXT NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")]
+        if "seq" not in columns:
+            # Databases created before the journal existed hold plain snapshots
+            self._conn.execute("ALTER TABLE sessions ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_saved_at ON sessions(saved_at)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS journal ("
+            " session_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " saved_at TEXT NOT NULL,"
+            " record TEXT NOT NULL,"
+            " PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
+        )
+        self._db_lock = threading.Lock()       # Serializes use of the shared connection
+        self._pending_lock = threading.Lock()
+        self._pending = {}                     # session_id -> latest state waiting for the next commit
+        # What was last persisted per session, so the next save can be written as a delta
+        self._heads = {}
+
+    def save(self, session_id, state):
+        """Persist a session's state (blocks until it is committed)"""
+        with self._pending_lock:
+            self._pending[session_id] = freeze(state)
+        self._flush()
+
+    def save_many(self, items):
+        """Persist several (session_id, state) pairs in one transaction"""
+        with self._pending_lock:
+            for session_id, state in items:
+                self._pending[session_id] = freeze(state)
+        self._flush()
+
+    def _flush(self):
+        # Whoever holds the lock commits everything queued so far, including
+        # saves other threads added while it was waiting
+        with self._db_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            saved_at = datetime.now().isoformat()
+            heads = {}
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for session_id, state in batch.items():
+                    heads[session_id] = self._write(session_id, state, saved_at)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                for session_id in batch:
+                    self._heads.pop(session_id, None)
+                raise
+            self._heads.update(heads)
+
+    def _write(self, session_id, state, saved_at):
+        """Append a journal record, or write a snapshot when no delta is possible"""
+        head = self._heads.get(session_id)
+        latest = self._latest_seq(session_id)
+        # A delta is only valid on top of what we last wrote; another process may have moved on
+        if head is not None and head["seq"] == latest and head["pending"] + 1 < self.compact_every:
+            record = _delta(head, state)
+            if record is not None:
+                self._conn.execute(
+                    "INSERT INTO journal (session_id, seq, saved_at, record) VALUES (?, ?, ?, ?)",
+                    (session_id, latest + 1, saved_at, self.serializer.dumps(record)),
+                )
+                return _head(state, latest + 1, head["pending"] + 1)
+
+        seq = latest + 1
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, version, saved_at, data, seq) VALUES (?, ?, ?, ?, ?)",
+            (session_id, SAVE_VERSION, saved_at, self.serializer.dumps(state), seq),
+        )
+        self._conn.execute("DELETE FROM journal WHERE session_id = ?", (session_id,))
+        return _head(state, seq, 0)
+
+    def _latest_seq(self, session_id):
+        row = self._conn.execute(
+            "SELECT MAX(seq) FROM ("
+            " SELECT seq FROM sessions WHERE session_id = ?"
+            " UNION ALL SELECT seq FROM journal WHERE session_id = ?)",
+            (session_id, session_id),
+        ).fetchone()
+        return row[0] or 0
+
+    def load(self, session_id):
+        """Return a session's state (snapshot + replayed journal), or None if never saved"""
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT data, seq FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            records = self._conn.execute(
+                "SELECT seq, record FROM journal WHERE session_id = ? AND seq > ? ORDER BY seq",
+                (session_id, row[1]),
+            ).fetchall()
+
+            state = serializers.loads(row[0])
+            seq = row[1]
+            for seq, record in records:
+                _apply(state, serializers.loads(record))
+            if isinstance(state.get("history"), list):
+                state["history"] = compact_history(state["history"])
+            self._heads[session_id] = _head(freeze(state), seq, len(records))
+        return state
+
+    def info(self, session_id):
+        """Save metadata without decoding the game data"""
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT version, saved_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            latest = self._conn.execute(
+                "SELECT saved_at FROM journal WHERE session_id = ? ORDER BY seq DESC LIMIT 1",
+                (session_id,),
+            ).fetchone()
+        return {"saved_at": latest[0] if latest else row[1], "version": row[0], "has_game_data": True}
+
+    def compact(self, session_id):
+        """Fold a session's journal into a fresh snapshot"""
+        state = self.load(session_id)
+        if state is None:
+            return
+        with self._db_lock:
+            self._heads.pop(session_id, None)
+        self.save(session_id, state)
+
+    def delete(self, session_id):
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM journal WHERE session_id = ?", (session_id,))
+            self._conn.execute("COMMIT")
+            self._heads.pop(session_id, None)
+
+    def list_sessions(self, limit=100):
+        """Most recently saved session ids"""
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT session_id FROM ("
+                " SELECT session_id, saved_at FROM sessions"
+                " UNION ALL SELECT session_id, saved_at FROM journal)"
+                " GROUP BY session_id ORDER BY MAX(saved_at) DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._db_lock:
+            self._conn.close()
+
+
+def freeze(state):
+    """Shallow-copy a state so later in-place edits by the caller don't leak into pending saves"""
+    state = dict(state)
+    if isinstance(state.get("history"), list):
+        state["history"] = list(state["history"])
+    return state
+
+
+def _head(state, seq, pending):
+    """Summary of the last persisted state, enough to compute the next delta"""
+    history = state.get("history") or []
+    return {
+        "seq": seq,
+        "pending": pending,  # Journal records since the last snapshot
+        "history_len": len(history),
+        "last_entry": history[-1] if history else None,
+        "fields": {k: v for k, v in state.items() if k != "history"},
+    }
+
+
+def _delta(head, state):
+    """Journal record turning the persisted state into `state`, or None if the history was replaced
+
+    Appends are recognised directly. Bounded histories that drop old entries
+    from the front as they append are recognised by finding the previously
+    saved last entry (by identity, so repeated identical turns can't be
+    mistaken for it).
+    """
+    history = state.get("history")
+    if not isinstance(history, list):
+        return None
+    length = head["history_len"]
+    last = head["last_entry"]
+
+    if length == 0:
+        start = 0
+    elif len(history) >= length and (history[length - 1] is last or (len(history) > length and history[length - 1] == last)):
+        start = length
+    else:
+        for i in range(min(length, len(history)) - 1, -1, -1):
+            if history[i] is last:
+                start = i + 1
+                break
+        else:
+            return None
+
+    record = {"add": history[start:]}
+    if length - start:
+        record["drop"] = length - start
+    changed = {k: v for k, v in state.items() if k != "history" and head["fields"].get(k, _MISSING) != v}
+    removed = [k for k in head["fields"] if k not in state]
+    if changed:
+        record["set"] = changed
+    if removed:
+        record["unset"] = removed
+    return record
+
+
+def _apply(state, record):
+    """Replay one journal record onto a loaded state"""
+    history = state.setdefault("history", [])
+    del history[:record.get("drop", 0)]
+    history.extend(record.get("add", []))
+    state.update(record.get("set", {}))
+    for key in record.get("unset", []):
+        state.pop(key, None)
+
+
+_MISSING = object()
+
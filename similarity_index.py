@@ -0,0 +1,253 @@
+import re
+import threading
+from collections import OrderedDict
+
+from generation_cache import normalize
+
+SIMILARITY_THRESHOLD = 0.8  # Score above which a stored continuation is reused
+MAX_SCENES = 20000          # Scenes whose choices are remembered (least recently used dropped first)
+ACTION_WEIGHT = 6           # An action counts as much as six descriptive words
+# Words that don't change what a choice does ("I open the chest" is "Open the chest")
+FILLER = frozenset(("a", "an", "the", "i", "we", "you", "me", "us", "let", "let's", "lets",
+                    "will", "shall", "please", "just", "now", "this", "that", "these", "those",
+                    "some", "my", "your", "his", "her", "its", "our", "their"))
+SEPARATORS = frozenset(("and", "then", ",", ";"))
+# Verbs and verb phrases that do the same thing, by canonical verb
+SYNONYMS = (
+    ("inspect", ("inspect", "examine", "study", "check", "look at", "look over", "investigate",
+                 "scrutinize", "observe")),
+    ("search", ("search", "rummage through", "look through", "comb")),
+    ("take", ("take", "grab", "pick up", "seize", "collect", "snatch")),
+    ("question", ("question", "interrogate", "ask", "quiz")),
+    ("talk", ("talk", "talk to", "talk with", "speak", "speak to", "speak with", "chat with", "address")),
+    ("leave", ("leave", "exit", "depart", "depart from", "walk away", "walk out of", "get out of")),
+    ("follow", ("follow", "track", "trail", "tail")),
+    ("approach", ("approach", "go", "go to", "go over", "go toward", "go towards", "come", "walk",
+                  "walk to", "walk over", "walk over to", "walk up to", "head to", "head over",
+                  "head toward", "head towards", "move closer", "step closer", "step forward")),
+    ("shout", ("shout", "call", "call out", "yell", "cry out")),
+    ("attack", ("attack", "strike", "hit", "assault", "charge")),
+    ("climb", ("climb", "climb up", "ascend", "scale")),
+    ("retreat", ("retreat", "turn back", "go back", "back away", "return")),
+    ("wait", ("wait", "linger", "stay put", "hold still")),
+    ("listen", ("listen", "listen for", "listen to")),
+    ("hide", ("hide", "take cover")),
+    ("run", ("run", "run away", "flee", "escape", "bolt")),
+    ("break", ("break", "smash", "shatter")),
+    ("use", ("use",)),
+    ("open", ("open",)),
+    ("close", ("close", "shut")),
+    ("push", ("push", "shove")),
+    ("pull", ("pull", "tug")),
+    ("read", ("read",)),
+    ("light", ("light", "ignite")),
+    ("defend", ("defend", "guard", "protect")),
+)
+# Prepositions that bring another participant into the action ("with the key"), by canonical form
+ARGUMENTS = {"with": "with", "using": "with", "to": "to", "into": "to", "onto": "to", "toward": "to",
+             "towards": "to", "at": "at", "about": "about", "for": "for", "through": "through",
+             "from": "from"}
+# Prepositions that place or describe what is acted on ("the guard in the corner")
+LOCATIVES = frozenset(("in", "on", "near", "by", "behind", "under", "beside", "inside", "of", "across",
+                       "around", "over", "beneath", "above", "below", "outside", "against", "along",
+                       "up", "down", "out", "off", "back", "away"))
+
+_TOKEN = re.compile(r"\w+(?:'\w+)?|[,;]")
+_NEGATION = re.compile(r"\b(?:not|no|never|nothing|don't|dont|doesn't|won't|can't|cannot|refus\w*|without|avoid\w*)\b")
+_VERBS = {phrase: verb for verb, phrases in SYNONYMS for phrase in phrases}
+
+
+def negated(text):
+    """Whether a choice refuses or negates its action ("Do not open the chest")"""
+    return _NEGATION.search(text.lower().replace("\u2019", "'")) is not None
+
+
+def _stem(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("sses", "xes", "zes", "ches", "shes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def _adverb(word):
+    return len(word) > 4 and word.endswith("ly")
+
+
+def _kind(modifier):
+    return "place" if " " in modifier else "adverb" if _adverb(modifier) else "adjective"
+
+
+def _verb(words):
+    """(canonical verb, remaining words) for a known verb phrase at the start of `words`, else (None, words)"""
+    for n in (3, 2, 1):
+        verb = _VERBS.get(" ".join(words[:n]))
+        if verb is not None:
+            return verb, words[n:]
+    return None, words
+
+
+def _split(words):
+    """Leading adverbs, then the rest of a clause"""
+    lead = 0
+    while lead < len(words) - 1 and _adverb(words[lead]):
+        lead += 1
+    return words[:lead], words[lead:]
+
+
+def frame(text):
+    """(actions, modifiers) of a choice, ignoring filler words
+
+    Each action is (verb, objects, arguments), with synonyms mapped to one
+    verb ("examine" is "inspect"); objects and arguments keep only their
+    head nouns. Adjectives, adverbs and places ("in the corner") are the
+    modifiers. A bare movement before the real action ("Approach and
+    inspect the throne") is dropped.
+    """
+    words = [word for word in _TOKEN.findall(text.lower().replace("\u2019", "'")) if word not in FILLER]
+    segments = [[]]
+    for word in words:
+        if word in SEPARATORS:
+            segments.append([])
+        else:
+            segments[-1].append(word)
+    clauses, modifiers = [], set()
+    for segment in filter(None, segments):
+        lead, rest = _split(segment)
+        verb, rest = _verb(rest)
+        if verb is None and clauses:
+            clauses[-1][1].append(segment)  # "the shelves and drawers": another object, not an action
+            continue
+        if verb is None:
+            verb, rest = rest[0], rest[1:]
+        modifiers.update(lead)
+        clauses.append((verb, [rest]))
+    if len(clauses) > 1:
+        clauses = [clause for clause in clauses if clause[0] != "approach" or any(clause[1])] or clauses
+    actions = []
+    for verb, bodies in clauses:
+        objects, arguments = [], []
+        for body in bodies:
+            phrases = [(None, [])]
+            for word in body:
+                if word in ARGUMENTS or word in LOCATIVES:
+                    phrases.append((word, []))
+                else:
+                    phrases[-1][1].append(word)
+            for preposition, phrase in phrases:
+                if not phrase:
+                    if preposition:  # A particle ("turn around")
+                        verb = _VERBS.get(f"{verb} {preposition}", f"{verb} {preposition}")
+                    continue
+                while phrase and _adverb(phrase[-1]) and (len(phrase) > 1 or preposition is None):
+                    modifiers.add(phrase.pop())  # "quietly" in "leave the hall quietly" and "wait quietly"
+                if not phrase:
+                    continue
+                head = _stem(phrase[-1])
+                modifiers.update(_stem(word) for word in phrase[:-1])
+                if preposition is None:
+                    objects.append(head)
+                elif preposition in ARGUMENTS or not objects:
+                    arguments.append(f"{ARGUMENTS.get(preposition, preposition)} {head}")
+                else:
+                    modifiers.add(f"{preposition} {head}")
+        actions.append((verb, tuple(sorted(objects)), tuple(sorted(arguments))))
+    return tuple(sorted(actions)), frozenset(modifiers)
+
+
+def score(query, stored):
+    """How closely two frames agree, from 0 to 1
+
+    Choices whose actions differ score 0. Otherwise the score is the F1 of
+    the modifiers each side covers, with every action counting as
+    ACTION_WEIGHT shared words, so a dropped or added adjective or adverb
+    costs a little. Modifiers of the same kind that contradict each other
+    ("the red door", "the blue door") halve the score.
+    """
+    (actions, modifiers), (stored_actions, stored_modifiers) = query, stored
+    if not actions or actions != stored_actions:
+        return 0.0
+    shared = ACTION_WEIGHT * len(actions) + len(modifiers & stored_modifiers)
+    precision = shared / (ACTION_WEIGHT * len(actions) + len(modifiers))
+    recall = shared / (ACTION_WEIGHT * len(actions) + len(stored_modifiers))
+    result = 2 * precision * recall / (precision + recall)
+    added = {_kind(modifier) for modifier in modifiers - stored_modifiers}
+    if added & {_kind(modifier) for modifier in stored_modifiers - modifiers}:
+        result /= 2
+    return result
+
+
+class SimilarityIndex:
+    """Reuse scenes generated for differently worded choices that mean the same thing
+
+    Choices are compared only with choices made from the same scene (by
+    normalized text), so a continuation is never carried over to a
+    different story situation. Each choice is reduced to its frame(): the
+    actions it takes, with synonymous verbs merged, and the words that only
+    describe them. A stored choice is reused when the actions are the same
+    and the descriptions agree closely enough: "Inspect the throne" and
+    "Examine the damaged throne" both reuse "Approach and inspect the
+    damaged throne", while "Smash open the chest", "Open the chest with the
+    rusty key" and "Close the chest" do not reuse "Open the chest". A
+    negated choice ("Do not open the chest") never matches one that isn't,
+    and a choice the scene itself offers never matches another of the
+    scene's offered choices. find() returns the best-scoring stored scene
+    when its score is at least `threshold`.
+    """
+
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, max_scenes=MAX_SCENES):
+        self.threshold = threshold
+        self.max_scenes = max_scenes
+        self._scenes = OrderedDict()  # normalized scene text -> {normalized choice: (frame, node)}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def add(self, scene_text, choice_text, node):
+        """Index the scene reached by taking `choice_text` from `scene_text`"""
+        scene, choice = normalize(scene_text), normalize(choice_text)
+        with self._lock:
+            choices = self._scenes.get(scene)
+            if choices is None:
+                choices = self._scenes[scene] = {}
+                if len(self._scenes) > self.max_scenes:
+                    _, dropped = self._scenes.popitem(last=False)
+                    self._count -= len(dropped)
+            else:
+                self._scenes.move_to_end(scene)
+            if choice in choices:
+                return
+            choices[choice] = (frame(choice), {"text": node["text"], "choices": node.get("choices", [])})
+            self._count += 1
+
+    def find(self, scene_text, choice_text, offered=()):
+        """(node, score) of the closest stored choice from this scene, or None below the threshold
+
+        `offered` lists the choices the scene presents. When the new choice
+        is one of them, the others are its alternatives and are never matched.
+        """
+        scene, choice = normalize(scene_text), normalize(choice_text)
+        offered = {normalize(text) for text in offered}
+        siblings = offered - {choice} if choice in offered else set()
+        negative = negated(choice)
+        query = frame(choice)
+        with self._lock:
+            choices = self._scenes.get(scene)
+            if not choices:
+                return None
+            self._scenes.move_to_end(scene)
+            best, best_score = None, 0.0
+            for stored_choice, (stored, node) in choices.items():
+                if stored_choice in siblings or negated(stored_choice) != negative:
+                    continue
+                result = score(query, stored)
+                if result > best_score:
+                    best, best_score = node, result
+        if best is None or best_score < self.threshold:
+            return None
+        return dict(best), best_score
+
+    def __len__(self):
+        """Number of indexed (scene, choice) pairs"""
+        return self._count
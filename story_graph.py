@@ -0,0 +1,371 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from generation_cache import normalize
+
+DATA_MAGIC = b"SGRAPH1\n"
+INDEX_MAGIC = b"SGIDX1\n\0"
+INDEX_HEADER = struct.Struct("<8sQQQ")  # magic, data bytes covered, entry count, node count
+INDEX_ENTRY = struct.Struct("<16sQ")   # key hash, record offset in the data file
+RECORD_LEN = struct.Struct("<I")
+FLUSH_EVERY = 64  # Appended nodes between index rewrites
+
+
+def _key(kind, *parts):
+    """16-byte index key for a node id, a scene text or a (parent scene, choice) edge"""
+    material = "\0".join([kind] + [normalize(p) for p in parts])
+    return hashlib.blake2b(material.encode("utf-8"), digest_size=16).digest()
+
+
+def _edge_key(parent_text, choice_text, context=None):
+    """Index key of a branch; generated branches also carry the story context they were written for"""
+    if context is None:
+        return _key("edge", parent_text, choice_text)
+    return _key("edge", parent_text, choice_text, context)
+
+
+def node_id_for(text):
+    """Stable id for a generated scene, derived from its text"""
+    return "g" + hashlib.blake2b(normalize(text).encode("utf-8"), digest_size=8).hexdigest()
+
+
+class FileLock:
+    """Exclusive lock on `path` shared by every process using it (not re-entrant)"""
+
+    def __init__(self, path):
+        self._file = open(path, "a+b")
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        return False
+
+    def close(self):
+        self._file.close()
+
+
+class StoryGraph:
+    """Story nodes and the choices linking them, in an append-only file with a sorted hash index
+
+    `<path>.dat` holds length-prefixed JSON node records; `<path>.idx` is a
+    sorted array of (key hash, record offset) entries covering node ids,
+    scene texts and (parent scene, choice) edges. Both files are mmap'd and
+    searched in place, so opening a campaign of any size reads only the
+    index header. Nodes added since the last index rewrite live in a small
+    in-memory index until the next flush(); records appended by a process
+    that died before flushing are re-indexed on open.
+
+    Several processes may share one graph (the console, the app, the server
+    and prerender all default to ./story_graph). Appends and index rewrites
+    hold an exclusive lock on `<path>.lock`, and each process first indexes
+    whatever the others appended since it last looked, so no record is left
+    out of the index.
+    """
+
+    def __init__(self, path="story_graph", flush_every=FLUSH_EVERY):
+        self.path = path
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(self.path + ".lock")
+        self._recent = {}  # key -> offset, for records not yet in the index file
+        self._recent_records = []  # Offsets of the records in _recent
+        self._unflushed = 0  # Records in _recent that the mapped index doesn't cover
+        self._data_map = None
+        self._index_map = None
+        self._index_count = 0
+        self._index_nodes = 0
+        self._covered = len(DATA_MAGIC)  # Data bytes the mapped index covers
+        with self._file_lock:
+            if not os.path.exists(self.data_path) or os.path.getsize(self.data_path) == 0:
+                with open(self.data_path, "wb") as f:
+                    f.write(DATA_MAGIC)
+            self._data = open(self.data_path, "r+b")
+            if self._data.read(len(DATA_MAGIC)) != DATA_MAGIC:
+                raise ValueError(f"{self.data_path} is not a story graph data file")
+            self._tail = self._open_index()  # Data bytes indexed, by the index file or _recent
+            self._catch_up()
+
+    @property
+    def data_path(self):
+        return self.path + ".dat"
+
+    @property
+    def index_path(self):
+        return self.path + ".idx"
+
+    def _open_index(self):
+        """Map the index file as it is on disk now; returns how many data bytes it covers"""
+        if self._index_map is not None:
+            self._index_map.close()
+            self._index_map = None
+        self._index_count = self._index_nodes = 0
+        self._covered = len(DATA_MAGIC)
+        if not os.path.exists(self.index_path) or os.path.getsize(self.index_path) < INDEX_HEADER.size:
+            return self._covered
+        with open(self.index_path, "rb") as f:
+            self._index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, covered, count, nodes = INDEX_HEADER.unpack_from(self._index_map, 0)
+        if magic != INDEX_MAGIC or len(self._index_map) < INDEX_HEADER.size + count * INDEX_ENTRY.size:
+            print(f"⚠️ Ignoring damaged story graph index {self.index_path}")
+            self._index_map.close()
+            self._index_map = None
+            return self._covered
+        self._index_count = count
+        self._index_nodes = nodes
+        self._covered = covered
+        return covered
+
+    def _catch_up(self):
+        """Index records appended since _tail, by this or another process (caller holds the file lock)"""
+        self._data.seek(0, os.SEEK_END)
+        end = self._data.tell()
+        offset = self._tail
+        while offset + RECORD_LEN.size <= end:
+            self._data.seek(offset)
+            (length,) = RECORD_LEN.unpack(self._data.read(RECORD_LEN.size))
+            raw = self._data.read(length)
+            if len(raw) < length:
+                # A torn final write by a process that died; drop it so the next append starts clean
+                self._data.truncate(offset)
+                break
+            self._index_node(json.loads(raw), offset)
+            offset += RECORD_LEN.size + length
+        self._tail = offset
+
+    def _index_node(self, node, offset):
+        self._unflushed += 1
+        self._recent_records.append(offset)
+        # setdefault: the first record for a key wins, as in add()
+        self._recent.setdefault(_key("id", node["id"]), offset)
+        self._recent.setdefault(_key("text", node["text"]), offset)
+        if node.get("parent_text") is not None:
+            self._recent.setdefault(_edge_key(node["parent_text"], node["choice"], node.get("context")), offset)
+
+    def _find(self, key):
+        """Record offset for a key, or None"""
+        offset = self._recent.get(key)
+        if offset is not None or self._index_map is None:
+            return offset
+        lo, hi = 0, self._index_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry_key, entry_offset = INDEX_ENTRY.unpack_from(self._index_map, INDEX_HEADER.size + mid * INDEX_ENTRY.size)
+            if entry_key < key:
+                lo = mid + 1
+            elif entry_key > key:
+                hi = mid
+            else:
+                return entry_offset
+        return None
+
+    def _read(self, offset):
+        if self._data_map is None or offset + RECORD_LEN.size > len(self._data_map):
+            self._remap()
+        (length,) = RECORD_LEN.unpack_from(self._data_map, offset)
+        start = offset + RECORD_LEN.size
+        if start + length > len(self._data_map):
+            self._remap()
+        return json.loads(self._data_map[start:start + length])
+
+    def _remap(self):
+        if self._data_map is not None:
+            self._data_map.close()
+        self._data.flush()
+        self._data_map = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _lookup(self, key, check):
+        with self._lock:
+            offset = self._find(key)
+            if offset is None and os.fstat(self._data.fileno()).st_size > self._tail:
+                # Another process has added nodes since we last looked
+                with self._file_lock:
+                    self._catch_up()
+                offset = self._find(key)
+            if offset is None:
+                return None
+            node = self._read(offset)
+        # Keys are hashes; make sure the record really is the one asked for
+        return node if check(node) else None
+
+    def get(self, node_id):
+        """Node by id, or None"""
+        return self._lookup(_key("id", node_id), lambda node: node["id"] == node_id)
+
+    def find(self, text):
+        """Node whose scene text matches `text` (ignoring whitespace), or None"""
+        norm = normalize(text)
+        return self._lookup(_key("text", text), lambda node: normalize(node["text"]) == norm)
+
+    def child(self, parent_text, choice_text, context=None):
+        """Node reached by taking `choice_text` from the scene `parent_text`, or None
+
+        Authored branches have no `context`. A generated branch is stored with
+        the story context it was written for (see add()) and is only found
+        with that same context.
+        """
+        parent, choice = normalize(parent_text), normalize(choice_text)
+        return self._lookup(
+            _edge_key(parent_text, choice_text, context),
+            lambda node: (normalize(node.get("parent_text", "")) == parent
+                          and normalize(node.get("choice", "")) == choice and node.get("context") == context),
+        )
+
+    def add(self, node, parent_text=None, choice_text=None, context=None):
+        """Store a node (and the edge that led to it); returns its id
+
+        `context` is a string naming the story so far, such as the scene's
+        generation cache key, for branches that are only valid in it.
+        Adding an edge that already exists keeps the first child.
+        """
+        record = {
+            "id": node.get("id") or node_id_for(node["text"]),
+            "text": node["text"],
+            "choices": node.get("choices", []),
+        }
+        if parent_text is not None:
+            record["parent_text"] = parent_text
+            record["choice"] = choice_text
+            if context is not None:
+                record["context"] = context
+        raw = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+        with self._lock, self._file_lock:
+            self._catch_up()
+            if parent_text is not None:
+                if self._find(_edge_key(parent_text, choice_text, context)) is not None:
+                    return record["id"]
+            elif self._find(_key("id", record["id"])) is not None:
+                return record["id"]
+            offset = self._tail
+            self._data.seek(offset)
+            self._data.write(RECORD_LEN.pack(len(raw)) + raw)
+            # Written through before the lock is released, so the next appender starts after it
+            self._data.flush()
+            self._index_node(record, offset)
+            self._tail = offset + RECORD_LEN.size + len(raw)
+            if self._unflushed >= self.flush_every:
+                self._flush()
+        return record["id"]
+
+    def add_tree(self, tree):
+        """Load an authored tree (STORY_TREE layout); a choice's "next" names its target node"""
+        nodes = tree.get("nodes", {})
+        targets = {choice.get("next") for node in nodes.values() for choice in node.get("choices", [])}
+        for node_id, node in nodes.items():
+            if node_id not in targets:
+                self.add(dict(node, id=node.get("id", node_id)))
+        for node in nodes.values():
+            for choice in node.get("choices", []):
+                target = nodes.get(choice.get("next"))
+                if target is not None:
+                    self.add(dict(target, id=target.get("id", choice["next"])), node["text"], choice["text"])
+
+    def flush(self):
+        """Merge recently added nodes into the index file"""
+        with self._lock, self._file_lock:
+            self._flush()
+
+    def _flush(self):
+        """Rewrite the index file (caller holds both locks)"""
+        self._catch_up()
+        if not self._recent:
+            return
+        self._data.flush()
+        os.fsync(self._data.fileno())
+        covered = self._tail
+
+        # Another process may have rewritten the index since it was mapped; merge into the current one
+        self._open_index()
+        entries = {}
+        if self._index_map is not None:
+            for i in range(self._index_count):
+                key, offset = INDEX_ENTRY.unpack_from(self._index_map, INDEX_HEADER.size + i * INDEX_ENTRY.size)
+                entries[key] = offset
+            # Windows can't replace a file that is still mapped
+            self._index_map.close()
+            self._index_map = None
+        for key, offset in self._recent.items():
+            entries.setdefault(key, offset)
+        keys = sorted(entries)
+        # Records the index file already counts are not counted again
+        nodes = self._index_nodes + sum(1 for offset in self._recent_records if offset >= self._covered)
+
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, covered, len(keys), nodes))
+            f.write(b"".join(INDEX_ENTRY.pack(key, entries[key]) for key in keys))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_path)
+        self._recent = {}
+        self._recent_records = []
+        self._unflushed = 0
+        self._open_index()
+
+    def __len__(self):
+        """Number of node records"""
+        return self._index_nodes + self._unflushed
+
+    def close(self):
+        with self._lock:
+            with self._file_lock:
+                self._flush()
+            for m in (self._data_map, self._index_map):
+                if m is not None:
+                    m.close()
+            self._data_map = self._index_map = None
+            self._data.close()
+            self._file_lock.close()
+
+
+def compile_tree(tree, path):
+    """Write an authored tree to a fresh story graph at `path`"""
+    for suffix in (".dat", ".idx"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    graph = StoryGraph(path)
+    graph.add_tree(tree)
+    graph.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect a story graph")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("compile", help="Compile an authored campaign (STORY_TREE-style JSON)")
+    build.add_argument("campaign")
+    build.add_argument("--out", default="story_graph")
+    show = sub.add_parser("get", help="Print a node by id")
+    show.add_argument("node_id")
+    show.add_argument("--graph", default="story_graph")
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        with open(args.campaign, "r", encoding="utf-8") as f:
+            compile_tree(json.load(f), args.out)
+        print(f"Compiled {args.campaign} into {args.out}.dat / {args.out}.idx")
+    else:
+        graph = StoryGraph(args.graph)
+        print(json.dumps(graph.get(args.node_id), ensure_ascii=False, indent=2))
+        graph.close()
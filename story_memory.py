@@ -0,0 +1,150 @@
+import re
+import sys
+from collections import deque
+
+import choice_classifier
+from session_state import Turn
+
+DEFAULT_WINDOW = 4          # Recent turns kept verbatim
+DEFAULT_TOKEN_BUDGET = 600  # Tokens the whole memory may add to a prompt
+SUMMARY_SHARE = 0.4         # Part of the budget reserved for the summary of older turns
+HISTORY_LIMIT = 10          # History entries kept in the game state for the UI and resuming
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English prose)"""
+    return len(text) // 4 + 1
+
+
+def gist(scene_text, max_words=20):
+    """First sentence of a scene, cut to a few words"""
+    sentence = _SENTENCE_END.split(scene_text.strip(), 1)[0]
+    words = sentence.split()
+    if len(words) > max_words:
+        return " ".join(words[:max_words]) + "..."
+    return sentence
+
+
+class StoryMemory:
+    """Rolling window of verbatim recent turns plus a running summary of older ones
+
+    Turns that fall out of the window are condensed into one-line beats
+    ("choice: first sentence of the scene"). When the beats outgrow their
+    share of the token budget, the oldest lose their scene gist and then
+    are dropped, leaving only a count of earlier turns. The prompt context
+    therefore stays within `token_budget` however long the session runs.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, token_budget=DEFAULT_TOKEN_BUDGET, summary_share=SUMMARY_SHARE):
+        self.window = window
+        self.token_budget = token_budget
+        self.summary_share = summary_share
+        self.turns = 0
+        self.forgotten = 0      # Turns no longer represented by a beat
+        self.recent = deque()   # (choice, scene) pairs, oldest first
+        self.beats = deque()    # [choice, gist] pairs for older turns, oldest first
+
+    def add_turn(self, choice, scene):
+        """Record the player's choice and the scene it produced"""
+        self.turns += 1
+        # Interned, so sessions that pass through the same scenes share one copy of its text
+        self.recent.append((sys.intern(choice), sys.intern(scene)))
+        self._trim()
+
+    def _trim(self):
+        summary_budget = int(self.token_budget * self.summary_share)
+        recent_budget = self.token_budget - summary_budget
+
+        while len(self.recent) > self.window or (
+            len(self.recent) > 1 and sum(estimate_tokens(c) + estimate_tokens(s) for c, s in self.recent) > recent_budget
+        ):
+            choice, scene = self.recent.popleft()
+            self.beats.append([choice, gist(scene)])
+
+        # Shrink the oldest beats first: drop their gist, then the beat itself
+        while self.beats and self._summary_tokens() > summary_budget:
+            for beat in self.beats:
+                if beat[1]:
+                    beat[1] = ""
+                    break
+            else:
+                self.beats.popleft()
+                self.forgotten += 1
+
+    def _summary_tokens(self):
+        return estimate_tokens(self.summary())
+
+    def summary(self):
+        """Condensed account of the turns outside the recent window"""
+        parts = []
+        if self.forgotten:
+            parts.append(f"({self.forgotten} earlier turns)")
+        for choice, scene_gist in self.beats:
+            parts.append(f"{choice}: {scene_gist}" if scene_gist else f"{choice}.")
+        return " ".join(parts)
+
+    def context(self):
+        """Prompt block describing the story so far"""
+        lines = []
+        summary = self.summary()
+        if summary:
+            lines.append(f"Story so far: {summary}")
+        recent = list(self.recent)
+        for i, (choice, scene) in enumerate(recent):
+            # The latest scene is already in the prompt as the current scene
+            if i == len(recent) - 1 or not scene:
+                lines.append(f"Previously: {choice}")
+            else:
+                lines.append(f"Previously: {choice} -> {scene}")
+        return "\n".join(lines)
+
+    def copy(self):
+        return StoryMemory.from_dict(self.to_dict())
+
+    def to_dict(self):
+        return {
+            "window": self.window,
+            "token_budget": self.token_budget,
+            "turns": self.turns,
+            "forgotten": self.forgotten,
+            "recent": [list(turn) for turn in self.recent],
+            "beats": [list(beat) for beat in self.beats],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        memory = cls(window=data.get("window", DEFAULT_WINDOW), token_budget=data.get("token_budget", DEFAULT_TOKEN_BUDGET))
+        memory.turns = data.get("turns", 0)
+        memory.forgotten = data.get("forgotten", 0)
+        memory.recent = deque(tuple(sys.intern(part) if isinstance(part, str) else part for part in turn)
+                              for turn in data.get("recent", []))
+        memory.beats = deque(list(beat) for beat in data.get("beats", []))
+        return memory
+
+    @classmethod
+    def from_history(cls, history, current_text=""):
+        """Rebuild memory from a save made before memory existed (scene texts weren't kept)"""
+        memory = cls()
+        for i, entry in enumerate(history):
+            scene = current_text if i == len(history) - 1 else ""
+            memory.add_turn(entry.get("choice", ""), scene)
+        return memory
+
+
+def load_memory(state):
+    """StoryMemory for a loaded game state, upgrading older saves"""
+    if state and state.get("memory"):
+        return StoryMemory.from_dict(state["memory"])
+    if state:
+        return StoryMemory.from_history(state.get("history", []), state.get("current_text", ""))
+    return StoryMemory()
+
+
+def record_turn(history, memory, choice, next_node, **extra):
+    """Append a turn to the bounded history and the story memory"""
+    history.append(Turn.from_entry(dict({"choice": choice, "choices": next_node.get("choices", [])}, **extra)))
+    del history[:-HISTORY_LIMIT]
+    memory.add_turn(choice, next_node["text"])
+    choice_classifier.record(choice)
@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+
+import metrics
+from metrics import percentile
+from main import (
+    OLLAMA_MODEL,
+    generate_next_node_ollama,
+    get_warmup,
+    scene_cache_key,
+    validate_response,
+    create_fallback_response,
+)
+from story_data import STORY_TREE
+from utils import queue_save, load_game, get_saver
+from story_memory import load_memory, record_turn
+
+# Fields each op needs besides "op"
+REQUIRED_FIELDS = {"choose": ("session_id", "choice"), "state": ("session_id",), "end": ("session_id",)}
+
+
+class GenerationBatcher:
+    """Coalesce concurrent scene requests for one model into batches
+
+    Requests arriving within `max_wait` seconds of each other (up to
+    `max_batch`) are dispatched together; identical requests in a batch share
+    one generation. At most `max_concurrency` generations run against the
+    model at once.
+    """
+
+    def __init__(self, generate, max_batch=8, max_wait=0.02, max_concurrency=2, latency_window=1000):
+        self.generate = generate
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_concurrency = max_concurrency
+        self._queue = asyncio.Queue()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._worker = None
+        self._tasks = set()  # Running generations; the loop only keeps weak references to tasks
+        self._latencies = deque(maxlen=latency_window)
+        self.in_flight = 0
+        self.stats = {"requests": 0, "batches": 0, "generations": 0, "coalesced": 0}
+
+    async def submit(self, current_text, choice_text, history, story_meta=None, memory=None):
+        """Queue a request and wait for its scene"""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        memory = memory.copy() if memory is not None else None
+        args = (current_text, choice_text, list(history), story_meta, memory)
+        self.stats["requests"] += 1
+        await self._queue.put((time.perf_counter(), args, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        """Group a batch by cache key and start one generation per distinct request"""
+        self.stats["batches"] += 1
+        groups = {}
+        for queued_at, args, future in batch:
+            groups.setdefault(scene_cache_key(*args), []).append((queued_at, args, future))
+        self.stats["coalesced"] += len(batch) - len(groups)
+        for waiters in groups.values():
+            task = asyncio.create_task(self._generate(waiters))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _generate(self, waiters):
+        args = waiters[0][1]
+        self.in_flight += 1
+        try:
+            async with self._semaphore:
+                self.stats["generations"] += 1
+                node = await asyncio.to_thread(self.generate, *args)
+            if not validate_response(node):
+                node = create_fallback_response(args[1])
+        except Exception as e:
+            print(f"⚠️ Generation failed: {e}")
+            node = create_fallback_response(args[1])
+        finally:
+            self.in_flight -= 1
+
+        now = time.perf_counter()
+        for queued_at, _, future in waiters:
+            self._latencies.append(now - queued_at)
+            if not future.done():
+                future.set_result(node)
+
+    def metrics(self):
+        """Queue depth, throughput counters and p50/p99 request latency in seconds"""
+        latencies = list(self._latencies)
+        return dict(
+            self.stats,
+            queue_depth=self._queue.qsize(),
+            in_flight=self.in_flight,
+            max_concurrency=self.max_concurrency,
+            latency_p50=percentile(latencies, 50),
+            latency_p99=percentile(latencies, 99),
+        )
+
+
+class StoryServer:
+    """Hold many independent story sessions and serve their turns through per-model batchers
+
+    `backends` maps model name -> generate(current_text, choice_text, history, story_meta, memory);
+    `model_limits` caps concurrent generations per model. With `persist`, each
+    session is saved to the session store after every turn and resumed by id.
+    A `warmup` manager (see warmup.py) is started with the server and kept
+    pinging while turns keep arriving.
+    """
+
+    def __init__(self, backends=None, model_limits=None, max_batch=8, max_wait=0.02, default_limit=2,
+                 persist=True, warmup=None):
+        self.backends = backends or {OLLAMA_MODEL: generate_next_node_ollama}
+        self.default_model = next(iter(self.backends))
+        self.model_limits = model_limits or {}
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.default_limit = default_limit
+        self.persist = persist
+        self.warmup = warmup
+        self.sessions = {}
+        self._locks = {}  # session_id -> asyncio.Lock, so one session's turns run one at a time
+        self._batchers = {}
+
+    def _batcher(self, model):
+        if model not in self._batchers:
+            self._batchers[model] = GenerationBatcher(
+                self.backends[model],
+                max_batch=self.max_batch,
+                max_wait=self.max_wait,
+                max_concurrency=self.model_limits.get(model, self.default_limit),
+            )
+        return self._batchers[model]
+
+    def new_session(self, session_id=None, story_meta=None, model=None):
+        """Start a session at the story's opening scene, or resume a saved one by id"""
+        if model is not None and model not in self.backends:
+            raise ValueError(f"Unknown model: {model}")
+        session_id = session_id or uuid.uuid4().hex
+        start = STORY_TREE["nodes"]["start"]
+        state = (load_game(session_id) if self.persist else None) or {}
+        history = state.get("history", [])
+        self.sessions[session_id] = {
+            "current_text": state.get("current_text", start["text"]),
+            "choices": history[-1]["choices"] if history and "choices" in history[-1] else start["choices"],
+            "history": history,
+            "memory": load_memory(state),
+            "story_meta": state.get("story_meta", story_meta or STORY_TREE.get("meta", {})),
+            "model": model or self.default_model,
+        }
+        return session_id
+
+    def get_session(self, session_id):
+        if session_id not in self.sessions:
+            raise KeyError(f"Unknown session: {session_id}")
+        return self.sessions[session_id]
+
+    def end_session(self, session_id):
+        self.sessions.pop(session_id, None)
+        self._locks.pop(session_id, None)
+
+    async def choose(self, session_id, choice_id):
+        """Apply a choice (by id or 1-based index) and return the next scene
+
+        Choices for the same session are applied one after another, each from
+        the scene the previous one produced.
+        """
+        self.get_session(session_id)
+        async with self._locks.setdefault(session_id, asyncio.Lock()):
+            return await self._choose(self.get_session(session_id), session_id, choice_id)
+
+    async def _choose(self, session, session_id, choice_id):
+        choices = session["choices"]
+        selected = None
+        for i, choice in enumerate(choices, 1):
+            if choice["id"] == choice_id or str(i) == str(choice_id):
+                selected = choice
+                break
+        if selected is None:
+            raise ValueError(f"Invalid choice: {choice_id}")
+
+        if self.warmup is not None:
+            self.warmup.touch()
+        node = await self._batcher(session["model"]).submit(
+            session["current_text"], selected["text"], session["history"], session["story_meta"], session["memory"]
+        )
+        record_turn(session["history"], session["memory"], selected["text"], node)
+        session["current_text"] = node["text"]
+        session["choices"] = node.get("choices", [])
+        if self.persist:
+            # Only queued here; the save writer commits it. The thread hop keeps the
+            # event loop free if the writer's queue is full
+            await asyncio.to_thread(queue_save, session_id, {
+                "current_text": session["current_text"],
+                "history": session["history"],
+                "memory": session["memory"].to_dict(),
+                "story_meta": session["story_meta"],
+            })
+        return node
+
+    def metrics(self):
+        """Session count, per-model queue and latency stats, turn-stage metrics and model residency"""
+        report = {
+            "sessions": len(self.sessions),
+            "models": {model: batcher.metrics() for model, batcher in self._batchers.items()},
+            "turns": metrics.snapshot(),
+        }
+        if self.warmup is not None:
+            report["residency"] = self.warmup.state()
+        if self.persist:
+            report["saves"] = get_saver().metrics()
+        return report
+
+    async def handle_connection(self, reader, writer):
+        """JSON-lines protocol: one request object per line, one reply object per line
+
+        {"op": "new"} -> {"session_id", "text", "choices"}
+        {"op": "choose", "session_id", "choice"} -> {"text", "choices"}
+        {"op": "state", "session_id"} / {"op": "end", "session_id"} / {"op": "metrics"}
+        {"op": "metrics", "format": "prometheus"} -> {"text"}
+        """
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("Request must be a JSON object")
+                    reply = await self._handle_request(request)
+                except (KeyError, ValueError) as e:
+                    # str() of a KeyError is the repr of its message, quotes included
+                    reply = {"error": e.args[0] if isinstance(e, KeyError) and e.args else str(e)}
+                except Exception as e:
+                    # One bad request must not end the connection, or the other requests on it
+                    print(f"⚠️ Request failed: {e!r}")
+                    reply = {"error": f"Request failed: {e}"}
+                writer.write((json.dumps(reply, ensure_ascii=False) + "\n").encode("utf-8"))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _handle_request(self, request):
+        op = request.get("op")
+        for field in REQUIRED_FIELDS.get(op, ()):
+            if field not in request:
+                raise ValueError(f"Missing field: {field}")
+        if op == "new":
+            session_id = self.new_session(request.get("session_id"), model=request.get("model"))
+            session = self.sessions[session_id]
+            return {"session_id": session_id, "text": session["current_text"], "choices": session["choices"]}
+        if op == "choose":
+            node = await self.choose(request["session_id"], request["choice"])
+            return {"text": node["text"], "choices": node.get("choices", [])}
+        if op == "state":
+            session = self.get_session(request["session_id"])
+            return {"text": session["current_text"], "choices": session["choices"], "turns": session["memory"].turns}
+        if op == "end":
+            self.end_session(request["session_id"])
+            return {"ok": True}
+        if op == "metrics":
+            if request.get("format") == "prometheus":
+                return {"text": metrics.to_prometheus()}
+            return self.metrics()
+        raise ValueError(f"Unknown op: {op}")
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        if self.warmup is not None:
+            self.warmup.start()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Story server listening on {host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-session AI Storyteller server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-wait", type=float, default=0.02, help="Batching window in seconds")
+    parser.add_argument("--concurrency", type=int, default=2, help="Concurrent generations per model")
+    args = parser.parse_args()
+
+    server = StoryServer(max_batch=args.max_batch, max_wait=args.max_wait, default_limit=args.concurrency,
+                         warmup=get_warmup())
+    asyncio.run(server.serve(args.host, args.port))
@@ -0,0 +1,148 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCENE = {
+    "text": "You step into the hall.",
+    "choices": [{"id": "choice1", "text": "Open the door"}, {"id": "choice2", "text": "Turn back"}],
+}
+
+
+class StubOllama(ThreadingHTTPServer):
+    """Local stand-in for the Ollama HTTP API
+
+    /api/generate answers with the next of `replies`, then `reply` (streamed as
+    JSON lines in `chunk_size` pieces when asked to stream) after `delay`
+    seconds; a request without a prompt loads the model. With `fail` set, or
+    for the next `fail_next` requests, it answers HTTP 500 instead.
+    /api/ps lists the models in `loaded`. Every request body is kept in
+    `requests`, and `connections` counts the TCP connections accepted.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.reply = json.dumps(SCENE)
+        self.chunk_size = 8
+        self.delay = 0.0
+        self.loaded = set()
+        self.replies = []
+        self.fail = False
+        self.fail_next = 0
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    @property
+    def host(self):
+        return f"127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, as Ollama serves it
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, value, status=200):
+        body = json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/ps":
+            self._send_json({"models": [{"name": name} for name in sorted(self.server.loaded)]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(payload)
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        with self.server.lock:
+            fail = self.server.fail or self.server.fail_next > 0
+            self.server.fail_next = max(0, self.server.fail_next - 1)
+            reply = ""
+            if "prompt" in payload and not fail:
+                reply = self.server.replies.pop(0) if self.server.replies else self.server.reply
+        if fail:
+            self._send_json({"error": "model failed to load"}, 500)
+            return
+        self.server.loaded.add(payload["model"])
+        if not payload.get("stream"):
+            self._send_json({"response": reply, "done": True, "eval_count": len(reply)})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        size = self.server.chunk_size
+        chunks = [{"response": reply[i:i + size], "done": False} for i in range(0, len(reply), size)]
+        chunks.append({"response": "", "done": True, "eval_count": len(chunks)})
+        for chunk in chunks:
+            line = (json.dumps(chunk) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def serve_stub():
+    server = StubOllama()
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    return server
+
+
+def stop_stub(server):
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def stub_ollama():
+    server = serve_stub()
+    yield server
+    stop_stub(server)
+
+
+@pytest.fixture
+def backup_ollama():
+    """A second stub server, for routing between backends"""
+    server = serve_stub()
+    yield server
+    stop_stub(server)
+
+
+@pytest.fixture
+def backend(stub_ollama, monkeypatch):
+    """main wired to the stub server, with the cache, story graph and similarity reuse off"""
+    import main
+    from generation_cache import GenerationCache
+    from ollama_client import OllamaClient
+
+    client = OllamaClient(main.OLLAMA_MODEL, host=stub_ollama.host)
+    monkeypatch.setattr(main, "_client", client)
+    monkeypatch.setattr(main, "_cache", GenerationCache([]))
+    monkeypatch.setattr(main, "_graph", None)
+    monkeypatch.setattr(main, "GRAPH_PATH", "")
+    monkeypatch.setattr(main, "_similar", None)
+    monkeypatch.setattr(main, "SIMILARITY_THRESHOLD", "")
+    monkeypatch.setattr(main, "_policy", None)
+    yield main
+    client.close()
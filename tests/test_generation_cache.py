@@ -0,0 +1,123 @@
+import pytest
+
+import generation_cache
+from generation_cache import GenerationCache, MemoryTier, SQLiteTier, make_cache_key
+
+
+def node(n):
+    return {"text": f"Scene {n}", "choices": [{"id": "choice1", "text": "Go on"}, {"id": "choice2", "text": "Stop"}]}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(generation_cache.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "cache.db")
+
+
+def test_key_ignores_whitespace_and_old_history():
+    history = [{"choice": f"Choice {n}"} for n in range(5)]
+    key = make_cache_key("The hall.", "Open the door", history)
+    assert make_cache_key(" The  hall.\n", "Open the  door", history[-3:]) == key
+    assert make_cache_key("The hall.", "Open the door", history[:4]) != key
+    assert make_cache_key("The hall.", "Open the door", history, {"genre": "Horror"}) != key
+    # A story-memory block replaces the choice window
+    assert make_cache_key("The hall.", "Open the door", history, context="Memory") == \
+        make_cache_key("The hall.", "Open the door", [], context="Memory")
+
+
+def test_memory_tier_evicts_least_recently_used():
+    tier = MemoryTier(max_entries=2)
+    tier.put("a", node(1))
+    tier.put("b", node(2))
+    assert tier.get("a") == node(1)  # "b" is now the least recent
+    tier.put("c", node(3))
+    assert tier.get("b") is None
+    assert tier.get("a") == node(1)
+    assert len(tier) == 2
+
+
+def test_memory_tier_expires_entries(clock):
+    tier = MemoryTier(ttl=60)
+    tier.put("a", node(1))
+    clock.now += 59
+    assert tier.get("a") == node(1)
+    clock.now += 2
+    assert tier.get("a") is None
+    assert len(tier) == 0
+
+
+def test_sqlite_tier_survives_reopening(db_path):
+    tier = SQLiteTier(db_path)
+    tier.put("a", node(1))
+    tier.close()
+    reopened = SQLiteTier(db_path)
+    assert reopened.get("a") == node(1)
+    assert len(reopened) == 1
+    reopened.close()
+
+
+def test_sqlite_tier_expires_entries(db_path, clock):
+    tier = SQLiteTier(db_path, ttl=60)
+    tier.put("a", node(1))
+    clock.now += 61
+    assert tier.get("a") is None
+    assert len(tier) == 0
+    tier.close()
+
+
+def test_sqlite_tier_evicts_least_recently_used(db_path, clock):
+    tier = SQLiteTier(db_path, max_entries=10)
+    for n in range(99):
+        clock.now += 1
+        tier.put(str(n), node(n))
+    clock.now += 1
+    assert tier.get("0") == node(0)  # Used most recently, so it survives eviction
+    assert len(tier) == 99  # Eviction only runs every 100 writes
+    clock.now += 1
+    tier.put("99", node(99))
+    assert len(tier) == 10
+    assert tier.get("0") == node(0)
+    assert tier.get("99") == node(99)
+    assert tier.get("1") is None
+    tier.close()
+
+
+def test_slower_tier_hit_is_promoted(db_path):
+    memory, disk = MemoryTier(), SQLiteTier(db_path)
+    disk.put("a", node(1))
+    cache = GenerationCache([memory, disk])
+    assert memory.get("a") is None
+
+    assert cache.get("a") == node(1)
+    assert memory.get("a") == node(1)
+    assert cache.get("a") == node(1)
+    assert cache.get("missing") is None
+    stats = cache.metrics()
+    assert (stats["sqlite_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["hit_rate"] == pytest.approx(2 / 3)
+    disk.close()
+
+
+def test_put_writes_every_tier_and_clear_empties_them(db_path):
+    memory, disk = MemoryTier(), SQLiteTier(db_path)
+    cache = GenerationCache([memory, disk])
+    cache.put("a", node(1))
+    assert memory.get("a") == disk.get("a") == node(1)
+    assert cache.metrics()["stores"] == 1
+    cache.clear()
+    assert len(memory) == len(disk) == 0
+    disk.close()
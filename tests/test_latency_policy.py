@@ -0,0 +1,152 @@
+import random
+import types
+
+import pytest
+
+import latency_policy
+import metrics
+from latency_policy import BACKOFF_BASE, BACKOFF_CAP, MIN_SAMPLES, LatencyPolicy
+from ollama_client import OllamaClient, OllamaError
+
+
+class Clock:
+    """Fake monotonic clock; sleeping advances it instead of waiting"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    fake_time = types.SimpleNamespace(monotonic=clock.monotonic, sleep=clock.sleep, time=clock.monotonic)
+    monkeypatch.setattr(latency_policy, "time", fake_time)
+    return clock
+
+
+@pytest.fixture
+def client(stub_ollama):
+    client = OllamaClient("stub-model", host=stub_ollama.host)
+    yield client
+    client.close()
+
+
+def policy(**kwargs):
+    kwargs.setdefault("log_path", None)
+    return LatencyPolicy(rng=random.Random(1), **kwargs)
+
+
+def test_first_call_is_cold_until_something_succeeds(clock):
+    p = policy(default_timeout=30, cold_timeout=120, cold_after=600)
+    assert p.expect_cold()
+    assert p.deadline() == 120
+    p.observe(2.0, cold=True)
+    assert not p.expect_cold()
+    assert p.deadline() == 30  # Too few warm samples to learn from yet
+
+    clock.now += 601  # Ollama has unloaded the model by now
+    assert p.expect_cold()
+    p.mark_warm()  # ...unless a warm-up ping just loaded it
+    assert not p.expect_cold()
+
+
+def test_warm_deadline_is_learned_from_p99(clock):
+    p = policy(default_timeout=30, min_timeout=1)
+    for seconds in [0.5] * (MIN_SAMPLES - 1) + [2.0]:
+        p.observe(seconds)
+    assert p.deadline(cold=False) == pytest.approx(2.0 * latency_policy.HEADROOM)
+    for _ in range(10):
+        p.observe(0.1)
+    assert p.deadline(cold=False) == pytest.approx(2.0 * latency_policy.HEADROOM)  # p99 still sees the slow one
+
+    fast = policy(min_timeout=1)
+    for _ in range(MIN_SAMPLES):
+        fast.observe(0.1)
+    assert fast.deadline(cold=False) == 1  # Never below min_timeout
+
+
+def test_cold_deadline_never_drops_below_cold_timeout(clock):
+    p = policy(cold_timeout=120)
+    p.observe(100.0, cold=True)
+    assert p.deadline(cold=True) == pytest.approx(100.0 * latency_policy.HEADROOM)
+    short = policy(cold_timeout=120)
+    short.observe(10.0, cold=True)
+    assert short.deadline(cold=True) == 120
+
+
+def test_failures_are_retried_with_jittered_backoff(clock, stub_ollama, client):
+    stub_ollama.fail_next = 2
+    p = policy()
+    reply = p.call(lambda timeout: client.generate("Begin", timeout=timeout), retry_on=(OllamaError,))
+    assert reply["done"]
+    assert len(stub_ollama.requests) == 3
+    assert [d["outcome"] for d in p.decisions] == ["OllamaError", "OllamaError", "ok"]
+    assert len(clock.sleeps) == 2
+    for attempt, pause in enumerate(clock.sleeps, 1):
+        assert 0 <= pause <= min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempt - 1))
+    assert [d["backoff"] for d in list(p.decisions)[:2]] == clock.sleeps
+
+
+def test_gives_up_after_max_attempts(clock, stub_ollama, client):
+    stub_ollama.fail = True
+    p = policy(max_attempts=3)
+    with pytest.raises(OllamaError):
+        p.call(lambda timeout: client.generate("Begin", timeout=timeout), retry_on=(OllamaError,))
+    assert len(stub_ollama.requests) == 3
+    assert p.decisions[-1]["retry"] is False
+
+
+def test_errors_outside_retry_on_are_not_retried(clock):
+    def attempt(timeout):
+        raise KeyError("bug")
+
+    with pytest.raises(KeyError):
+        policy().call(attempt, retry_on=(OllamaError,))
+    assert clock.sleeps == []
+
+
+def test_attempts_stay_within_the_turn_budget(clock, stub_ollama, client):
+    stub_ollama.fail = True
+    timeouts = []
+
+    def slow_attempt(timeout):
+        timeouts.append(timeout)
+        clock.now += 40  # Each attempt burns 40 seconds before failing
+        return client.generate("Begin", timeout=timeout)
+
+    p = policy(turn_budget=50, default_timeout=30, cold_timeout=30, max_attempts=5)
+    with pytest.raises(OllamaError):
+        p.call(slow_attempt, retry_on=(OllamaError,))
+    # The second attempt only gets what is left of the budget, and there is no time for a third
+    assert len(timeouts) == 2
+    assert timeouts[0] == 30
+    assert timeouts[1] == pytest.approx(50 - 40 - clock.sleeps[0])
+
+
+def test_timed_out_attempt_is_retried(clock, stub_ollama, client):
+    before = metrics.counter("attempt_timeouts")
+    p = policy(min_timeout=0.2)
+    for _ in range(MIN_SAMPLES):
+        p.observe(0.01)  # Learned deadline: min_timeout
+    stub_ollama.delay = 1.0
+    timeouts = []
+
+    def attempt(timeout):
+        timeouts.append(timeout)
+        try:
+            return client.generate("Begin", timeout=timeout)
+        finally:
+            stub_ollama.delay = 0.0  # The model answers quickly once it is loaded
+
+    assert p.call(attempt, retry_on=(TimeoutError, OllamaError))["done"]
+    assert timeouts == [0.2, 0.2]
+    assert [d["outcome"] for d in p.decisions] == ["TimeoutError", "ok"]
+    assert metrics.counter("attempt_timeouts") == before + 1
@@ -0,0 +1,115 @@
+import time
+
+import pytest
+
+import metrics
+from model_router import COOLDOWN, MIN_SAMPLES, TRIP_AFTER, Backend, ModelRouter
+from ollama_client import OllamaClient, OllamaError
+
+
+@pytest.fixture
+def router(stub_ollama, backup_ollama):
+    router = ModelRouter([
+        Backend("primary", OllamaClient("stub-model", host=stub_ollama.host)),
+        Backend("backup", OllamaClient("stub-model", host=backup_ollama.host)),
+    ], hedge_min_delay=0.05)
+    yield router
+    router.close()
+
+
+def prime(backend, seconds, count=MIN_SAMPLES):
+    """Give a backend enough latency history to be ranked and hedged on"""
+    for _ in range(count):
+        backend.record(True, seconds)
+
+
+def counted(name, before):
+    return metrics.counter(name) - before.get(name, 0)
+
+
+def test_request_goes_to_the_fastest_backend(router, stub_ollama, backup_ollama):
+    primary, backup = router.backends
+    prime(primary, 0.02)
+    prime(backup, 0.01)
+    assert router.generate("Begin")["backend"] == "backup"
+    assert len(backup_ollama.requests) == 1
+    assert stub_ollama.requests == []
+
+
+def test_unmeasured_backend_is_tried_first(router, backup_ollama):
+    prime(router.backends[0], 0.01)
+    assert router.generate("Begin")["backend"] == "backup"
+
+
+def test_failed_backend_fails_over(router, stub_ollama, backup_ollama):
+    before = metrics.snapshot()["counters"]
+    stub_ollama.fail = True
+    reply = router.generate("Begin")
+    assert reply["backend"] == "backup"
+    assert len(stub_ollama.requests) == 1
+    assert counted("backend_failovers", before) == 1
+    assert router.backends[0].consecutive_failures == 1
+
+
+def test_backend_is_tripped_after_repeated_failures(router, stub_ollama, monkeypatch):
+    primary, backup = router.backends
+    # A mostly reliable, fast primary, so only the run of failures takes it out
+    prime(primary, 0.001, count=10)
+    prime(backup, 0.01)
+    stub_ollama.fail = True
+    for _ in range(TRIP_AFTER):
+        assert router.generate("Begin")["backend"] == "backup"
+    assert primary.error_rate() < 0.5
+    assert not primary.healthy()
+    assert router.ranked()[0].name == "backup"
+
+    router.generate("Begin")
+    assert len(stub_ollama.requests) == TRIP_AFTER  # Sat out, not even tried
+
+    # After the cooldown, and once its error rate recovers, it is back in rotation
+    later = time.monotonic() + COOLDOWN + 1
+    monkeypatch.setattr("model_router.time.monotonic", lambda: later)
+    assert primary.healthy()
+    assert router.ranked()[0] is primary
+
+
+def test_every_backend_failing_raises(router, stub_ollama, backup_ollama):
+    stub_ollama.fail = backup_ollama.fail = True
+    with pytest.raises(OllamaError, match="HTTP 500"):
+        router.generate("Begin")
+    assert len(stub_ollama.requests) == len(backup_ollama.requests) == 1
+
+
+def test_slow_request_is_hedged_to_the_next_backend(router, stub_ollama, backup_ollama):
+    before = metrics.snapshot()["counters"]
+    primary, backup = router.backends
+    prime(primary, 0.01)
+    prime(backup, 0.02)
+    stub_ollama.delay = 1.0  # Far past primary's usual p95
+
+    started = time.perf_counter()
+    reply = router.generate("Begin")
+    assert time.perf_counter() - started < 0.8
+    assert reply["backend"] == "backup"
+    assert len(backup_ollama.requests) == 1
+    assert counted("hedged_requests", before) == 1
+    assert counted("hedge_wins", before) == 1
+
+
+def test_fast_request_is_not_hedged(router, backup_ollama):
+    before = metrics.snapshot()["counters"]
+    prime(router.backends[0], 0.5)
+    prime(router.backends[1], 0.6)
+    assert router.generate("Begin")["backend"] == "primary"
+    assert backup_ollama.requests == []
+    assert counted("hedged_requests", before) == 0
+
+
+def test_stream_fails_over_before_the_first_chunk(router, stub_ollama, backup_ollama):
+    stub_ollama.fail = True
+    chunks = list(router.generate_stream("Begin"))
+    assert chunks[-1]["done"]
+    assert len(backup_ollama.requests) == 1
+    assert router.backends[0].consecutive_failures == 1
+    assert router.backends[1].latency(streaming=True) is None  # Only one sample so far
+    assert len(router.backends[1].first_token) == 1
@@ -0,0 +1,63 @@
+import socket
+
+import pytest
+
+from ollama_client import OllamaClient, OllamaError
+
+
+def test_generate_reuses_one_keep_alive_connection(stub_ollama):
+    client = OllamaClient("stub-model", host=stub_ollama.host)
+    for _ in range(3):
+        reply = client.generate("Begin", system="Narrate")
+        assert reply["done"]
+    assert stub_ollama.connections == 1
+    client.close()
+
+
+def test_generate_sends_keep_alive_and_system(stub_ollama):
+    client = OllamaClient("stub-model", host=stub_ollama.host, keep_alive="10m")
+    client.generate("Begin", system="Narrate", format="json")
+    payload = stub_ollama.requests[-1]
+    assert payload["keep_alive"] == "10m"
+    assert payload["system"] == "Narrate"
+    assert payload["format"] == "json"
+    assert payload["stream"] is False
+    client.close()
+
+
+def test_dropped_pooled_connection_is_replaced(stub_ollama):
+    client = OllamaClient("stub-model", host=stub_ollama.host)
+    client.generate("Begin")
+    # The server (or a proxy) closed the idle socket while it sat in the pool
+    pooled = client._pool.get_nowait()
+    pooled.sock.shutdown(socket.SHUT_RDWR)
+    client._pool.put_nowait(pooled)
+    assert client.generate("Again")["done"]
+    assert stub_ollama.connections == 2
+    client.close()
+
+
+def test_pool_keeps_at_most_pool_size_connections(stub_ollama):
+    client = OllamaClient("stub-model", host=stub_ollama.host, pool_size=2)
+    conns = [client._acquire()[0] for _ in range(3)]
+    for conn in conns:
+        client._release(conn)
+    assert client._pool.qsize() == 2
+    client.close()
+    assert client._pool.qsize() == 0
+
+
+def test_http_error_raises_ollama_error(stub_ollama):
+    stub_ollama.fail = True
+    client = OllamaClient("stub-model", host=stub_ollama.host)
+    with pytest.raises(OllamaError, match="HTTP 500"):
+        client.generate("Begin")
+
+
+def test_unreachable_server_raises_ollama_error():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    client = OllamaClient("stub-model", host=f"127.0.0.1:{port}", timeout=2)
+    with pytest.raises(OllamaError, match="Cannot reach Ollama"):
+        client.generate("Begin")
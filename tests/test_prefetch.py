@@ -0,0 +1,69 @@
+import threading
+
+from prefetch import PrefetchPool, Prefetcher
+
+CHOICES = [{"id": "choice1", "text": "Left"}, {"id": "choice2", "text": "Right"}]
+
+
+def scene(choice_text):
+    return {"text": f"You went {choice_text}.", "choices": CHOICES}
+
+
+def test_take_waits_for_a_running_branch():
+    release = threading.Event()
+    started = threading.Event()
+
+    def generate(current_text, choice_text, history, story_meta, cancel=None, memory=None):
+        if choice_text == "Left":
+            started.set()
+            release.wait()
+        return scene(choice_text), 10
+
+    pool = PrefetchPool(max_workers=2)
+    prefetcher = Prefetcher(generate, pool=pool)
+    prefetcher.start("Fork.", CHOICES, [])
+    started.wait(5)
+    assert prefetcher.running("Left")
+
+    result = []
+    taker = threading.Thread(target=lambda: result.append(prefetcher.take("Left")))
+    taker.start()
+    taker.join(0.2)
+    assert taker.is_alive()  # Still waiting on the branch rather than giving up on it
+    release.set()
+    taker.join(5)
+    assert result == [scene("Left")]
+    assert prefetcher.metrics()["hits"] == 1
+    pool.shutdown()
+
+
+def test_queued_branch_is_dropped_for_a_live_call():
+    release = threading.Event()
+
+    def generate(current_text, choice_text, history, story_meta, cancel=None, memory=None):
+        release.wait()
+        return scene(choice_text), 10
+
+    pool = PrefetchPool(max_workers=1)
+    prefetcher = Prefetcher(generate, pool=pool)
+    prefetcher.start("Fork.", CHOICES, [])
+    assert not prefetcher.running("Right")  # Queued behind Left
+    assert prefetcher.take("Right") is None
+    assert prefetcher.metrics()["misses"] == 1
+    release.set()
+    pool.shutdown()
+
+
+def test_saturated_pool_skips_branches():
+    release = threading.Event()
+
+    def generate(current_text, choice_text, history, story_meta, cancel=None, memory=None):
+        release.wait()
+        return scene(choice_text), 0
+
+    pool = PrefetchPool(max_workers=1, max_queued=0)
+    prefetcher = Prefetcher(generate, pool=pool)
+    prefetcher.start("Fork.", CHOICES, [])
+    assert prefetcher.metrics()["skipped"] == 1
+    release.set()
+    pool.shutdown()
@@ -0,0 +1,43 @@
+import pytest
+
+from prerender import prerender
+from similarity_index import SimilarityIndex
+from story_data import STORY_TREE
+from story_graph import StoryGraph
+
+
+@pytest.fixture
+def graph(backend, tmp_path, monkeypatch):
+    graph = StoryGraph(str(tmp_path / "graph"))
+    monkeypatch.setattr(backend, "_graph", graph)
+    yield graph
+    graph.close()
+
+
+def test_rerun_reuses_every_rendered_branch(graph, stub_ollama):
+    first = prerender(depth=2, fanout=2, workers=2)
+    assert first["failed"] == 0
+    assert first["generated"] == 2 + 4
+    requests = len(stub_ollama.requests)
+
+    second = prerender(depth=2, fanout=2, workers=2)
+    assert second == {"generated": 0, "reused": 6, "failed": 0}
+    assert len(stub_ollama.requests) == requests
+
+
+def test_similar_choices_are_generated_not_reused(backend, graph, monkeypatch):
+    start = STORY_TREE["nodes"]["start"]
+    similar = SimilarityIndex()
+    # Every start choice is a paraphrase of one of these
+    for choice in ("Inspect the throne", "Question the guard", "Study the tapestries", "Exit the hall"):
+        similar.add(start["text"], choice, {"text": "Elsewhere.", "choices": []})
+    assert all(similar.find(start["text"], choice["text"]) for choice in start["choices"])
+    monkeypatch.setattr(backend, "_similar", similar)
+
+    stats = prerender(depth=1, fanout=4)
+    assert stats["failed"] == 0
+    assert stats["generated"] == len(start["choices"][:4])
+    assert backend._similar is similar  # Restored afterwards
+
+    rerun = prerender(depth=1, fanout=4)
+    assert rerun == {"generated": 0, "reused": stats["generated"], "failed": 0}
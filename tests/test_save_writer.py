@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+from save_writer import SaveWriter
+
+
+class GatedStore:
+    """Records each save_many() batch; each write waits for `release` first"""
+
+    def __init__(self):
+        self.batches = []
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.fail = None
+
+    def save_many(self, items):
+        self.entered.set()
+        self.release.wait(5)
+        if self.fail is not None:
+            raise self.fail
+        self.batches.append(dict(items))
+
+
+def state(n):
+    return {"current_text": f"Scene {n}", "history": [{"choice": f"Choice {i}"} for i in range(n)]}
+
+
+@pytest.fixture
+def store():
+    return GatedStore()
+
+
+@pytest.fixture
+def writer(store):
+    writer = SaveWriter(lambda: store)
+    yield writer
+    store.release.set()
+    writer.close(timeout=5)
+
+
+def test_saves_queued_during_a_write_are_coalesced(writer, store):
+    writer.submit("s", state(1))
+    assert store.entered.wait(5)  # The first save is being written
+    for n in range(2, 5):
+        writer.submit("s", state(n))
+    writer.submit("other", state(1))
+
+    store.release.set()
+    assert writer.flush(timeout=5)
+    assert store.batches == [{"s": state(1)}, {"s": state(4), "other": state(1)}]
+    stats = writer.metrics()
+    assert stats["submitted"] == 5
+    assert stats["coalesced"] == 2
+    assert stats["written"] == 3
+    assert stats["pending"] == 0
+
+
+def test_flush_waits_for_the_write_in_progress(writer, store):
+    writer.submit("s", state(1))
+    assert store.entered.wait(5)
+    assert writer.flush(timeout=0.05) is False
+
+    store.release.set()
+    assert writer.flush(timeout=5) is True
+    assert store.batches == [{"s": state(1)}]
+
+
+def test_pending_state_is_a_copy_until_written(writer, store):
+    current = state(1)
+    writer.submit("s", current)
+    current["history"].append({"choice": "Choice 1"})
+    current["current_text"] = "Changed"
+    assert store.entered.wait(5)
+
+    pending = writer.pending_state("s")
+    assert pending == state(1)  # The caller's later edits are not in the queued save
+    pending["history"].clear()
+    assert writer.pending_state("s") == state(1)
+    assert writer.pending_state("unknown") is None
+
+    store.release.set()
+    assert writer.flush(timeout=5)
+    assert writer.pending_state("s") is None
+
+
+def test_last_error_is_kept_until_the_next_successful_write(writer, store):
+    store.fail = OSError("disk full")
+    store.release.set()
+    writer.submit("s", state(1))
+    assert writer.flush(timeout=5)
+    assert isinstance(writer.last_error("s"), OSError)
+    assert writer.last_error("other") is None
+    assert writer.metrics()["failed"] == 1
+
+    store.fail = None
+    writer.submit("s", state(2))
+    assert writer.flush(timeout=5)
+    assert writer.last_error("s") is None
+    assert store.batches == [{"s": state(2)}]
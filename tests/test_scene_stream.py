@@ -0,0 +1,140 @@
+import json
+import threading
+
+import pytest
+
+from conftest import SCENE
+from scene_stream import SceneFormatError, SceneStreamParser, parse_scene
+
+
+def feed_all(parser, chunks):
+    return "".join(parser.feed(chunk) for chunk in chunks)
+
+
+def test_text_is_emitted_across_split_chunks():
+    reply = json.dumps(SCENE)
+    parser = SceneStreamParser()
+    text = feed_all(parser, [reply[i:i + 3] for i in range(0, len(reply), 3)])
+    assert text == SCENE["text"]
+    assert parser.done
+    assert parser.result() == SCENE
+
+
+def test_escapes_split_between_chunks():
+    scene = dict(SCENE, text='She said "run" \\ then é\U0001F5E1')
+    reply = json.dumps(scene)  # \u escapes and a surrogate pair for the emoji
+    parser = SceneStreamParser()
+    assert feed_all(parser, list(reply)) == scene["text"]
+    assert parser.result() == scene
+
+
+def test_escaped_quote_does_not_end_the_text():
+    parser = SceneStreamParser()
+    text = parser.feed('{"text": "A \\"quoted\\" word", "choices": [')
+    assert text == 'A "quoted" word'
+    assert not parser.done
+
+
+def test_short_preamble_is_skipped():
+    assert parse_scene("Sure! Here is the scene:\n" + json.dumps(SCENE)) == SCENE
+
+
+def test_long_preamble_fails_early():
+    parser = SceneStreamParser(max_preamble=20)
+    with pytest.raises(SceneFormatError, match="No JSON object"):
+        parser.feed("Once upon a time, in a land far away, " * 2)
+
+
+def test_too_many_choices_fails_before_the_reply_ends():
+    choices = [{"id": f"c{i}", "text": f"Option {i}"} for i in range(4)]
+    reply = json.dumps({"text": "x", "choices": choices})
+    parser = SceneStreamParser(max_choices=3)
+    with pytest.raises(SceneFormatError, match="More than 3 choices"):
+        parser.feed(reply)
+
+
+@pytest.mark.parametrize("reply, message", [
+    ('{"text": ["x"], "choices": []}', "scene.text must be of type string"),
+    ('{"text": "x", "choices": [{"id": "a", "text": "A"}]}', "Fewer than 2 choices"),
+    ('{"text": "x", "choices": [{"id": "a"}, {"id": "b", "text": "B"}]}', "Choice without id and text"),
+    ('{"choices": [{"id": "a", "text": "A"}, {"id": "b", "text": "B"}]}', "missing text or choices"),
+])
+def test_invalid_shapes_are_rejected(reply, message):
+    with pytest.raises(SceneFormatError, match=message):
+        parse_scene(reply)
+
+
+def test_runaway_text_fails():
+    parser = SceneStreamParser(max_text_chars=10)
+    with pytest.raises(SceneFormatError, match="too long"):
+        parser.feed('{"text": "' + "a" * 11)
+
+
+def test_incomplete_reply_has_no_result():
+    parser = SceneStreamParser()
+    parser.feed(json.dumps(SCENE)[:-1])
+    with pytest.raises(SceneFormatError, match="ended before"):
+        parser.result()
+
+
+def test_streamed_turns_reuse_one_connection(backend, stub_ollama):
+    for _ in range(3):
+        stream = backend.stream_next_node_ollama("Scene", "Open the door", [])
+        assert "".join(stream) == SCENE["text"]
+        assert stream.node == SCENE
+    assert stub_ollama.connections == 1
+
+
+def test_prefetched_turns_reuse_one_connection(backend, stub_ollama):
+    for _ in range(3):
+        node, tokens = backend.generate_next_node_cancellable("Scene", "Open the door", [], cancel=threading.Event())
+        assert node == SCENE
+        assert tokens > 0
+    assert stub_ollama.connections == 1
+
+
+@pytest.fixture
+def policy(backend, monkeypatch):
+    from latency_policy import LatencyPolicy
+
+    policy = LatencyPolicy()
+    policy.backoff = lambda attempt: 0.0
+    monkeypatch.setattr(backend, "_policy", policy)
+    return policy
+
+
+def test_stream_retries_a_failure_before_any_text(backend, stub_ollama, policy):
+    stub_ollama.fail_next = 1
+    stream = backend.stream_next_node_ollama("Scene", "Open the door", [])
+    assert "".join(stream) == SCENE["text"]
+    assert stream.node == SCENE
+    assert len(stub_ollama.requests) == 2
+    assert [d["outcome"] for d in policy.decisions] == ["OllamaError", "ok"]
+
+
+def test_stream_retries_a_malformed_opening(backend, stub_ollama, policy):
+    stub_ollama.replies = ["Once upon a time, with no JSON at all. " * 10]
+    stream = backend.stream_next_node_ollama("Scene", "Open the door", [])
+    assert "".join(stream) == SCENE["text"]
+    assert len(stub_ollama.requests) == 2
+
+
+def test_stream_is_not_retried_once_text_was_shown(backend, stub_ollama, policy):
+    reply = json.dumps(SCENE)
+    stub_ollama.replies = [reply[:reply.index('"choices"')] + '"choices": 5}']
+    stream = backend.stream_next_node_ollama("Scene", "Open the door", [])
+    text = "".join(stream)
+    assert text.startswith(SCENE["text"] + "\n\n")  # The fallback scene follows what was shown
+    assert stream.node != SCENE
+    assert len(stub_ollama.requests) == 1
+
+
+def test_stream_latency_excludes_the_consumer(backend, stub_ollama, policy):
+    import time
+
+    stub_ollama.chunk_size = 4
+    for fragment in backend.stream_next_node_ollama("Scene", "Open the door", []):
+        time.sleep(0.05)  # A slow renderer
+    samples = list(policy.cold) + list(policy.warm)
+    assert len(samples) == 1
+    assert samples[0] < 0.05
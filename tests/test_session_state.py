@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+from session_state import Choices, Turn, compact_history
+
+
+@pytest.mark.parametrize("entry", [
+    {"choice": "Open the door", "choices": [{"id": "c1", "text": "Go in"}, {"id": "c2", "text": "Leave"}]},
+    {"choice": "Open the door", "choices": [], "timestamp": "2024-05-01T10:00:00.123456"},
+    {"choices": [{"text": "Go in", "id": "c1"}], "choice": "Open the door"},
+    {"choice": "Wait", "note": "extra key", "choices": [], "timestamp": "2024-05-01T10:00:00"},
+    {"choice": "Wait", "choices": "not a list", "timestamp": 12},
+])
+def test_turn_writes_back_the_saved_entry_byte_for_byte(entry):
+    turn = Turn.from_entry(entry)
+    assert json.dumps(turn.to_dict()) == json.dumps(entry)
+    assert dict(turn) == entry
+
+
+def test_identical_choice_lists_are_shared():
+    choices = [{"id": "c1", "text": "Go in"}, {"id": "c2", "text": "Leave"}]
+    first, second = compact_history([
+        {"choice": "A", "choices": choices},
+        {"choice": "B", "choices": [dict(c) for c in choices]},
+    ])
+    assert isinstance(first["choices"], Choices)
+    assert first["choices"] is second["choices"]
@@ -0,0 +1,137 @@
+import sqlite3
+
+import pytest
+
+import serializers
+from session_store import SQLiteSessionStore
+
+
+def turn(n):
+    return {"choice": f"Choice {n}", "choices": [{"id": "choice1", "text": f"Next {n}"}]}
+
+
+def state_after(turns, **fields):
+    return dict({"current_text": f"Scene {turns}", "history": [turn(n) for n in range(turns)]}, **fields)
+
+
+def rows(path, table):
+    with sqlite3.connect(path) as conn:
+        return conn.execute(f"SELECT * FROM {table}").fetchall()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "saves.db")
+
+
+def test_turns_are_journaled_as_deltas(db_path):
+    store = SQLiteSessionStore(db_path, serializer=serializers.get_serializer("json"))
+    state = state_after(1)
+    store.save("s", state)
+    for n in range(1, 4):
+        state["history"].append(turn(n))
+        state["current_text"] = f"Scene {n + 1}"
+        store.save("s", state)
+    store.close()
+
+    assert len(rows(db_path, "sessions")) == 1
+    journal = rows(db_path, "journal")
+    assert [row[1] for row in journal] == [2, 3, 4]
+    # Each record holds only the new turn and the changed scene text
+    record = serializers.loads(journal[-1][3])
+    assert record == {"add": [turn(3)], "set": {"current_text": "Scene 4"}}
+
+
+def test_fresh_store_replays_snapshot_and_journal(db_path):
+    store = SQLiteSessionStore(db_path)
+    state = state_after(0, story_meta={"genre": "fantasy"})
+    for n in range(5):
+        state["history"].append(turn(n))
+        state["current_text"] = f"Scene {n + 1}"
+        store.save("s", state)
+    del state["story_meta"]
+    store.save("s", state)
+    # No close(): as if the process died right after its last commit
+    loaded = SQLiteSessionStore(db_path).load("s")
+    assert loaded["current_text"] == "Scene 5"
+    assert [dict(entry) for entry in loaded["history"]] == [turn(n) for n in range(5)]
+    assert "story_meta" not in loaded
+
+
+def test_bounded_history_is_replayed(db_path):
+    store = SQLiteSessionStore(db_path)
+    history = []
+    for n in range(8):
+        history.append(turn(n))
+        del history[:-3]  # Keep the last three turns, as a bounded history does
+        store.save("s", {"current_text": f"Scene {n}", "history": history})
+    loaded = SQLiteSessionStore(db_path).load("s")
+    assert [dict(entry) for entry in loaded["history"]] == [turn(n) for n in range(5, 8)]
+
+
+def test_journal_is_compacted_into_a_snapshot(db_path):
+    store = SQLiteSessionStore(db_path, compact_every=3)
+    state = state_after(0)
+    for n in range(7):
+        state["history"].append(turn(n))
+        store.save("s", state)
+    # Saves 1 and 4 and 7 write snapshots; the journal holds nothing older than the last one
+    assert rows(db_path, "journal") == []
+    assert rows(db_path, "sessions")[0][4] == 7
+    assert len(store.load("s")["history"]) == 7
+
+
+def test_uncommitted_write_leaves_the_last_save(db_path):
+    store = SQLiteSessionStore(db_path)
+    store.save("s", state_after(2))
+    store.close()
+
+    # A writer that dies mid-transaction: its journal record is never committed
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute(
+        "INSERT INTO journal (session_id, seq, saved_at, record) VALUES ('s', 2, 'now', ?)",
+        (serializers.get_serializer("json").dumps({"add": [turn(2)]}),),
+    )
+    conn.close()
+
+    loaded = SQLiteSessionStore(db_path).load("s")
+    assert len(loaded["history"]) == 2
+
+
+def test_failed_save_rolls_back_and_next_save_is_complete(db_path):
+    class FailingSerializer(serializers.JSONSerializer):
+        fail = False
+
+        def dumps(self, value):
+            if self.fail:
+                raise OSError("disk full")
+            return super().dumps(value)
+
+    serializer = FailingSerializer()
+    store = SQLiteSessionStore(db_path, serializer=serializer)
+    state = state_after(1)
+    store.save("s", state)
+    state["history"].append(turn(1))
+    serializer.fail = True
+    with pytest.raises(OSError):
+        store.save("s", state)
+    assert len(SQLiteSessionStore(db_path).load("s")["history"]) == 1
+
+    serializer.fail = False
+    state["history"].append(turn(2))
+    store.save("s", state)
+    assert len(SQLiteSessionStore(db_path).load("s")["history"]) == 3
+
+
+def test_other_writer_forces_a_snapshot(db_path):
+    first = SQLiteSessionStore(db_path)
+    second = SQLiteSessionStore(db_path)
+    state = state_after(1)
+    first.save("s", state)
+    second.save("s", state_after(4))
+    # first's delta base is stale, so it must not append on top of second's save
+    state["history"].append(turn(1))
+    first.save("s", state)
+    loaded = SQLiteSessionStore(db_path).load("s")
+    assert [dict(entry) for entry in loaded["history"]] == [turn(0), turn(1)]
@@ -0,0 +1,101 @@
+import pytest
+
+from similarity_index import SimilarityIndex
+from story_data import STORY_TREE
+
+START = STORY_TREE["nodes"]["start"]
+OFFERED = [choice["text"] for choice in START["choices"]]
+
+
+def scene(text):
+    return {"text": text, "choices": [{"id": "c1", "text": "Go on"}, {"id": "c2", "text": "Stop"}]}
+
+
+@pytest.fixture
+def index():
+    index = SimilarityIndex()
+    for choice in ("Open the chest", "Open the door", "Follow the footprints", "Search the shelves"):
+        index.add("The cellar.", choice, scene(f"After: {choice}"))
+    for choice in OFFERED:
+        index.add(START["text"], choice, scene(f"After: {choice}"))
+    return index
+
+
+@pytest.mark.parametrize("query", [
+    "I open the chest.",
+    "open the chest!",
+    "Let's open the chest",
+    "Open  chest",
+    "Carefully open the chest",
+])
+def test_rewordings_reuse_the_scene(index, query):
+    node, score = index.find("The cellar.", query)
+    assert node["text"] == "After: Open the chest"
+    assert score >= 0.8
+
+
+@pytest.mark.parametrize("query, choice", [
+    ("Inspect the throne", "Approach and inspect the damaged throne"),
+    ("Examine the damaged throne", "Approach and inspect the damaged throne"),
+    ("Look at the throne", "Approach and inspect the damaged throne"),
+    ("Interrogate the guard", "Question the lone guard in the corner"),
+    ("Study the tapestries", "Examine the ancient tapestries"),
+    ("Quietly exit the hall", "Leave the hall quietly"),
+])
+def test_synonyms_and_dropped_modifiers_reuse_the_scene(index, query, choice):
+    node, score = index.find(START["text"], query)
+    assert node["text"] == f"After: {choice}"
+    assert score >= 0.8
+
+
+@pytest.mark.parametrize("query", [
+    "Do not open the chest",
+    "Don’t open the chest",
+    "Smash open the chest",
+    "Smash and open the chest",
+    "Open the chest with the rusty key",
+    "Open the chest and run",
+    "Close the chest",
+])
+def test_different_actions_are_not_reused(index, query):
+    assert index.find("The cellar.", query) is None
+
+
+def test_negated_offered_choice_is_not_reused(index):
+    assert index.find(START["text"], "Refuse to leave the hall quietly", OFFERED) is None
+
+
+def test_contradicting_modifiers_are_not_reused():
+    index = SimilarityIndex()
+    index.add("Hall.", "Open the red door", scene("Red door opened"))
+    index.add("Hall.", "Leave the hall quietly", scene("Hall left"))
+    assert index.find("Hall.", "Open the blue door") is None
+    assert index.find("Hall.", "Leave the hall loudly") is None
+
+
+def test_offered_choice_never_matches_a_sibling():
+    index = SimilarityIndex()
+    index.add("Hall.", "Open the door", scene("Door opened"))
+    assert index.find("Hall.", "Open the red door") is not None
+    # The same wording is one of the scene's own choices: it is an alternative, not a rewording
+    assert index.find("Hall.", "Open the red door", ["Open the door", "Open the red door"]) is None
+    assert index.find("Hall.", "Open the door", ["Open the door", "Open the red door"]) is not None
+
+
+def test_other_scenes_are_never_matched(index):
+    assert index.find("The attic.", "Open the chest") is None
+
+
+def test_similar_hits_are_not_written_to_the_graph(backend, tmp_path, monkeypatch):
+    from story_graph import StoryGraph
+
+    graph = StoryGraph(str(tmp_path / "graph"))
+    monkeypatch.setattr(backend, "_graph", graph)
+    monkeypatch.setattr(backend, "_similar", SimilarityIndex())
+    backend.store_scene("key", "The cellar.", "Open the chest", scene("Chest opened"))
+
+    node = backend.lookup_scene("other-key", "The cellar.", "I open the chest.")
+    assert node["text"] == "Chest opened"
+    assert graph.child("The cellar.", "I open the chest.") is None
+    assert backend.get_cache().get("other-key") is None
+    graph.close()
@@ -0,0 +1,215 @@
+import os
+
+import pytest
+
+from story_graph import INDEX_ENTRY, INDEX_HEADER, StoryGraph, compile_tree
+
+
+def campaign(size):
+    """An authored tree where node i offers choices leading to nodes 2i+1 and 2i+2"""
+    nodes = {}
+    for i in range(size):
+        nodes[f"n{i}"] = {
+            "text": f"Scene number {i}.",
+            "choices": [
+                {"id": f"c{i}_{j}", "text": f"Take path {2 * i + j}", "next": f"n{2 * i + j}"}
+                for j in (1, 2) if 2 * i + j < size
+            ],
+        }
+    return {"nodes": nodes}
+
+
+@pytest.fixture
+def graph_path(tmp_path):
+    return str(tmp_path / "graph")
+
+
+def test_compiled_graph_is_served_from_the_sorted_index(graph_path):
+    compile_tree(campaign(1000), graph_path)
+    graph = StoryGraph(graph_path)
+    assert graph._recent == {}  # Everything comes from the mmap'd index
+    assert len(graph) == 1000
+
+    assert graph.get("n0")["text"] == "Scene number 0."
+    assert graph.find("Scene number 517.")["id"] == "n517"
+    assert graph.child("Scene number 10.", "Take path 22")["id"] == "n22"
+    assert graph.get("n1000") is None
+    assert graph.find("Scene number 1000.") is None
+    assert graph.child("Scene number 10.", "Take path 23") is None
+    graph.close()
+
+
+def test_index_entries_are_sorted_and_cover_every_key(graph_path):
+    compile_tree(campaign(300), graph_path)
+    with open(graph_path + ".idx", "rb") as f:
+        data = f.read()
+    _, covered, count, nodes = INDEX_HEADER.unpack_from(data, 0)
+    keys = [INDEX_ENTRY.unpack_from(data, INDEX_HEADER.size + i * INDEX_ENTRY.size)[0] for i in range(count)]
+    assert keys == sorted(keys)
+    assert len(set(keys)) == count
+    # An id and a text key per node, plus one edge key for every node but the root
+    assert count == 300 * 2 + 299
+    assert nodes == 300
+    assert covered == os.path.getsize(graph_path + ".dat")
+
+
+def test_lookups_ignore_whitespace(graph_path):
+    graph = StoryGraph(graph_path)
+    graph.add({"text": "A  dark\nroom.", "choices": []}, "The  hall.", "Go   in")
+    graph.flush()
+    assert graph.find("A dark room.")["text"] == "A  dark\nroom."
+    assert graph.child("The hall.", " Go in ")["text"] == "A  dark\nroom."
+    graph.close()
+
+
+def test_first_child_of_an_edge_is_kept(graph_path):
+    graph = StoryGraph(graph_path)
+    graph.add({"text": "First."}, "Start.", "Open")
+    graph.add({"text": "Second."}, "Start.", "Open")
+    assert graph.child("Start.", "Open")["text"] == "First."
+    assert len(graph) == 1
+    graph.close()
+
+
+def test_unflushed_nodes_are_reindexed_on_open(graph_path):
+    graph = StoryGraph(graph_path, flush_every=10)
+    for i in range(15):
+        graph.add({"text": f"Generated {i}."}, "Start.", f"Choice {i}")
+    # The process dies: the last 5 records were never merged into the index file
+    graph._data.flush()
+
+    reopened = StoryGraph(graph_path)
+    assert len(reopened._recent) > 0
+    assert len(reopened) == 15
+    for i in (0, 9, 10, 14):
+        assert reopened.child("Start.", f"Choice {i}")["text"] == f"Generated {i}."
+    reopened.close()
+
+
+def test_torn_final_record_is_dropped(graph_path):
+    graph = StoryGraph(graph_path)
+    graph.add({"text": "Kept."}, "Start.", "Stay")
+    graph.close()
+    size = os.path.getsize(graph_path + ".dat")
+    with open(graph_path + ".dat", "ab") as f:
+        f.write(b"\xff\x00\x00\x00{\"id\":")  # Length prefix promising more than was written
+
+    graph = StoryGraph(graph_path)
+    assert os.path.getsize(graph_path + ".dat") == size
+    assert graph.child("Start.", "Stay")["text"] == "Kept."
+    graph.add({"text": "Appended."}, "Start.", "Go")
+    graph.close()
+    assert StoryGraph(graph_path).child("Start.", "Go")["text"] == "Appended."
+
+
+def test_damaged_index_is_rebuilt_from_the_data_file(graph_path, capsys):
+    compile_tree(campaign(50), graph_path)
+    with open(graph_path + ".idx", "r+b") as f:
+        f.write(b"garbage!")
+    graph = StoryGraph(graph_path)
+    assert "damaged" in capsys.readouterr().out
+    assert graph.get("n49")["text"] == "Scene number 49."
+    assert len(graph) == 50
+    graph.close()
+
+
+def test_writers_sharing_a_path_keep_each_others_edges(graph_path):
+    a = StoryGraph(graph_path)
+    b = StoryGraph(graph_path)
+    a.add({"text": "A1."}, "Start.", "Go A1")
+    a.flush()
+    b.add({"text": "B1."}, "Start.", "Go B1")
+    b.flush()
+    a.add({"text": "A2."}, "Start.", "Go A2")
+    a.flush()
+    # Each sees the other's nodes without reopening
+    assert a.child("Start.", "Go B1")["text"] == "B1."
+    assert b.child("Start.", "Go A2")["text"] == "A2."
+    a.close()
+    b.close()
+
+    reopened = StoryGraph(graph_path)
+    assert [reopened.child("Start.", f"Go {name}") is not None for name in ("A1", "B1", "A2")] == [True, True, True]
+    assert len(reopened) == 3
+    reopened.close()
+
+
+def test_first_child_wins_across_writers(graph_path):
+    a = StoryGraph(graph_path)
+    b = StoryGraph(graph_path)
+    a.add({"text": "From A."}, "Start.", "Open")
+    b.add({"text": "From B."}, "Start.", "Open")
+    assert b.child("Start.", "Open")["text"] == "From A."
+    a.close()
+    b.close()
+    assert len(StoryGraph(graph_path)) == 1
+
+
+def _write_edges(path, writer, count):
+    graph = StoryGraph(path, flush_every=7)
+    for i in range(count):
+        graph.add({"text": f"Scene {writer}-{i}."}, "Start.", f"Choice {writer}-{i}")
+    graph.close()
+
+
+def test_concurrent_processes_lose_no_records(graph_path):
+    import multiprocessing
+
+    processes = [multiprocessing.Process(target=_write_edges, args=(graph_path, w, 40)) for w in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+
+    graph = StoryGraph(graph_path)
+    assert len(graph) == 160
+    assert all(graph.child("Start.", f"Choice {w}-{i}") is not None for w in range(4) for i in range(40))
+    with open(graph_path + ".idx", "rb") as f:
+        _, covered, count, nodes = INDEX_HEADER.unpack_from(f.read(INDEX_HEADER.size), 0)
+    assert (count, nodes) == (160 * 3, 160)
+    assert covered == os.path.getsize(graph_path + ".dat")
+    graph.close()
+
+
+def test_generated_branches_are_found_only_in_their_context(graph_path):
+    graph = StoryGraph(graph_path)
+    graph.add({"text": "Authored."}, "Start.", "Open")
+    graph.add({"text": "For story A."}, "Start.", "Look", "story-a")
+    graph.add({"text": "For story B."}, "Start.", "Look", "story-b")
+    graph.close()
+
+    graph = StoryGraph(graph_path)
+    assert graph.child("Start.", "Open")["text"] == "Authored."
+    assert graph.child("Start.", "Open", "story-a") is None
+    assert graph.child("Start.", "Look") is None
+    assert graph.child("Start.", "Look", "story-a")["text"] == "For story A."
+    assert graph.child("Start.", "Look", "story-b")["text"] == "For story B."
+    graph.close()
+
+
+def test_players_with_different_stories_get_their_own_scenes(backend, stub_ollama, tmp_path, monkeypatch):
+    from story_data import STORY_TREE
+    from story_memory import StoryMemory, record_turn
+
+    graph = StoryGraph(str(tmp_path / "graph"))
+    graph.add_tree(STORY_TREE)
+    monkeypatch.setattr(backend, "_graph", graph)
+    start = STORY_TREE["nodes"]["start"]
+
+    def play(first_choice):
+        """Take `first_choice` at the start, then the same second choice"""
+        history, memory = [], StoryMemory()
+        node = backend.generate_next_node_ollama(start["text"], first_choice, history, memory=memory)
+        record_turn(history, memory, first_choice, node)
+        return backend.generate_next_node_ollama(node["text"], "Open the door", history, memory=memory)
+
+    first, second = start["choices"][0]["text"], start["choices"][1]["text"]
+    play(first)
+    generated = len(stub_ollama.requests)
+    play(second)
+    # Same scene text and choice, but a different story so far: generated again
+    assert len(stub_ollama.requests) == generated + 2
+    play(first)
+    assert len(stub_ollama.requests) == generated + 2
+    graph.close()
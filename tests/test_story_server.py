@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+from story_server import StoryServer
+
+SCENE = {"text": "The door opens.", "choices": [{"id": "choice1", "text": "Go in"}, {"id": "choice2", "text": "Leave"}]}
+
+
+def generate(current_text, choice_text, history, story_meta=None, memory=None):
+    return SCENE
+
+
+def exchange(lines):
+    """Send request lines over one connection and return the decoded replies"""
+    async def run():
+        server = StoryServer(backends={"stub": generate}, persist=False, max_wait=0)
+        listener = await asyncio.start_server(server.handle_connection, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        replies = []
+        for line in lines:
+            writer.write(line.encode("utf-8") + b"\n")
+            await writer.drain()
+            replies.append(json.loads(await asyncio.wait_for(reader.readline(), 5)))
+        writer.close()
+        listener.close()
+        return replies
+
+    return asyncio.run(run())
+
+
+def test_new_and_choose():
+    new, chosen, state = exchange([
+        '{"op": "new", "session_id": "s"}',
+        '{"op": "choose", "session_id": "s", "choice": 1}',
+        '{"op": "state", "session_id": "s"}',
+    ])
+    assert new["session_id"] == "s"
+    assert chosen == {"text": SCENE["text"], "choices": SCENE["choices"]}
+    assert state["turns"] == 1
+
+
+def test_malformed_requests_get_plain_errors_and_keep_the_connection():
+    replies = exchange([
+        'not json',
+        '[1, 2]',
+        '{"op": "choose", "session_id": "s"}',
+        '{"op": "choose", "session_id": "nope", "choice": 1}',
+        '{"op": "state", "session_id": ["unhashable"]}',
+        '{"op": "fly"}',
+        '{"op": "new", "session_id": "s"}',
+        '{"op": "choose", "session_id": "s", "choice": 9}',
+    ])
+    errors = [reply.get("error") for reply in replies]
+    assert errors[0].startswith("Expecting value")
+    assert errors[1] == "Request must be a JSON object"
+    assert errors[2] == "Missing field: choice"
+    assert errors[3] == "Unknown session: nope"
+    assert errors[4].startswith("Request failed:")
+    assert errors[5] == "Unknown op: fly"
+    assert replies[6]["session_id"] == "s"
+    assert errors[7] == "Invalid choice: 9"
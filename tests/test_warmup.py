@@ -0,0 +1,105 @@
+import time
+
+from ollama_client import OllamaClient
+from warmup import COLD, RESIDENT, UNKNOWN, WarmupManager, label
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_start_preloads_the_model_in_the_background(stub_ollama):
+    client = OllamaClient("stub-model", host=stub_ollama.host)
+    warmed = []
+    manager = WarmupManager([client], on_warm=warmed.append)
+    assert manager.state(label(client)) == UNKNOWN
+    manager.start()
+    wait_for(lambda: manager.state(label(client)) == RESIDENT)
+    manager.stop()
+
+    # A load is a generate request without a prompt, keeping the model resident
+    load = stub_ollama.requests[0]
+    assert "prompt" not in load
+    assert load["model"] == "stub-model"
+    assert "keep_alive" in load
+    assert warmed == [client]
+    client.close()
+
+
+def test_active_players_keep_the_model_pinged(stub_ollama):
+    client = OllamaClient("stub-model", host=stub_ollama.host)
+    manager = WarmupManager([client], ping_interval=0.05, active_window=60)
+    manager.start()
+    wait_for(lambda: len(stub_ollama.requests) >= 3)
+    manager.stop()
+    # Every ping rides the same pooled keep-alive connection
+    assert stub_ollama.connections == 1
+    client.close()
+
+
+def test_quiet_period_stops_pings_until_touch(stub_ollama):
+    client = OllamaClient("stub-model", host=stub_ollama.host)
+    manager = WarmupManager([client], ping_interval=0.05, active_window=0)
+    manager._last_activity -= 1  # Nobody has played for a while
+    manager.start()
+    wait_for(lambda: manager.state(label(client)) == RESIDENT)
+    time.sleep(0.2)
+    assert len(stub_ollama.requests) == 1
+
+    manager.active_window = 60
+    manager.touch()
+    wait_for(lambda: len(stub_ollama.requests) >= 2)
+    manager.stop()
+    client.close()
+
+
+def test_refresh_reports_an_unloaded_model_as_cold(stub_ollama):
+    client = OllamaClient("stub-model", host=stub_ollama.host)
+    manager = WarmupManager([client])
+    manager.warm()
+    manager.refresh()
+    assert manager.state(label(client)) == RESIDENT
+
+    stub_ollama.loaded.clear()  # Ollama's keep_alive ran out
+    manager.refresh()
+    assert manager.state() == {label(client): COLD}
+    client.close()
+
+
+def test_failed_load_marks_the_model_cold(stub_ollama, capsys):
+    stub_ollama.fail = True
+    client = OllamaClient("stub-model", host=stub_ollama.host)
+    manager = WarmupManager([client])
+    manager.warm()
+    assert manager.state(label(client)) == COLD
+    assert "Could not preload stub-model" in capsys.readouterr().out
+
+    # Warned once; a model that stays cold is retried quietly
+    manager.warm()
+    assert capsys.readouterr().out == ""
+    stub_ollama.fail = False
+    manager.warm()
+    assert manager.state(label(client)) == RESIDENT
+    client.close()
+
+
+def test_unreachable_server_is_unknown(stub_ollama):
+    client = OllamaClient("stub-model", host=stub_ollama.host)
+    stub_ollama.shutdown()
+    stub_ollama.server_close()
+    manager = WarmupManager([client])
+    manager.refresh()
+    assert manager.state(label(client)) == UNKNOWN
+
+
+def test_clients_without_load_are_left_alone():
+    class Double:
+        model = "double"
+
+    manager = WarmupManager([Double()])
+    manager.warm()
+    manager.refresh()
+    assert manager.state() == {"double": UNKNOWN}
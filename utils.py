@@ -1,63 +1,98 @@
-import json
+import atexit
 import os
 from datetime import datetime
-import shutil
+import metrics
+import serializers
 
+SAVE_DB = os.environ.get("STORY_SAVE_DB", "saves.db")
+DEFAULT_SESSION = "default"
+
+# Legacy single-file saves, only read when migrating into the session store
 SAVE_FILE = "save.json"
 BACKUP_DIR = "saves_backup"
 
-def save_game(state):
-    """Save game with backup and error handling"""
+_store = None
+_saver = None
+
+def get_store():
+    """Shared session store, opened on first use"""
+    global _store
+    if _store is None:
+        from session_store import SQLiteSessionStore
+        _store = SQLiteSessionStore(SAVE_DB)
+    return _store
+
+def get_saver():
+    """Shared background save writer, flushed when the process exits"""
+    global _saver
+    if _saver is None:
+        from save_writer import SaveWriter
+        # Looks the store up per batch, so a replaced _store (e.g. in benchmarks) is honoured
+        _saver = SaveWriter(lambda: get_store())
+        atexit.register(_saver.close)
+    return _saver
+
+def queue_save(session_id, state):
+    """Save a session's game state in the background (auto-save); returns at once"""
     try:
-        # Create backup directory if it doesn't exist
-        os.makedirs(BACKUP_DIR, exist_ok=True)
-        
-        # Create backup of existing save
-        if os.path.exists(SAVE_FILE):
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_file = os.path.join(BACKUP_DIR, f"save_backup_{timestamp}.json")
-            shutil.copy2(SAVE_FILE, backup_file)
-        
-        # Add metadata to save
-        enhanced_state = {
-            "version": "2.0",
-            "saved_at": datetime.now().isoformat(),
-            "game_data": state
-        }
-        
-        # Save with atomic write
-        temp_file = f"{SAVE_FILE}.tmp"
-        with open(temp_file, "w", encoding='utf-8') as f:
-            json.dump(enhanced_state, f, indent=2, ensure_ascii=False)
-        
-        # Atomic rename
-        os.replace(temp_file, SAVE_FILE)
-        
-        # Clean old backups (keep last 5)
-        cleanup_old_backups()
-        
+        get_saver().submit(session_id, state)
         return True
-        
     except Exception as e:
+        metrics.inc("save_failures")
         print(f"Save failed: {e}")
         return False
 
-def load_game():
-    """Load game with better error handling"""
+def save_game(session_id, state):
+    """Save a session's game state and wait until it is written"""
+    saver = get_saver()
+    if not queue_save(session_id, state):
+        return False
+    saver.flush()
+    # The writer has already reported the failure
+    return saver.last_error(session_id) is None
+
+def load_game(session_id=DEFAULT_SESSION):
+    """Load a session's game state, migrating the legacy save.json into the default session"""
+    # A save still waiting for the writer is newer than what the store holds
+    if _saver is not None:
+        state = _saver.pending_state(session_id)
+        if state is not None:
+            return state
+    try:
+        with metrics.span("load"):
+            state = get_store().load(session_id)
+    except Exception as e:
+        metrics.inc("load_failures")
+        print(f"Load failed: {e}")
+        return None
+
+    if state is None and session_id == DEFAULT_SESSION:
+        state = migrate_legacy_save(session_id)
+    return state
+
+def migrate_legacy_save(session_id=DEFAULT_SESSION):
+    """Import save.json (or its newest readable backup) into the session store"""
+    state = load_legacy_save()
+    if state is not None and save_game(session_id, state):
+        print(f"Migrated {SAVE_FILE} into session '{session_id}'")
+    return state
+
+def load_legacy_save():
+    """Read the old single-file save format"""
     if not os.path.exists(SAVE_FILE):
         return None
-    
+
     try:
-        with open(SAVE_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
+        data = serializers.read_file(SAVE_FILE)
+
         # Handle different save formats
         if "version" in data and "game_data" in data:
             return data["game_data"]  # New format
         else:
             return data  # Legacy format
-            
-    except json.JSONDecodeError as e:
+
+    except ValueError as e:
+        # JSON and msgpack decode errors are both ValueErrors
         print(f"Save file corrupted: {e}")
         return try_backup_recovery()
     except Exception as e:
@@ -68,70 +103,42 @@ def try_backup_recovery():
     """Attempt to recover from backup files"""
     if not os.path.exists(BACKUP_DIR):
         return None
-    
+
     backup_files = [f for f in os.listdir(BACKUP_DIR) if f.startswith("save_backup_")]
     if not backup_files:
         return None
-    
+
     # Try most recent backup
     backup_files.sort(reverse=True)
-    
+
     for backup_file in backup_files[:3]:  # Try last 3 backups
         try:
-            backup_path = os.path.join(BACKUP_DIR, backup_file)
-            with open(backup_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
+            data = serializers.read_file(os.path.join(BACKUP_DIR, backup_file))
+
             print(f"Recovered from backup: {backup_file}")
             return data.get("game_data", data)
-            
+
         except Exception:
             continue
-    
-    return None
 
-def cleanup_old_backups(keep_count=5):
-    """Keep only the most recent backup files"""
-    if not os.path.exists(BACKUP_DIR):
-        return
-    
-    backup_files = [f for f in os.listdir(BACKUP_DIR) if f.startswith("save_backup_")]
-    if len(backup_files) <= keep_count:
-        return
-    
-    # Sort by creation time and remove oldest
-    backup_paths = [(f, os.path.getctime(os.path.join(BACKUP_DIR, f))) for f in backup_files]
-    backup_paths.sort(key=lambda x: x[1], reverse=True)
-    
-    for file_name, _ in backup_paths[keep_count:]:
-        try:
-            os.remove(os.path.join(BACKUP_DIR, file_name))
-        except Exception:
-            pass
+    return None
 
-def get_save_info():
-    """Get information about the current save file"""
-    if not os.path.exists(SAVE_FILE):
-        return None
-    
+def get_save_info(session_id=DEFAULT_SESSION):
+    """Get information about a session's save"""
     try:
-        with open(SAVE_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        if "saved_at" in data:
-            return {
-                "saved_at": data["saved_at"],
-                "version": data.get("version", "1.0"),
-                "has_game_data": "game_data" in data
-            }
-        else:
-            # Legacy save file
-            stat = os.stat(SAVE_FILE)
-            return {
-                "saved_at": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                "version": "1.0 (legacy)",
-                "has_game_data": True
-            }
-            
+        info = get_store().info(session_id)
     except Exception:
         return None
+    if info is not None or session_id != DEFAULT_SESSION or not os.path.exists(SAVE_FILE):
+        return info
+
+    # Not migrated yet: describe the legacy save file from its header, without decoding the history
+    try:
+        header = serializers.read_header(SAVE_FILE)
+    except Exception:
+        header = {}
+    return {
+        "saved_at": header.get("saved_at") or datetime.fromtimestamp(os.stat(SAVE_FILE).st_mtime).isoformat(),
+        "version": f"{header.get('version', '1.0')} (legacy)",
+        "has_game_data": True
+    }
@@ -0,0 +1,131 @@
+import threading
+import time
+
+import metrics
+
+PING_INTERVAL = 5 * 60    # Seconds between keep-alive pings; well inside Ollama's keep_alive
+ACTIVE_WINDOW = 30 * 60   # Seconds after the last turn that a session still counts as active
+LOAD_TIMEOUT = 300        # Loading a large model from disk can take minutes
+
+RESIDENT = "resident"
+LOADING = "loading"
+COLD = "cold"
+UNKNOWN = "unknown"
+
+
+def label(client):
+    """How a backend is named in state(): model, plus host when not the local default"""
+    host = getattr(client, "host", None)
+    if host in (None, "localhost", "127.0.0.1") and getattr(client, "port", 11434) == 11434:
+        return client.model
+    return f"{client.model}@{host}:{client.port}"
+
+
+def _tagged(name):
+    """Ollama reports 'llama3' as 'llama3:latest'"""
+    return name if ":" in name else name + ":latest"
+
+
+class WarmupManager:
+    """Preload models in the background and keep them resident while players are active
+
+    start() loads every client's model on a daemon thread, then pings each
+    one every `ping_interval` seconds for as long as touch() has been called
+    within `active_window` seconds. Quiet periods are left alone, so Ollama
+    can still unload the model once nobody is playing. state() reports
+    whether each model is resident, loading or cold, refreshed from
+    /api/ps on every cycle. Clients without load()/running_models() (such
+    as test doubles) are reported as unknown and left alone.
+    """
+
+    def __init__(self, clients, ping_interval=PING_INTERVAL, active_window=ACTIVE_WINDOW, on_warm=None):
+        self.clients = list(clients)
+        self.ping_interval = ping_interval
+        self.active_window = active_window
+        self.on_warm = on_warm
+        self._states = {label(client): UNKNOWN for client in self.clients if hasattr(client, "model")}
+        self._last_activity = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Begin preloading in the background (idempotent)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="model-warmup", daemon=True)
+            self._thread.start()
+
+    def touch(self):
+        """Record player activity; pings resume right away after a quiet period"""
+        idle = self.idle()
+        self._last_activity = time.monotonic()
+        if idle > self.active_window:
+            self._wake.set()
+
+    def idle(self):
+        return time.monotonic() - self._last_activity
+
+    def state(self, name=None):
+        """State of one backend (see label()), or {name: state} for all"""
+        with self._lock:
+            if name is not None:
+                return self._states.get(name, UNKNOWN)
+            return dict(self._states)
+
+    def _set(self, client, state):
+        with self._lock:
+            self._states[label(client)] = state
+
+    def _loop(self):
+        self.warm()
+        while not self._stop.is_set():
+            self._wake.wait(self.ping_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            self.refresh()
+            if self.idle() <= self.active_window:
+                self.warm()
+
+    def warm(self):
+        """Load every model, or refresh the keep_alive of those already resident"""
+        for client in self.clients:
+            if not hasattr(client, "load"):
+                continue
+            previous = self.state(label(client))
+            if previous != RESIDENT:
+                self._set(client, LOADING)
+            started = time.perf_counter()
+            try:
+                client.load(timeout=LOAD_TIMEOUT)
+            except Exception as e:
+                metrics.inc("warmup_failures")
+                if previous != COLD:
+                    print(f"⚠️ Could not preload {client.model}: {e}")
+                self._set(client, COLD)
+                continue
+            metrics.observe("model_warmup", time.perf_counter() - started)
+            metrics.inc("keepalive_pings")
+            self._set(client, RESIDENT)
+            if self.on_warm is not None:
+                self.on_warm(client)
+
+    def refresh(self):
+        """Update model states from the server's list of loaded models"""
+        for client in self.clients:
+            if not hasattr(client, "running_models"):
+                continue
+            try:
+                loaded = {_tagged(name) for name in client.running_models(timeout=5)}
+            except Exception:
+                self._set(client, UNKNOWN)
+                continue
+            if self.state(label(client)) != LOADING:
+                self._set(client, RESIDENT if _tagged(client.model) in loaded else COLD)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()